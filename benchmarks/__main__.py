@@ -0,0 +1,81 @@
+'''Runs the benchmark suite and writes the results as JSON (to compare them across versions), e.g.
+`python -m benchmarks --output bench.json`'''
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import tomllib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from rediswriter.config import PipelineMode, TransformMode
+
+from . import suite
+from .generator import MessageProfile
+from .resp_server import Faults
+
+
+def _benchmarks(args, profile: MessageProfile):
+    yield 'get[PROTO]', suite.bench_get, (profile, args.messages, TransformMode.PROTO)
+    yield 'get[WIRE]', suite.bench_get, (profile, args.messages, TransformMode.WIRE)
+    yield 'remove_frame_data', suite.bench_remove_frame_data, (profile, args.messages)
+    yield 'sender_get_next_batch', suite.bench_sender_get_next_batch, (profile, args.messages, args.streams)
+    faults = Faults(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, stall_probability=args.stall_probability, disconnect_probability=args.disconnect_probability)
+    yield 'sender_network', suite.bench_sender_network, (profile, args.messages, args.streams, faults)
+    for pipeline_mode in PipelineMode:
+        for transform_mode in TransformMode:
+            scenario = suite.EndToEndScenario(pipeline_mode, transform_mode)
+            yield scenario.name, suite.bench_end_to_end, (profile, args.messages, args.streams, scenario, args.rate_hz)
+
+
+def _version() -> str:
+    with open(Path(__file__).parent.parent / 'pyproject.toml', 'rb') as f:
+        return tomllib.load(f)['tool']['poetry']['version']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000, help='Messages per benchmark')
+    parser.add_argument('--streams', type=int, default=4, help='Number of source streams')
+    parser.add_argument('--detections', type=int, default=MessageProfile._field_defaults['detections'], help='Detections per message')
+    parser.add_argument('--jpeg-bytes', type=int, default=MessageProfile._field_defaults['jpeg_bytes'], help='Size of the JPEG frame data per message')
+    parser.add_argument('--raw-frame', action='store_true', help='Add uncompressed frame data to every message')
+    parser.add_argument('--rate-hz', type=float, default=None, help='Total rate at which messages are written in the end-to-end runs (default: as fast as possible)')
+    parser.add_argument('--latency-ms', type=float, default=5, help='Round trip time added by the RESP server in the sender_network run')
+    parser.add_argument('--jitter-ms', type=float, default=1, help='Max. deviation from --latency-ms')
+    parser.add_argument('--stall-probability', type=float, default=0, help='Probability that the RESP server stalls a reply (for 200ms, like a retransmission)')
+    parser.add_argument('--disconnect-probability', type=float, default=0, help='Probability that the RESP server drops the connection instead of replying')
+    parser.add_argument('--only', nargs='*', default=None, help='Only run the benchmarks whose name starts with one of these prefixes')
+    parser.add_argument('--output', default='-', help='Output file (default: stdout)')
+    args = parser.parse_args()
+
+    profile = MessageProfile(jpeg_bytes=args.jpeg_bytes, raw_frame=args.raw_frame, detections=args.detections)
+
+    results = []
+    # Every benchmark runs in a fresh process, so that the peak RSS values are comparable
+    mp_context = multiprocessing.get_context('spawn')
+    for name, benchmark, bench_args in _benchmarks(args, profile):
+        if args.only is not None and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        print(f'Running {name}...', file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+            results.append(executor.submit(benchmark, *bench_args).result()._asdict())
+
+    report = {
+        'version': _version(),
+        'python': platform.python_version(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'parameters': {**vars(args), 'profile': profile._asdict()},
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        Path(args.output).write_text(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import random
+from typing import List, NamedTuple
+
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import SaeMessage
+
+
+class MessageProfile(NamedTuple):
+    '''Shape of the synthetic SaeMessages. The defaults resemble a 1080p camera stream with JPEG frames.'''
+    width: int = 1920
+    height: int = 1080
+    # Size of `frame.frame_data_jpeg` (roughly 1:20 compression of the raw frame)
+    jpeg_bytes: int = 300_000
+    # Also add uncompressed frame data (width * height * 3 bytes)
+    raw_frame: bool = False
+    detections: int = 20
+    feature_dims: int = 0
+
+
+def make_sae_message(rng: random.Random, profile: MessageProfile, source_id: str, timestamp_utc_ms: int) -> bytes:
+    sae_msg = SaeMessage()
+    sae_msg.type = MessageType.SAE
+
+    sae_msg.frame.source_id = source_id
+    sae_msg.frame.timestamp_utc_ms = timestamp_utc_ms
+    sae_msg.frame.shape.width = profile.width
+    sae_msg.frame.shape.height = profile.height
+    sae_msg.frame.shape.channels = 3
+    sae_msg.frame.camera_location.latitude = 52.0 + rng.random()
+    sae_msg.frame.camera_location.longitude = 10.0 + rng.random()
+    # Frame data is incompressible noise, like real JPEG data
+    sae_msg.frame.frame_data_jpeg = rng.randbytes(profile.jpeg_bytes)
+    if profile.raw_frame:
+        sae_msg.frame.frame_data = rng.randbytes(profile.width * profile.height * 3)
+
+    for object_id in range(profile.detections):
+        detection = sae_msg.detections.add()
+        min_x, min_y = rng.random() * 0.9, rng.random() * 0.9
+        detection.bounding_box.min_x = min_x
+        detection.bounding_box.min_y = min_y
+        detection.bounding_box.max_x = min_x + rng.random() * 0.1
+        detection.bounding_box.max_y = min_y + rng.random() * 0.1
+        detection.confidence = 0.3 + rng.random() * 0.7
+        detection.class_id = rng.randrange(80)
+        detection.object_id = object_id.to_bytes(16, 'big')
+        detection.geo_coordinate.latitude = 52.0 + rng.random()
+        detection.geo_coordinate.longitude = 10.0 + rng.random()
+        detection.feature.extend(rng.random() for _ in range(profile.feature_dims))
+
+    sae_msg.metrics.detection_inference_time_us = rng.randrange(5_000, 50_000)
+    return sae_msg.SerializeToString()
+
+
+def make_message_pool(profile: MessageProfile, count: int, seed: int = 0) -> List[bytes]:
+    '''Generates `count` distinct messages. Benchmarks cycle through the pool to bound the memory used for input data.'''
+    rng = random.Random(seed)
+    return [make_sae_message(rng, profile, 'bench', 1_700_000_000_000 + idx * 100) for idx in range(count)]
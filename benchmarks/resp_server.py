@@ -0,0 +1,375 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .standin import InMemoryStreams, _to_bytes
+
+
+class Faults(NamedTuple):
+    '''Network faults injected by `RespServer` (can be replaced while it is running)'''
+    # Added to every reply (i.e. to the round trip time), plus a uniformly distributed deviation of up to +/- `jitter_ms`
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    # Probability per command to hold back its reply (and the ones after it) for `stall_ms` (like a lost packet that has to be retransmitted)
+    stall_probability: float = 0
+    stall_ms: float = 200
+    # Probability per command to close the connection after executing it, but before replying (commands of a pipeline after it are not executed)
+    disconnect_probability: float = 0
+    # Neither execute nor answer anything (like `netem loss 100%`), clients run into their socket timeout
+    blackhole: bool = False
+
+
+class RespProtocolError(Exception):
+    pass
+
+
+class RespParser:
+    '''Incremental parser for client requests (arrays of bulk strings or inline commands)'''
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def feed(self, data: bytes) -> None:
+        self._buffer += data
+
+    def commands(self) -> List[List[bytes]]:
+        '''Returns all complete commands received so far'''
+        commands = []
+        while True:
+            command = self._parse()
+            if command is None:
+                break
+            if len(command) > 0:
+                commands.append(command)
+        del self._buffer[:self._pos]
+        self._pos = 0
+        return commands
+
+    def _line(self, pos: int) -> Optional[Tuple[bytes, int]]:
+        end = self._buffer.find(b'\r\n', pos)
+        if end < 0:
+            return None
+        return bytes(self._buffer[pos:end]), end + 2
+
+    def _parse(self) -> Optional[List[bytes]]:
+        line = self._line(self._pos)
+        if line is None:
+            return None
+        header, pos = line
+        if not header.startswith(b'*'):
+            self._pos = pos
+            return header.split()
+
+        try:
+            args = []
+            for _ in range(int(header[1:])):
+                line = self._line(pos)
+                if line is None:
+                    return None
+                header, pos = line
+                if not header.startswith(b'$'):
+                    raise RespProtocolError(f'Expected a bulk string, got {header!r}')
+                length = int(header[1:])
+                if len(self._buffer) < pos + length + 2:
+                    return None
+                args.append(bytes(self._buffer[pos:pos + length]))
+                pos += length + 2
+        except ValueError as e:
+            raise RespProtocolError('Invalid length') from e
+        self._pos = pos
+        return args
+
+
+class _Reply(bytes):
+    '''An already encoded reply (e.g. a simple string or an error)'''
+
+
+NULL_ARRAY = _Reply(b'*-1\r\n')
+OK = _Reply(b'+OK\r\n')
+
+
+def error(message: str) -> _Reply:
+    return _Reply(f'-ERR {message}\r\n'.encode('utf-8'))
+
+
+def encode(value) -> bytes:
+    if isinstance(value, _Reply):
+        return value
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, (list, tuple)):
+        return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+    value = _to_bytes(value)
+    return b'$%d\r\n' % len(value) + value + b'\r\n'
+
+
+def _encode_entries(entries) -> list:
+    return [[entry_id, [item for field in fields.items() for item in field]] for entry_id, fields in entries]
+
+
+class _Connection:
+    def __init__(self, connection_id: int, writer: asyncio.StreamWriter) -> None:
+        self.id = connection_id
+        self.writer = writer
+        self.created = time.monotonic()
+        self.last_active = self.created
+        self.last_command = b'NULL'
+        self.name = b''
+
+
+class RespServer:
+    '''An in-process RESP2 server for the commands the stage uses (XADD with MAXLEN, XREAD, XREVRANGE, SCAN, PING, CLIENT LIST, pipelines),
+    with the streams kept in `InMemoryStreams`. It runs its own event loop on a background thread and listens on a local TCP port,
+    so that the real (sync or asyncio) client can be used and backoff, batching and throughput can be tested without containers or `tc netem`.
+    `faults` are applied per command. Every connection draws its faults from its own random generator (seeded with `seed` and the connection number),
+    so the n-th command of a connection always gets the same faults, no matter how the data is split into TCP segments.
+    Replies are never reordered and MAXLEN trimming is always approximate.'''
+
+    POLL_INTERVAL_S = 0.001
+
+    def __init__(self, streams: Optional[InMemoryStreams] = None, faults: Faults = Faults(), seed: int = 0, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.streams = streams if streams is not None else InMemoryStreams()
+        self.faults = faults
+        self.host = host
+        self.port = port
+        self.disconnects = 0
+        self._seed = seed
+        self._connections: Dict[int, _Connection] = {}
+        self._next_connection_id = 1
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='resp-server', daemon=True)
+        self._commands: Dict[bytes, Callable] = {
+            b'PING': self._ping,
+            b'CLIENT': self._client,
+            b'XADD': self._xadd,
+            b'XREAD': self._xread,
+            b'XREVRANGE': self._xrevrange,
+            b'XLEN': self._xlen,
+            b'SCAN': self._scan,
+        }
+
+    def start(self) -> 'RespServer':
+        self._thread.start()
+        if not self._ready.wait(10):
+            raise RuntimeError('RESP server did not start')
+        return self
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join(10)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, _, __, ___):
+        self.stop()
+        return False
+
+    def client_count(self) -> int:
+        return len(self._connections)
+
+    def disconnect_all(self) -> None:
+        '''Closes all client connections (like a server restart)'''
+        def _disconnect():
+            for connection in list(self._connections.values()):
+                connection.writer.close()
+        self._loop.call_soon_threadsafe(_disconnect)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+
+    async def _serve(self) -> None:
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with server:
+            await self._stopped.wait()
+            for connection in list(self._connections.values()):
+                connection.writer.close()
+            # Blocked XREADs return once they see the stop
+            while len(self._connections) > 0:
+                await asyncio.sleep(self.POLL_INTERVAL_S)
+
+    @staticmethod
+    def _draw_faults(faults: Faults, rnd: random.Random) -> Tuple[float, bool]:
+        '''Returns the reply delay and whether to disconnect, for one command'''
+        delay_ms = faults.latency_ms
+        if faults.jitter_ms > 0:
+            delay_ms += rnd.uniform(-faults.jitter_ms, faults.jitter_ms)
+        if faults.stall_probability > 0 and rnd.random() < faults.stall_probability:
+            delay_ms += faults.stall_ms
+        disconnect = faults.disconnect_probability > 0 and rnd.random() < faults.disconnect_probability
+        return max(0, delay_ms) / 1000, disconnect
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = _Connection(self._next_connection_id, writer)
+        self._next_connection_id += 1
+        self._connections[connection.id] = connection
+        rnd = random.Random(f'{self._seed}:{connection.id}')
+        replies: asyncio.Queue = asyncio.Queue()
+        sender = asyncio.create_task(self._send_replies(writer, replies))
+        parser = RespParser()
+        # Replies must not overtake each other, even if the jitter would allow it
+        last_due = 0.0
+        try:
+            while True:
+                data = await reader.read(65536)
+                if len(data) == 0:
+                    break
+                faults = self.faults
+                if faults.blackhole:
+                    parser = RespParser()
+                    continue
+                parser.feed(data)
+
+                disconnect = False
+                for command in parser.commands():
+                    delay, disconnect = self._draw_faults(faults, rnd)
+                    reply = encode(await self._execute(connection, command))
+                    if disconnect:
+                        break
+                    last_due = max(last_due, time.monotonic() + delay)
+                    replies.put_nowait((last_due, reply))
+                if disconnect:
+                    self.disconnects += 1
+                    break
+        except (ConnectionError, RespProtocolError) as _:
+            pass
+        finally:
+            sender.cancel()
+            writer.close()
+            del self._connections[connection.id]
+
+    @staticmethod
+    async def _send_replies(writer: asyncio.StreamWriter, replies: asyncio.Queue) -> None:
+        try:
+            while True:
+                due, reply = await replies.get()
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(reply)
+                if replies.empty():
+                    await writer.drain()
+        except ConnectionError as _:
+            pass
+
+    async def _execute(self, connection: _Connection, command: List[bytes]):
+        name = command[0].upper()
+        connection.last_active = time.monotonic()
+        connection.last_command = name.lower()
+        handler = self._commands.get(name)
+        if handler is None:
+            return error(f"unknown command '{command[0].decode('utf-8', 'replace')}'")
+        try:
+            return await handler(connection, command[1:])
+        except (IndexError, ValueError) as _:
+            return error(f"syntax error in '{command[0].decode('utf-8', 'replace')}'")
+
+    async def _ping(self, _, args: List[bytes]):
+        return args[0] if len(args) > 0 else _Reply(b'+PONG\r\n')
+
+    async def _client(self, connection: _Connection, args: List[bytes]):
+        subcommand = args[0].upper()
+        if subcommand == b'LIST':
+            now = time.monotonic()
+            lines = []
+            for other in self._connections.values():
+                peer = other.writer.get_extra_info('peername')
+                lines.append(f'id={other.id} addr={peer[0]}:{peer[1]} name={other.name.decode("utf-8")} '
+                             f'age={int(now - other.created)} idle={int(now - other.last_active)} cmd={other.last_command.decode("utf-8")}')
+            return '\n'.join(lines) + '\n'
+        if subcommand == b'SETNAME':
+            connection.name = args[1]
+            return OK
+        if subcommand == b'SETINFO':
+            return OK
+        return error('unsupported CLIENT subcommand')
+
+    async def _xadd(self, _, args: List[bytes]):
+        key, pos, maxlen = args[0], 1, None
+        while True:
+            option = args[pos].upper()
+            if option == b'NOMKSTREAM':
+                pos += 1
+            elif option == b'MAXLEN':
+                pos += 1
+                if args[pos] in (b'=', b'~'):
+                    pos += 1
+                maxlen = int(args[pos])
+                pos += 1
+                if args[pos].upper() == b'LIMIT':
+                    pos += 2
+            else:
+                break
+        if args[pos] != b'*':
+            return error('only auto-generated ids are supported')
+        pairs = args[pos + 1:]
+        if len(pairs) == 0 or len(pairs) % 2 != 0:
+            return error("wrong number of arguments for 'xadd' command")
+        return self.streams.xadd(key, dict(zip(pairs[::2], pairs[1::2])), maxlen)
+
+    async def _xread(self, _, args: List[bytes]):
+        count, block, pos = None, None, 0
+        while args[pos].upper() != b'STREAMS':
+            option = args[pos].upper()
+            if option == b'COUNT':
+                count = int(args[pos + 1])
+            elif option == b'BLOCK':
+                block = int(args[pos + 1])
+            else:
+                return error('syntax error')
+            pos += 2
+        keys_and_ids = args[pos + 1:]
+        if len(keys_and_ids) == 0 or len(keys_and_ids) % 2 != 0:
+            return error("Unbalanced 'xread' list of streams")
+        half = len(keys_and_ids) // 2
+        streams = {}
+        for key, last_id in zip(keys_and_ids[:half], keys_and_ids[half:]):
+            if last_id == b'$':
+                last_entries = self.streams.xrevrange(key, count=1)
+                last_id = last_entries[0][0] if len(last_entries) > 0 else b'0-0'
+            streams[key] = last_id
+
+        # BLOCK 0 waits forever
+        deadline = time.monotonic() + block / 1000 if block else None
+        while True:
+            result = self.streams.xread(streams, count)
+            if len(result) > 0:
+                return [[key, _encode_entries(entries)] for key, entries in result]
+            if block is None or self._stopped.is_set() or (deadline is not None and time.monotonic() >= deadline):
+                return NULL_ARRAY
+            await asyncio.sleep(self.POLL_INTERVAL_S)
+
+    async def _xrevrange(self, _, args: List[bytes]):
+        if args[1] != b'+' or args[2] != b'-':
+            return error('only the full range (+ -) is supported')
+        count = int(args[4]) if len(args) > 4 and args[3].upper() == b'COUNT' else None
+        return _encode_entries(self.streams.xrevrange(args[0], count=count))
+
+    async def _xlen(self, _, args: List[bytes]):
+        return len(self.streams.xrevrange(args[0]))
+
+    async def _scan(self, _, args: List[bytes]):
+        # Everything is returned at once, i.e. the cursor is always 0
+        match, stream_type = None, None
+        for option, value in zip(args[1::2], args[2::2]):
+            if option.upper() == b'MATCH':
+                match = value.decode('utf-8')
+            elif option.upper() == b'TYPE':
+                stream_type = value.lower()
+        keys = self.streams.keys(match) if stream_type in (None, b'stream') else []
+        return [b'0', keys]
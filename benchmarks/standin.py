@@ -0,0 +1,192 @@
+import asyncio
+import re
+import threading
+import time
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from rediswriter.mapping import glob_to_regex
+
+
+def _to_bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+def _id_seq(entry_id) -> int:
+    return int(_to_bytes(entry_id).split(b'-')[0])
+
+
+class _Stream:
+    def __init__(self) -> None:
+        self.seqs: List[int] = []
+        self.entries: List[Tuple[bytes, Dict[bytes, bytes]]] = []
+
+
+class InMemoryStreams:
+    '''Stream storage of one stand-in server. Implements the subset of stream commands used by the stage.
+    Every added entry is timestamped (see `arrivals` per stream and `entry_arrivals` per entry id, which are kept when entries are trimmed),
+    which the benchmarks use to measure latency.'''
+
+    def __init__(self) -> None:
+        self._changed = threading.Condition()
+        self._streams: Dict[bytes, _Stream] = {}
+        self._seq = 0
+        self.arrivals: Dict[bytes, List[float]] = {}
+        self.entry_arrivals: Dict[bytes, float] = {}
+        self.received_bytes = 0
+        self.reader_connected = threading.Event()
+
+    def xadd(self, name, fields: Dict, maxlen: Optional[int] = None) -> bytes:
+        name = _to_bytes(name)
+        fields = {_to_bytes(key): _to_bytes(value) for key, value in fields.items()}
+        now = time.perf_counter()
+        with self._changed:
+            self._seq += 1
+            entry_id = f'{self._seq}-0'.encode('utf-8')
+            stream = self._streams.setdefault(name, _Stream())
+            stream.seqs.append(self._seq)
+            stream.entries.append((entry_id, fields))
+            # Trim like `MAXLEN ~` does, i.e. not on every add
+            if maxlen is not None and len(stream.entries) > 2 * maxlen:
+                del stream.seqs[:-maxlen]
+                del stream.entries[:-maxlen]
+            self.arrivals.setdefault(name, []).append(now)
+            self.entry_arrivals[entry_id] = now
+            self.received_bytes += sum(len(key) + len(value) for key, value in fields.items())
+            self._changed.notify_all()
+        return entry_id
+
+    def xrevrange(self, name, count: Optional[int] = None):
+        with self._changed:
+            stream = self._streams.get(_to_bytes(name))
+            if stream is None:
+                return []
+            entries = stream.entries[::-1]
+            return entries[:count] if count is not None else entries
+
+    def xread(self, streams: Dict, count: Optional[int] = None, block: Optional[int] = None):
+        self.reader_connected.set()
+        deadline = time.monotonic() + (block or 0) / 1000
+        with self._changed:
+            while True:
+                result = self._read(streams, count)
+                remaining = deadline - time.monotonic()
+                if len(result) > 0 or block is None or remaining <= 0:
+                    return result
+                self._changed.wait(remaining)
+
+    def _read(self, streams: Dict, count: Optional[int]):
+        result = []
+        for name, last_id in streams.items():
+            stream = self._streams.get(_to_bytes(name))
+            if stream is None:
+                continue
+            start = bisect_right(stream.seqs, _id_seq(last_id))
+            end = len(stream.entries) if count is None else start + count
+            entries = stream.entries[start:end]
+            if len(entries) > 0:
+                result.append([_to_bytes(name), entries])
+        return result
+
+    def keys(self, match: Optional[str] = None) -> List[bytes]:
+        with self._changed:
+            names = list(self._streams.keys())
+        if match is None:
+            return names
+        # Same glob semantics as SCAN MATCH
+        regex = re.compile(glob_to_regex(match), re.DOTALL)
+        return [name for name in names if regex.fullmatch(name.decode('utf-8'))]
+
+    def message_count(self) -> int:
+        with self._changed:
+            return sum(len(arrivals) for arrivals in self.arrivals.values())
+
+
+class StandInPipeline:
+    def __init__(self, streams: InMemoryStreams) -> None:
+        self._streams = streams
+        self._commands = []
+
+    def xadd(self, name, fields, maxlen=None):
+        self._commands.append((name, fields, maxlen))
+        return self
+
+    def _execute(self):
+        commands, self._commands = self._commands, []
+        return [self._streams.xadd(name, fields, maxlen) for name, fields, maxlen in commands]
+
+    def execute(self):
+        return self._execute()
+
+
+class StandInClient:
+    '''Replaces `valkey.Valkey` (only the commands the stage uses)'''
+
+    def __init__(self, streams: InMemoryStreams) -> None:
+        self._streams = streams
+
+    def xread(self, streams, count=None, block=None):
+        return self._streams.xread(streams, count, block)
+
+    def xrevrange(self, name, max='+', min='-', count=None):
+        return self._streams.xrevrange(name, count)
+
+    def scan_iter(self, match=None, count=None, _type=None):
+        return iter(self._streams.keys(match))
+
+    def pipeline(self, transaction=True):
+        return StandInPipeline(self._streams)
+
+    def close(self):
+        pass
+
+
+class AsyncStandInPipeline(StandInPipeline):
+    async def execute(self):
+        return self._execute()
+
+
+class AsyncStandInClient:
+    '''Replaces `valkey.asyncio.Valkey`. Blocking reads poll, so that the event loop is never blocked.'''
+
+    POLL_INTERVAL_S = 0.0005
+
+    def __init__(self, streams: InMemoryStreams) -> None:
+        self._streams = streams
+
+    async def xread(self, streams, count=None, block=None):
+        deadline = time.monotonic() + (block or 0) / 1000
+        while True:
+            result = self._streams.xread(streams, count)
+            if len(result) > 0 or block is None or time.monotonic() >= deadline:
+                return result
+            await asyncio.sleep(self.POLL_INTERVAL_S)
+
+    async def xrevrange(self, name, max='+', min='-', count=None):
+        return self._streams.xrevrange(name, count)
+
+    async def scan_iter(self, match=None, count=None, _type=None):
+        for name in self._streams.keys(match):
+            yield name
+
+    def pipeline(self, transaction=True):
+        return AsyncStandInPipeline(self._streams)
+
+    async def aclose(self):
+        pass
+
+
+class StandIn:
+    '''A set of in-process stand-in servers, addressed by host name.
+    `client` and `async_client` can be patched in for `valkey.Valkey` and `valkey.asyncio.Valkey`.'''
+
+    def __init__(self, *hosts: str) -> None:
+        self.servers = {host: InMemoryStreams() for host in hosts}
+
+    def client(self, host: str, port: int = 6379, **_) -> StandInClient:
+        return StandInClient(self.servers[host])
+
+    def async_client(self, host: str, port: int = 6379, **_) -> AsyncStandInClient:
+        return AsyncStandInClient(self.servers[host])
@@ -0,0 +1,256 @@
+import base64
+import itertools
+import os
+import resource
+import signal
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY
+from visionapi.sae_pb2 import SaeMessage
+
+from rediswriter.config import (MappingConfig, PipelineMode, RedisConfig,
+                                RedisWriterConfig, TargetRedisConfig,
+                                TransformMode)
+from rediswriter.publisher import PAYLOAD_FIELD
+from rediswriter.rediswriter import RedisWriter
+from rediswriter.sender import Sender, SenderWorker
+
+from .generator import MessageProfile, make_message_pool
+from .resp_server import Faults, RespServer
+from .standin import InMemoryStreams, StandIn
+
+POOL_SIZE = 50
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    messages: int
+    duration_s: float
+    msgs_per_s: float
+    # Input bytes processed per second
+    bytes_per_s: float
+    latency_p50_ms: float
+    latency_p99_ms: float
+    # Peak resident set size of the (benchmark) process
+    peak_rss_kb: int
+    # Benchmark specific values
+    extra: Dict[str, float]
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    '''Nearest-rank percentile of an already sorted sequence'''
+    if len(sorted_values) == 0:
+        return float('nan')
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_kb() -> int:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def make_result(name: str, latencies_s: List[float], duration_s: float, input_bytes: int, **extra) -> BenchmarkResult:
+    latencies_s = sorted(latencies_s)
+    return BenchmarkResult(
+        name=name,
+        messages=len(latencies_s),
+        duration_s=duration_s,
+        msgs_per_s=len(latencies_s) / duration_s if duration_s > 0 else float('nan'),
+        bytes_per_s=input_bytes / duration_s if duration_s > 0 else float('nan'),
+        latency_p50_ms=percentile(latencies_s, 50) * 1000,
+        latency_p99_ms=percentile(latencies_s, 99) * 1000,
+        peak_rss_kb=peak_rss_kb(),
+        extra=extra,
+    )
+
+
+def _time_calls(name: str, inputs: Sequence, fn: Callable, count: int) -> BenchmarkResult:
+    latencies = []
+    input_bytes = 0
+    start = time.perf_counter()
+    for _, (payload, arg) in zip(range(count), itertools.cycle(inputs)):
+        call_start = time.perf_counter()
+        fn(arg)
+        latencies.append(time.perf_counter() - call_start)
+        input_bytes += len(payload)
+    return make_result(name, latencies, time.perf_counter() - start, input_bytes)
+
+
+def _writer_config(transform_mode: TransformMode = TransformMode.PROTO, **target_redis) -> RedisWriterConfig:
+    return RedisWriterConfig(
+        log_level='WARNING',
+        transform_mode=transform_mode,
+        mapping_config=[MappingConfig(source='bench:0')],
+        target_redis=TargetRedisConfig(**{'host': 'target', 'port': 6379, **target_redis}),
+    )
+
+
+def bench_get(profile: MessageProfile, count: int, transform_mode: TransformMode) -> BenchmarkResult:
+    writer = RedisWriter(_writer_config(transform_mode))
+    pool = make_message_pool(profile, POOL_SIZE)
+    return _time_calls(f'get[{transform_mode.value}]', [(msg, msg) for msg in pool], writer.get, count)
+
+
+def bench_remove_frame_data(profile: MessageProfile, count: int) -> BenchmarkResult:
+    '''Times `_remove_frame_data` only (messages are parsed upfront, as the method modifies them)'''
+    writer = RedisWriter(_writer_config())
+    pool = make_message_pool(profile, POOL_SIZE)
+    messages = [(pool[idx % POOL_SIZE], SaeMessage.FromString(pool[idx % POOL_SIZE])) for idx in range(count)]
+    return _time_calls('remove_frame_data', messages, writer._remove_frame_data, count)
+
+
+def bench_sender_get_next_batch(profile: MessageProfile, count: int, streams: int) -> BenchmarkResult:
+    '''Fills the buffer of a (not started) sender worker and times draining it batch by batch'''
+    config = _writer_config(buffer_length=count, buffer_max_bytes=2**40)
+    worker = SenderWorker(config)
+    pool = [RedisWriter(config).transform(msg) for msg in make_message_pool(profile, POOL_SIZE)]
+    worker.publish_batch([(f'bench:{idx % streams}', pool[idx % POOL_SIZE], None) for idx in range(count)])
+
+    latencies = []
+    input_bytes = 0
+    batches = 0
+    start = time.perf_counter()
+    while True:
+        call_start = time.perf_counter()
+        batch, _ = worker._get_next_batch()
+        duration = time.perf_counter() - call_start
+        if len(batch) == 0:
+            break
+        batches += 1
+        # Every message of the batch waited for the whole call
+        latencies.extend([duration] * len(batch))
+        input_bytes += sum(len(entry.msg_bytes) for entry in batch)
+    return make_result('sender_get_next_batch', latencies, time.perf_counter() - start, input_bytes, batches=batches)
+
+
+def bench_sender_network(profile: MessageProfile, count: int, streams: int, faults: Faults, seed: int = 0, timeout_s: float = 300) -> BenchmarkResult:
+    '''Publishes `count` messages at once with a `Sender` to a `RespServer` (over TCP, with the real client) that injects `faults`.
+    This shows how fast the sender works off a backlog under the given network conditions (batching, pipelining, backoff).
+    The latency of each message is measured from `publish` to its first arrival (messages can arrive twice after disconnects).'''
+    with RespServer(faults=faults, seed=seed) as server:
+        config = _writer_config(host=server.host, port=server.port, buffer_length=count, buffer_max_bytes=2**40,
+                                target_stream_maxlen=count * 4, socket_timeout_s=1)
+        pool = [RedisWriter(config).transform(msg) for msg in make_message_pool(profile, POOL_SIZE)]
+        stream_keys = [f'bench:{idx}' for idx in range(streams)]
+        target_label = {'target': f'{server.host}:{server.port}'}
+        backoffs_before = REGISTRY.get_sample_value('redis_writer_backoff_counter_total', target_label) or 0
+
+        publish_times = []
+        with Sender(config) as publish:
+            for idx in range(count):
+                publish_times.append(time.perf_counter())
+                publish(stream_keys[idx % streams], pool[idx % POOL_SIZE], {'seq': str(idx)})
+
+            arrivals = _first_arrivals(server.streams, stream_keys, count, time.monotonic() + timeout_s)
+
+        backoffs = (REGISTRY.get_sample_value('redis_writer_backoff_counter_total', target_label) or 0) - backoffs_before
+        received = server.streams.message_count()
+        disconnects = server.disconnects
+
+    latencies = [arrival - publish_times[seq] for seq, arrival in arrivals.items()]
+    last_arrival = max(arrivals.values(), default=publish_times[0])
+    return make_result('sender_network', latencies, last_arrival - publish_times[0],
+                       sum(len(pool[seq % POOL_SIZE]) for seq in arrivals),
+                       delivered_ratio=len(arrivals) / count, duplicates=received - len(arrivals), backoffs=backoffs, disconnects=disconnects)
+
+
+def _first_arrivals(streams: InMemoryStreams, stream_keys: List[str], count: int, deadline: float) -> Dict[int, float]:
+    '''Waits until every message (identified by its `seq` field) has arrived at least once, returns the first arrival per message.
+    Entries are collected on every poll, so that they are not missed if the stream gets trimmed in between.'''
+    arrivals = {}
+    while True:
+        for stream_key in stream_keys:
+            for entry_id, fields in streams.xrevrange(stream_key):
+                seq = int(fields[b'seq'])
+                arrival = streams.entry_arrivals[entry_id]
+                if arrival < arrivals.get(seq, float('inf')):
+                    arrivals[seq] = arrival
+        if len(arrivals) >= count or time.monotonic() >= deadline:
+            return arrivals
+        time.sleep(0.01)
+
+
+class EndToEndScenario(NamedTuple):
+    pipeline_mode: PipelineMode = PipelineMode.THREADED
+    transform_mode: TransformMode = TransformMode.PROTO
+
+    @property
+    def name(self) -> str:
+        return f'e2e[{self.pipeline_mode.value},{self.transform_mode.value}]'
+
+
+def bench_end_to_end(profile: MessageProfile, count: int, streams: int, scenario: EndToEndScenario,
+                     rate_hz: Optional[float] = None, timeout_s: float = 300) -> BenchmarkResult:
+    '''Runs `run_stage` against in-process stand-ins of the source and target server.
+    A producer thread writes `count` messages round-robin onto the source streams (as fast as possible unless `rate_hz` is set),
+    the latency of each message is measured from its source XADD to its target XADD.
+    Without a rate limit, the latency mostly reflects how long messages queue in front of the stage.'''
+    from rediswriter.stage import run_stage
+
+    standin = StandIn('source', 'target')
+    source, target = standin.servers['source'], standin.servers['target']
+    stream_keys = [f'bench:{idx}' for idx in range(streams)]
+    config = RedisWriterConfig(
+        log_level='WARNING',
+        redis=RedisConfig(host='source', read_block_ms=50),
+        target_redis=TargetRedisConfig(host='target', port=6379, buffer_length=count, buffer_max_bytes=2**40, target_stream_maxlen=count),
+        transform_mode=scenario.transform_mode,
+        pipeline_mode=scenario.pipeline_mode,
+        mapping_config=[MappingConfig(source=stream_key, target=f'{stream_key}:out') for stream_key in stream_keys],
+    )
+
+    pool = make_message_pool(profile, POOL_SIZE)
+    pool_b64 = [base64.b64encode(msg) for msg in pool]
+    write_times: Dict[str, List[float]] = {stream_key: [] for stream_key in stream_keys}
+
+    def produce():
+        # Messages written before the stage started reading would not be delivered
+        source.reader_connected.wait(timeout_s)
+        interval = 1 / rate_hz if rate_hz is not None else 0
+        next_write = time.perf_counter()
+        for idx in range(count):
+            stream_key = stream_keys[idx % streams]
+            write_times[stream_key].append(time.perf_counter())
+            source.xadd(stream_key, {PAYLOAD_FIELD: pool_b64[idx % POOL_SIZE]})
+            if interval > 0:
+                next_write += interval
+                time.sleep(max(0, next_write - time.perf_counter()))
+
+    def stop_when_done():
+        deadline = time.monotonic() + timeout_s
+        while target.message_count() < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Shut down the stage like the container runtime would
+        os.kill(os.getpid(), signal.SIGINT)
+
+    producer = threading.Thread(target=produce, name='bench-producer')
+    stopper = threading.Thread(target=stop_when_done, name='bench-stopper')
+    with patch('valkey.Valkey', side_effect=standin.client), \
+            patch('valkey.asyncio.Valkey', side_effect=standin.async_client), \
+            patch('rediswriter.stage.RedisWriterConfig', return_value=config), \
+            patch('rediswriter.stage.start_http_server'):
+        producer.start()
+        stopper.start()
+        run_stage()
+        producer.join()
+        stopper.join()
+
+    latencies = []
+    input_bytes = 0
+    first_write = min(times[0] for times in write_times.values() if len(times) > 0)
+    last_arrival = first_write
+    for stream_idx, stream_key in enumerate(stream_keys):
+        arrivals = target.arrivals.get(f'{stream_key}:out'.encode('utf-8'), [])
+        # Streams are forwarded in order and nothing is dropped, so the n-th arrival is the n-th written message
+        for idx, (write_time, arrival) in enumerate(zip(write_times[stream_key], arrivals)):
+            latencies.append(arrival - write_time)
+            input_bytes += len(pool[(idx * streams + stream_idx) % POOL_SIZE])
+            last_arrival = max(last_arrival, arrival)
+
+    return make_result(scenario.name, latencies, last_arrival - first_write, input_bytes,
+                       output_bytes_per_s=target.received_bytes / (last_arrival - first_write) if last_arrival > first_write else float('nan'),
+                       delivered_ratio=len(latencies) / count)
@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from contextlib import AsyncExitStack, nullcontext
+from typing import Deque, List, Optional, Union
+
+from valkey.exceptions import ConnectionError, TimeoutError
+from visionapi.common_pb2 import MessageType
+
+from .buffer import BufferEntry
+from .checkpoint import (PAUSE_POLL_S, READ_PAUSE_DURATION, Checkpointer,
+                         read_room)
+from .config import ExecutionMode, RedisWriterConfig
+from .fanout import AsyncFanOutSender, needs_fan_out, target_configs
+from .publisher import AsyncStreamPublisher
+from .rate_limit import RateLimiter
+from .rediswriter import RedisWriter
+from .routing import Router
+from .shaping import BANDWIDTH_THROTTLE_DURATION
+from .sender import (EntryPreparer, OutgoingMessage, SenderBase, backoff_gen,
+                     split_by_worker)
+from .source import AsyncSourceReader, StreamDiscovery
+from .transform_pool import (TRANSFORM_ERROR_COUNTER, TRANSFORM_IN_FLIGHT,
+                             TRANSFORM_WORKERS, TransformItem, _init_worker,
+                             _transform_batch_in_worker, collect_batch_results,
+                             observe_consume_to_enqueue, oldest_submission,
+                             shard_for)
+
+logging.basicConfig(format='%(asctime)s %(name)-15s %(levelname)-8s %(processName)-10s %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class AsyncTransformDispatcher:
+    '''asyncio counterpart of `TransformPool`. In THREAD and PROCESS mode, every shard is served by one task
+    that awaits its single-worker executor, so the per-stream order is preserved without any collector threads.'''
+
+    def __init__(self, config: RedisWriterConfig, redis_writer: RedisWriter, send_batch) -> None:
+        self._config = config.transform_pool
+        self._writer_config = config
+        self._redis_writer = redis_writer
+        self._send_batch = send_batch
+        logger.setLevel(config.log_level.value)
+
+        self._executors: List[Executor] = []
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight: asyncio.BoundedSemaphore = None
+        self._submitted: List[Deque[float]] = []
+        self._pending = 0
+
+    async def __aenter__(self):
+        if self._config.mode == ExecutionMode.INLINE:
+            return self
+
+        self._in_flight = asyncio.BoundedSemaphore(self._config.max_in_flight)
+        for idx in range(self._config.workers):
+            self._executors.append(self._create_executor())
+            shard_queue = asyncio.Queue()
+            self._queues.append(shard_queue)
+            self._submitted.append(deque())
+            self._tasks.append(asyncio.create_task(self._run_shard(idx, shard_queue), name=f'transform-shard-{idx}'))
+
+        TRANSFORM_WORKERS.set(self._config.workers)
+        logger.info(f'Started {self._config.workers} transform workers in {self._config.mode.value} mode')
+
+        return self
+
+    def _create_executor(self) -> Executor:
+        if self._config.mode == ExecutionMode.PROCESS:
+            return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(self._writer_config,))
+        return ThreadPoolExecutor(max_workers=1)
+
+    def _send_results(self, results, consume_time: Optional[float]):
+        self._send_batch(results)
+        observe_consume_to_enqueue(results, consume_time)
+
+    def pending_since(self) -> Optional[float]:
+        '''Counterpart of `TransformPool.pending_since`'''
+        return oldest_submission(self._submitted)
+
+    def pending_count(self) -> int:
+        '''Counterpart of `TransformPool.pending_count`'''
+        return self._pending
+
+    async def transform_batch(self, items: List[TransformItem], consume_time: Optional[float] = None):
+        '''Counterpart of `TransformPool.transform_batch`'''
+        if len(items) == 0:
+            return
+
+        if self._config.mode == ExecutionMode.INLINE:
+            output_protos = self._redis_writer.get_batch([item[2] for item in items], [item[0] for item in items])
+            self._send_results(collect_batch_results(items, output_protos), consume_time)
+            return
+
+        shards: List[List[TransformItem]] = [[] for _ in range(self._config.workers)]
+        for item in items:
+            shards[shard_for(item[0], self._config.workers)].append(item)
+
+        for shard, shard_items in enumerate(shards):
+            for start in range(0, len(shard_items), self._config.max_in_flight):
+                chunk = shard_items[start:start + self._config.max_in_flight]
+                for _ in chunk:
+                    await self._in_flight.acquire()
+                TRANSFORM_IN_FLIGHT.inc(len(chunk))
+                self._pending += len(chunk)
+                self._submitted[shard].append(time.monotonic())
+                self._queues[shard].put_nowait((chunk, consume_time))
+
+    async def _run_shard(self, idx: int, shard_queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        executor = self._executors[idx]
+        transform_batch = _transform_batch_in_worker if self._config.mode == ExecutionMode.PROCESS else self._redis_writer.get_batch
+        while True:
+            item = await shard_queue.get()
+            if item is None:
+                break
+            items, consume_time = item
+            try:
+                output_protos = await loop.run_in_executor(executor, transform_batch, [item[2] for item in items], [item[0] for item in items])
+                self._send_results(collect_batch_results(items, output_protos), consume_time)
+            except Exception:
+                TRANSFORM_ERROR_COUNTER.inc(len(items))
+                logger.warning('Transformation failed, discarding message', exc_info=True)
+            finally:
+                self._submitted[idx].popleft()
+                self._pending -= len(items)
+                TRANSFORM_IN_FLIGHT.dec(len(items))
+                for _ in items:
+                    self._in_flight.release()
+
+    async def __aexit__(self, _, __, ___):
+        for shard_queue in self._queues:
+            shard_queue.put_nowait(None)
+        await asyncio.gather(*self._tasks)
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+        TRANSFORM_WORKERS.set(0)
+        return False
+
+
+class AsyncSenderWorker(SenderBase):
+    '''asyncio counterpart of `SenderWorker`. All buffer access happens on the event loop, so no locking is needed.'''
+
+    def __init__(self, config: RedisWriterConfig, worker_idx: int = 0, preparer: Optional[EntryPreparer] = None) -> None:
+        super().__init__(config, worker_idx, preparer)
+
+        self._buffer_changed: asyncio.Event = None
+        self._stopped: asyncio.Event = None
+        self._sender_task: asyncio.Task = None
+
+    async def __aenter__(self):
+        self._buffer_changed = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._sender_task = asyncio.create_task(self._run(), name=f'sender-{self._worker_idx}')
+        return self._publish
+
+    def _publish(self, stream_key, msg_bytes, fields=None):
+        if self._enqueue(self._preparer.prepare(stream_key, msg_bytes, fields)):
+            self._buffer_changed.set()
+
+    def publish_batch(self, items: List[OutgoingMessage]):
+        self.publish_entries([self._preparer.prepare(*item) for item in items])
+
+    def publish_entries(self, entries: List[BufferEntry]):
+        if self._enqueue_all(entries):
+            self._buffer_changed.set()
+
+    def pending_since(self) -> Optional[float]:
+        return self._pending_since()
+
+    def has_room(self) -> bool:
+        return self._has_room()
+
+    def room(self) -> int:
+        return self._room()
+
+    def set_catch_up(self, catch_up: bool):
+        self._catch_up = catch_up
+
+    async def _wait_for_change(self, timeout: Optional[float] = None):
+        self._buffer_changed.clear()
+        try:
+            await asyncio.wait_for(self._buffer_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _wait_for_batch(self) -> bool:
+        '''Returns False if the sender is being stopped'''
+        # Spilled messages are replayed without delay
+        if self._has_spilled():
+            return await self._wait_for_bandwidth()
+
+        while len(self._buffer) == 0:
+            if self._stopped.is_set():
+                return False
+            await self._wait_for_change()
+
+        while not self._batch_ready():
+            if self._stopped.is_set():
+                return False
+            remaining = self._linger_remaining()
+            if remaining <= 0:
+                break
+            await self._wait_for_change(remaining)
+
+        return await self._wait_for_bandwidth()
+
+    async def _wait_for_bandwidth(self) -> bool:
+        delay = self._shaper.delay()
+        while delay > 0:
+            if self._stopped.is_set():
+                return False
+            wait_start = time.monotonic()
+            await self._wait_for_change(delay)
+            BANDWIDTH_THROTTLE_DURATION.inc(time.monotonic() - wait_start)
+            delay = self._shaper.delay()
+        return not self._stopped.is_set()
+
+    async def _run(self):
+        publisher = AsyncStreamPublisher(
+            host=self._config.host,
+            port=self._config.port,
+            stream_maxlen=self._config.target_stream_maxlen,
+            target_name=self._config.name,
+            packing=self._config.packing,
+            **self._redis_args
+        )
+
+        backoff_time = backoff_gen()
+        batch = []
+        enqueue_times = []
+
+        async with publisher as publish:
+            while not self._stopped.is_set():
+                if self._connection_healthy:
+                    if not await self._wait_for_batch():
+                        break
+                    batch, enqueue_times = self._take_batch()
+                    if len(batch) == 0:
+                        continue
+
+                try:
+                    execution_time = time.monotonic()
+                    with self._redis_publish_duration.time():
+                        await publish(batch)
+                    if self._publish_succeeded(execution_time, batch, enqueue_times):
+                        backoff_time = backoff_gen()
+                    continue
+                except (ConnectionError, TimeoutError) as _:
+                    logger.debug('Publish failed with error', exc_info=True)
+                except Exception as _:
+                    logger.warning('Got unexpected exception', exc_info=True)
+
+                sleep_time = self._publish_failed(backoff_time)
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), sleep_time)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def __aexit__(self, _, __, ___):
+        self._stopped.set()
+        self._buffer_changed.set()
+        try:
+            await asyncio.wait_for(self._sender_task, timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning('Sender did not stop in time')
+        self._close_spill()
+        return False
+
+
+class AsyncSender:
+    '''asyncio counterpart of `Sender`'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self.preparer = EntryPreparer(config)
+        self._workers = [AsyncSenderWorker(config, idx, self.preparer) for idx in range(config.target_redis.sender_workers)]
+        self._exit_stack = AsyncExitStack()
+
+    async def __aenter__(self):
+        publish_fns = [await self._exit_stack.enter_async_context(worker) for worker in self._workers]
+        if len(publish_fns) == 1:
+            return publish_fns[0]
+
+        def publish(stream_key, msg_bytes, fields=None):
+            publish_fns[shard_for(stream_key, len(publish_fns))](stream_key, msg_bytes, fields)
+        return publish
+
+    def publish_batch(self, items: List[OutgoingMessage]):
+        self.publish_entries([self.preparer.prepare(*item) for item in items])
+
+    def publish_entries(self, entries: List[BufferEntry]):
+        if len(self._workers) == 1:
+            self._workers[0].publish_entries(entries)
+            return
+        for worker, worker_entries in zip(self._workers, split_by_worker(entries, len(self._workers))):
+            if len(worker_entries) > 0:
+                worker.publish_entries(worker_entries)
+
+    def pending_since(self) -> Optional[float]:
+        return min((since for since in (worker.pending_since() for worker in self._workers) if since is not None), default=None)
+
+    def has_room(self) -> bool:
+        return all(worker.has_room() for worker in self._workers)
+
+    def room(self) -> int:
+        return min(worker.room() for worker in self._workers)
+
+    def set_catch_up(self, catch_up: bool):
+        for worker in self._workers:
+            worker.set_catch_up(catch_up)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return await self._exit_stack.__aexit__(exc_type, exc_value, traceback)
+
+
+async def _checkpoint(checkpointer: Checkpointer, reader: AsyncSourceReader, dispatcher: AsyncTransformDispatcher, sender: Union[AsyncSender, AsyncFanOutSender], stop_event: threading.Event):
+    '''Counterpart of `stage._checkpoint` (the store is accessed in a separate thread)'''
+    sender.set_catch_up(reader.catching_up)
+    pause_start: Optional[float] = None
+    while True:
+        ids = checkpointer.poll(reader.last_ids, dispatcher.pending_since, sender.pending_since)
+        if ids is not None:
+            await asyncio.to_thread(checkpointer.commit, ids)
+        if stop_event.is_set() or (sender.has_room() and (not reader.catching_up or dispatcher.pending_since() is None)):
+            break
+        pause_start = pause_start or time.monotonic()
+        await asyncio.sleep(PAUSE_POLL_S)
+
+    if pause_start is not None:
+        READ_PAUSE_DURATION.inc(time.monotonic() - pause_start)
+
+
+async def run_async_pipeline(config: RedisWriterConfig, stop_event: threading.Event):
+    '''Runs reading, transformation and publishing as tasks on a single event loop.
+    `stop_event` is set by the signal handlers and checked after every read.'''
+    redis_writer = RedisWriter(config)
+    router = Router(config)
+    rate_limiter = RateLimiter(config)
+
+    discovery = None
+    if len(router.scan_matches) > 0:
+        discovery = StreamDiscovery(router.scan_matches, router.matches, config.redis.discovery_interval_s)
+    checkpointer = await asyncio.to_thread(Checkpointer, config) if config.checkpoint.enabled else None
+    if checkpointer is not None:
+        reader = AsyncSourceReader(config.redis, router.source_streams, discovery, checkpointer.start_ids, checkpointer.catch_up)
+    else:
+        reader = AsyncSourceReader(config.redis, router.source_streams, discovery)
+    logger.debug(f'Listening to stream keys {router.source_streams}')
+
+    if needs_fan_out(config):
+        sender = AsyncFanOutSender([target.name for target in config.targets],
+                                   [AsyncSender(target_config) for target_config in target_configs(config)], router.targets_for)
+    else:
+        sender = AsyncSender(config)
+    with checkpointer or nullcontext():
+        async with reader as iter_batches, sender:
+            dispatcher = AsyncTransformDispatcher(config, redis_writer, sender.publish_batch)
+            async with dispatcher:
+                room = read_room(sender.room, dispatcher.pending_count) if checkpointer is not None else None
+                async for batch in iter_batches(room):
+                    if stop_event.is_set():
+                        break
+                    consume_time = time.monotonic()
+
+                    to_transform = []
+                    to_forward = []
+                    for stream_key, proto_data in batch:
+                        route = router.route(stream_key, proto_data)
+                        if route is None:
+                            continue
+
+                        # Drop messages according to the rate policies before any further work is spent on them
+                        if not rate_limiter.allow(stream_key, route.message_type, proto_data):
+                            continue
+
+                        # Only process SaeMessage messages, otherwise pass verbatim
+                        if route.message_type == MessageType.SAE:
+                            to_transform.append((stream_key, route.target_stream, proto_data, route.envelope))
+                        else:
+                            to_forward.append((route.target_stream, proto_data, route.envelope))
+
+                    # The order is only preserved within each stream (every stream carries a single message type)
+                    if len(to_forward) > 0:
+                        sender.publish_batch(to_forward)
+                        observe_consume_to_enqueue(to_forward, consume_time)
+                    await dispatcher.transform_batch(to_transform, consume_time)
+
+                    if checkpointer is not None:
+                        await _checkpoint(checkpointer, reader, dispatcher, sender, stop_event)
@@ -0,0 +1,68 @@
+import logging
+from typing import NamedTuple
+
+from prometheus_client import Gauge
+
+from .config import TargetRedisConfig
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_TARGET = Gauge('redis_writer_batch_size_target', 'The current maximum number of messages per pipeline (adjusted by the adaptive batching)', ['worker'])
+BATCH_BYTES_TARGET = Gauge('redis_writer_batch_bytes_target', 'The current maximum number of bytes per pipeline (adjusted by the adaptive batching)', ['worker'])
+
+
+class BatchLimits(NamedTuple):
+    size: int
+    bytes: int
+
+
+class AdaptiveBatchController:
+    '''Tunes the batch limits of one sender worker from the observed pipeline durations (AIMD, like TCP congestion control).
+    After a pipeline that finished within `target_duration_ms` and left messages behind in the buffer (i.e. the limits were binding),
+    both limits are increased additively. After a slow or failed pipeline, they are decreased multiplicatively.
+    The limits stay between the `adaptive_batching` minimums and `max_batch_size` / `max_batch_bytes`.
+    If adaptive batching is disabled, the maximums are used as fixed limits.'''
+
+    def __init__(self, config: TargetRedisConfig, worker_label: str = '0') -> None:
+        self._config = config.adaptive_batching
+        self._max = BatchLimits(config.max_batch_size, config.max_batch_bytes)
+        self._min = BatchLimits(min(self._config.min_batch_size, self._max.size), min(self._config.min_batch_bytes, self._max.bytes))
+        # Keep the configured ratio of messages to bytes while increasing
+        self._bytes_step = max(1, self._max.bytes * self._config.increase_step // self._max.size)
+        self._target_duration_s = self._config.target_duration_ms / 1000
+
+        self.limits = self._min if self._config.enabled else self._max
+        self._size_gauge = BATCH_SIZE_TARGET.labels(worker_label)
+        self._bytes_gauge = BATCH_BYTES_TARGET.labels(worker_label)
+        self._report()
+
+    def _report(self):
+        self._size_gauge.set(self.limits.size)
+        self._bytes_gauge.set(self.limits.bytes)
+
+    def on_success(self, duration_s: float, backlog: bool) -> None:
+        '''`backlog` tells whether messages were left in the buffer when the batch was taken'''
+        if not self._config.enabled:
+            return
+        if duration_s > self._target_duration_s:
+            self._decrease()
+        elif backlog:
+            self.limits = BatchLimits(
+                min(self._max.size, self.limits.size + self._config.increase_step),
+                min(self._max.bytes, self.limits.bytes + self._bytes_step),
+            )
+            self._report()
+
+    def on_failure(self) -> None:
+        if not self._config.enabled:
+            return
+        self._decrease()
+
+    def _decrease(self):
+        factor = self._config.decrease_factor
+        self.limits = BatchLimits(
+            max(self._min.size, int(self.limits.size * factor)),
+            max(self._min.bytes, int(self.limits.bytes * factor)),
+        )
+        logger.debug(f'Decreased batch limits to {self.limits}')
+        self._report()
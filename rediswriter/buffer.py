@@ -0,0 +1,263 @@
+from collections import deque
+from itertools import chain
+from typing import Deque, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+
+class BufferEntry(NamedTuple):
+    stream_key: str
+    msg_bytes: bytes
+    # Additional stream entry fields (besides the payload)
+    fields: Optional[Dict[str, str]] = None
+    # `frame.timestamp_utc_ms` of SaeMessages (only kept in memory, i.e. not spilled)
+    frame_timestamp_ms: Optional[int] = None
+    # Lower values are sent first (and evicted last), see `shaping.Priority`
+    priority: int = 0
+    # Entries of the same stream and priority with the same key replace each other while pending (None: never conflated)
+    conflation_key: Optional[Hashable] = None
+
+
+def entry_size(entry: BufferEntry) -> int:
+    size = len(entry.msg_bytes) + len(entry.stream_key)
+    if entry.fields is not None:
+        size += sum(len(name) + len(value) for name, value in entry.fields.items())
+    return size
+
+
+class _StreamQueue:
+    '''FIFO of one stream and priority in parallel slot lists (entries, enqueue times and the cumulative bytes up to each entry).
+    The byte count of any prefix is a subtraction, so whole runs of entries can be taken with one slice.
+    Consumed slots are cleared right away and the lists are compacted once more than half of them is consumed.
+    Conflated entries are indexed by their key (slot positions are counted from the creation of the queue, see `offset`).'''
+
+    __slots__ = ('entries', 'times', 'ends', 'head', 'appended_bytes', 'consumed_bytes', 'keys', 'offset')
+
+    def __init__(self) -> None:
+        self.entries: List[Optional[BufferEntry]] = []
+        self.times: List[float] = []
+        # Bytes appended to the queue so far, after each entry
+        self.ends: List[int] = []
+        self.head = 0
+        self.appended_bytes = 0
+        self.consumed_bytes = 0
+        # Conflation key -> position of the last entry appended with it
+        self.keys: Optional[Dict[Hashable, int]] = None
+        # Slots removed from the front of the lists by compactions
+        self.offset = 0
+
+    def __len__(self) -> int:
+        return len(self.entries) - self.head
+
+    @property
+    def bytes(self) -> int:
+        return self.appended_bytes - self.consumed_bytes
+
+    def append(self, entry: BufferEntry, enqueue_time: float, size: int) -> None:
+        if entry.conflation_key is not None:
+            if self.keys is None:
+                self.keys = {}
+            self.keys[entry.conflation_key] = self.offset + len(self.entries)
+        self.appended_bytes += size
+        self.entries.append(entry)
+        self.times.append(enqueue_time)
+        self.ends.append(self.appended_bytes)
+
+    def replace(self, entry: BufferEntry, size: int) -> Optional[Tuple[BufferEntry, int]]:
+        '''Puts `entry` into the slot of the pending entry with the same conflation key (keeping its position and enqueue time).
+        Returns the replaced entry and the change in bytes, or None if there is no such entry.'''
+        if self.keys is None:
+            return None
+        slot = self.keys.get(entry.conflation_key)
+        if slot is None or slot - self.offset < self.head:
+            return None
+        slot -= self.offset
+        start = self.ends[slot - 1] if slot > self.head else self.consumed_bytes
+        delta = size - (self.ends[slot] - start)
+        replaced = self.entries[slot]
+        self.entries[slot] = entry
+        if delta != 0:
+            # Linear in the entries behind the slot, which conflation keeps short
+            for idx in range(slot, len(self.ends)):
+                self.ends[idx] += delta
+            self.appended_bytes += delta
+        return replaced, delta
+
+    def prefix_bytes(self, count: int) -> int:
+        return self.ends[self.head + count - 1] - self.consumed_bytes
+
+    def take(self, count: int) -> Tuple[List[BufferEntry], List[float], int]:
+        '''Removes the first `count` entries and returns them, their enqueue times and their bytes'''
+        head, end = self.head, self.head + count
+        entries = self.entries[head:end]
+        times = self.times[head:end]
+        taken_bytes = self.ends[end - 1] - self.consumed_bytes
+        self.consumed_bytes = self.ends[end - 1]
+
+        if end == len(self.entries):
+            self.offset += end
+            self.entries.clear()
+            self.times.clear()
+            self.ends.clear()
+            self.head = 0
+            if self.keys is not None:
+                self.keys.clear()
+        elif end * 2 > len(self.entries):
+            self.offset += end
+            del self.entries[:end]
+            del self.times[:end]
+            del self.ends[:end]
+            self.head = 0
+        else:
+            # Do not keep the payloads alive until the next compaction
+            self.entries[head:end] = [None] * count
+            self.head = end
+        return entries, times, taken_bytes
+
+
+class StreamBuffer:
+    '''A buffer that is bounded by total bytes (and message count), split into one FIFO queue per stream key and priority.
+    If the buffer overflows, the oldest entry of the stream currently occupying the most bytes is evicted from the lowest priority,
+    so that a single chatty stream cannot push out the messages of all other streams.
+    Draining takes entries from higher priorities first and from the streams of a priority in a round-robin fashion.
+    Complete rounds over all streams are taken in bulk (one slice per stream), only the last, partial round is taken entry by entry.
+    Entries with a conflation key can replace a pending entry of their stream in place (see `replace`).
+    This class is not thread-safe, synchronization is up to the caller.'''
+
+    def __init__(self, max_bytes: int, max_length: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_length = max_length
+
+        # priority -> stream key -> queue
+        self._queues: Dict[int, Dict[str, _StreamQueue]] = {}
+        # Non-empty queues in round-robin order, per priority
+        self._active: Dict[int, Deque[_StreamQueue]] = {}
+        self._length = 0
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def is_full(self) -> bool:
+        return self._length >= self.max_length or self._bytes >= self.max_bytes
+
+    def append(self, entry: BufferEntry, enqueue_time: float) -> List[BufferEntry]:
+        '''Appends an entry and returns the entries that had to be evicted to stay within bounds.'''
+        size = entry_size(entry)
+
+        priority_queues = self._queues.get(entry.priority)
+        if priority_queues is None:
+            priority_queues = self._queues[entry.priority] = {}
+            self._active[entry.priority] = deque()
+        queue = priority_queues.get(entry.stream_key)
+        if queue is None:
+            queue = priority_queues[entry.stream_key] = _StreamQueue()
+        if len(queue) == 0:
+            self._active[entry.priority].append(queue)
+
+        queue.append(entry, enqueue_time, size)
+        self._length += 1
+        self._bytes += size
+        return self._evict_overflow()
+
+    def replace(self, entry: BufferEntry) -> Optional[List[BufferEntry]]:
+        '''Conflates `entry` with the pending entry of its stream that has the same conflation key.
+        Returns None if there is no such entry (i.e. it has to be appended), otherwise the entries that had to be evicted to stay within bounds.'''
+        queue = self._queues.get(entry.priority, {}).get(entry.stream_key)
+        if queue is None or entry.conflation_key is None:
+            return None
+        replaced = queue.replace(entry, entry_size(entry))
+        if replaced is None:
+            return None
+        self._bytes += replaced[1]
+        return self._evict_overflow()
+
+    def _evict_overflow(self) -> List[BufferEntry]:
+        evicted = []
+        while self._length > self.max_length or (self._bytes > self.max_bytes and self._length > 1):
+            evicted.append(self._evict())
+        return evicted
+
+    def _evict(self) -> BufferEntry:
+        lowest_priority = max(priority for priority, active in self._active.items() if len(active) > 0)
+        active = self._active[lowest_priority]
+        victim = max(active, key=lambda queue: queue.bytes)
+        entries, _, _ = self._take(victim, 1)
+        if len(victim) == 0:
+            active.remove(victim)
+        return entries[0]
+
+    def _take(self, queue: _StreamQueue, count: int) -> Tuple[List[BufferEntry], List[float], int]:
+        entries, times, taken_bytes = queue.take(count)
+        self._length -= count
+        self._bytes -= taken_bytes
+        return entries, times, taken_bytes
+
+    def oldest_enqueue_time(self) -> float:
+        return min(queue.times[queue.head] for active in self._active.values() for queue in active)
+
+    def drain(self, max_count: int, max_bytes: int) -> Tuple[List[BufferEntry], List[float]]:
+        '''Takes up to `max_count` entries (and up to `max_bytes`, but at least one entry), starting with the highest priority.
+        Returns the entries and their enqueue times.'''
+        batch: List[BufferEntry] = []
+        enqueue_times: List[float] = []
+        batch_bytes = 0
+        for priority in sorted(self._active):
+            active = self._active[priority]
+            while len(active) > 0 and len(batch) < max_count:
+                rounds = min((max_count - len(batch)) // len(active), min(len(queue) for queue in active))
+                rounds = self._rounds_within(active, rounds, max_bytes - batch_bytes)
+                if rounds > 0:
+                    batch_bytes += self._take_rounds(active, rounds, batch, enqueue_times)
+                    continue
+
+                # Not even one more round fits, so the last one is taken entry by entry
+                for _ in range(len(active)):
+                    if len(active) == 0 or len(batch) >= max_count:
+                        break
+                    queue = active[0]
+                    if len(batch) > 0 and batch_bytes + queue.prefix_bytes(1) > max_bytes:
+                        return batch, enqueue_times
+                    entries, times, taken_bytes = self._take(queue, 1)
+                    # Remove the queue from the rotation if it ran empty, otherwise move it to the back
+                    if len(queue) == 0:
+                        active.popleft()
+                    else:
+                        active.rotate(-1)
+                    batch.append(entries[0])
+                    enqueue_times.append(times[0])
+                    batch_bytes += taken_bytes
+        return batch, enqueue_times
+
+    @staticmethod
+    def _rounds_within(active: Deque[_StreamQueue], rounds: int, max_bytes: int) -> int:
+        '''The largest number of complete rounds (up to `rounds`) that fits into `max_bytes`'''
+        if rounds == 0 or sum(queue.prefix_bytes(rounds) for queue in active) <= max_bytes:
+            return rounds
+        low, high = 0, rounds - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if sum(queue.prefix_bytes(mid) for queue in active) <= max_bytes:
+                low = mid
+            else:
+                high = mid - 1
+        return low
+
+    def _take_rounds(self, active: Deque[_StreamQueue], rounds: int, batch: List[BufferEntry], enqueue_times: List[float]) -> int:
+        '''Takes `rounds` entries from every active queue (interleaved like single round-robin steps would) and returns their bytes'''
+        taken = [self._take(queue, rounds) for queue in active]
+        if len(taken) == 1:
+            batch.extend(taken[0][0])
+            enqueue_times.extend(taken[0][1])
+        else:
+            batch.extend(chain.from_iterable(zip(*(entries for entries, _, _ in taken))))
+            enqueue_times.extend(chain.from_iterable(zip(*(times for _, times, _ in taken))))
+
+        # Complete rounds end where they started, so the rotation only loses the queues that ran empty
+        if any(len(queue) == 0 for queue in active):
+            remaining = [queue for queue in active if len(queue) > 0]
+            active.clear()
+            active.extend(remaining)
+        return sum(taken_bytes for _, _, taken_bytes in taken)
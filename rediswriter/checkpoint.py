@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional
+
+import valkey
+from prometheus_client import Counter, Histogram
+from valkey.exceptions import ResponseError, ValkeyError
+
+from .config import CheckpointStore, RedisConfig, RedisWriterConfig
+from .source import CatchUp
+
+logging.basicConfig(format='%(asctime)s %(name)-15s %(levelname)-8s %(processName)-10s %(message)s')
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_COMMIT_COUNTER = Counter('redis_writer_checkpoint_commit_counter', 'How often the source stream positions have been persisted')
+CHECKPOINT_ERROR_COUNTER = Counter('redis_writer_checkpoint_error_counter', 'How often persisting the source stream positions failed')
+CHECKPOINT_DELAY = Histogram('redis_writer_checkpoint_delay', 'The time from taking a snapshot of the source stream positions until everything before it was published',
+                             buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+READ_PAUSE_DURATION = Counter('redis_writer_read_pause_duration', 'How long reading the source streams was paused, because the sender could not take more messages (in seconds)')
+
+# How often the stage checks whether it can resume reading
+PAUSE_POLL_S = 0.05
+
+
+def _to_str(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+class FileCheckpointStore:
+    '''Keeps the positions in a JSON file (stream key -> entry id), which is replaced atomically on every save'''
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+
+    def load(self) -> Dict[str, str]:
+        try:
+            with open(self._path, 'r') as f:
+                ids = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f'Ignoring unparsable checkpoint file {self._path}, starting without checkpoints', exc_info=True)
+            return {}
+
+        if not isinstance(ids, dict) or not all(isinstance(entry_id, str) for entry_id in ids.values()):
+            logger.warning(f'Ignoring checkpoint file {self._path} (expected an object of stream keys to entry ids), starting without checkpoints')
+            return {}
+        return ids
+
+    def save(self, ids: Dict[str, str]) -> None:
+        tmp_path = f'{self._path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(ids, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+
+    def close(self) -> None:
+        pass
+
+
+class RedisCheckpointStore:
+    '''Keeps the positions in a hash in the source instance (one field per stream)'''
+
+    def __init__(self, config: RedisConfig, key: str) -> None:
+        self._key = key
+        self._client = valkey.Valkey(host=config.host, port=config.port)
+
+    def load(self) -> Dict[str, str]:
+        try:
+            return {_to_str(stream_key): _to_str(entry_id) for stream_key, entry_id in self._client.hgetall(self._key).items()}
+        except (ResponseError, UnicodeDecodeError) as _:
+            # E.g. the key holds another type
+            logger.warning(f'Ignoring unreadable checkpoint hash {self._key}, starting without checkpoints', exc_info=True)
+            return {}
+
+    def save(self, ids: Dict[str, str]) -> None:
+        self._client.hset(self._key, mapping=ids)
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def read_room(sender_room: Callable[[], int], transform_pending: Callable[[], int]) -> Callable[[], int]:
+    '''How many messages can be read without the sender having to evict any of them (evicted messages would be committed without being published).
+    The messages still being transformed are going to take their share of the room.'''
+    def room() -> int:
+        return sender_room() - transform_pending()
+    return room
+
+
+def _settled(pending_since: Optional[float], barrier: float) -> bool:
+    # Everything still pending has arrived after the barrier
+    return pending_since is None or pending_since > barrier
+
+
+class Checkpointer:
+    '''Persists the positions in the source streams up to which all messages have been published (or deliberately dropped).
+    Instead of tracking every message, a snapshot of the read positions is taken after a batch has been handed on.
+    It is committed once the transform pool and then the sender have nothing pending anymore that was submitted before the snapshot.
+    Messages after the last commit are read again after a restart, i.e. they can be published twice but never get lost.'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self._config = config.checkpoint
+        logger.setLevel(config.log_level.value)
+        if self._config.store == CheckpointStore.REDIS:
+            self._store = RedisCheckpointStore(config.redis, self._config.key)
+        else:
+            self._store = FileCheckpointStore(self._config.path)
+
+        self._committed = self._store.load()
+        if len(self._committed) > 0:
+            logger.info(f'Resuming from checkpoints {self._committed}')
+        # The reads are additionally bounded by the room in the sender (see `read_room`)
+        self.catch_up = CatchUp(self._config.catch_up_read_count)
+
+        self._snapshot: Optional[Dict[str, str]] = None
+        self._snapshot_time = 0.0
+        self._barrier = 0.0
+        self._transformed = False
+        self._next_snapshot = time.monotonic() + self._config.interval_s
+
+    @property
+    def start_ids(self) -> Dict[str, str]:
+        return dict(self._committed)
+
+    def poll(self, last_ids: Dict[str, str], transform_pending_since: Callable[[], Optional[float]],
+             sender_pending_since: Callable[[], Optional[float]]) -> Optional[Dict[str, str]]:
+        '''Returns the positions to commit, if any. Must only be called when all messages up to `last_ids` have been handed to the transform pool or the sender.'''
+        now = time.monotonic()
+        if self._snapshot is None:
+            if now < self._next_snapshot:
+                return None
+            self._snapshot = {_to_str(stream_key): _to_str(entry_id) for stream_key, entry_id in last_ids.items()}
+            self._snapshot_time = now
+            self._barrier = now
+            self._transformed = False
+
+        if not self._transformed:
+            if not _settled(transform_pending_since(), self._barrier):
+                return None
+            # The transform results have been handed to the sender before this point
+            self._transformed = True
+            self._barrier = time.monotonic()
+
+        if not _settled(sender_pending_since(), self._barrier):
+            return None
+
+        snapshot, self._snapshot = self._snapshot, None
+        self._next_snapshot = now + self._config.interval_s
+        CHECKPOINT_DELAY.observe(now - self._snapshot_time)
+        return snapshot if snapshot != self._committed else None
+
+    def commit(self, ids: Dict[str, str]) -> None:
+        '''Can be run in a separate thread (it only touches the store)'''
+        if len(ids) == 0:
+            # Nothing has been read yet (and an empty hash cannot be written)
+            return
+        try:
+            self._store.save(ids)
+        except (OSError, ValkeyError) as _:
+            CHECKPOINT_ERROR_COUNTER.inc()
+            logger.warning('Persisting checkpoints failed, retrying with the next one', exc_info=True)
+            return
+        self._committed = ids
+        CHECKPOINT_COMMIT_COUNTER.inc()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _, __, ___):
+        self._store.close()
+        return False
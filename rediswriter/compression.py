@@ -0,0 +1,177 @@
+import hashlib
+import lzma
+import threading
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+from prometheus_client import Counter, Histogram
+
+from .config import CompressionConfig, RedisWriterConfig
+from .mapping import MappingTable
+
+COMPRESSION_DURATION = Histogram('redis_writer_compression_duration', 'The time it takes to compress a message payload',
+                                 buckets=(0.0001, 0.00025, 0.0005, 0.00075, 0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05))
+COMPRESSION_RAW_BYTES = Counter('redis_writer_compression_raw_bytes', 'How many payload bytes were handed to the compression', ['stream'])
+COMPRESSION_COMPRESSED_BYTES = Counter('redis_writer_compression_compressed_bytes', 'How many payload bytes were left after compression (raw bytes if compression did not pay off)', ['stream'])
+
+# Stream entry fields marking a compressed payload
+CODEC_FIELD = 'codec'
+DICTIONARY_FIELD = 'codec_dict'
+
+
+class Codec:
+    '''Base class for payload codecs. Implementations must be thread-safe.'''
+    name: str = None
+
+    def __init__(self, level: Optional[int] = None, dictionary: Optional[bytes] = None) -> None:
+        self.level = level
+        self.dictionary = dictionary
+        # Receivers need to know which dictionary was used, so we send a short fingerprint along
+        self.dictionary_id = hashlib.sha256(dictionary).hexdigest()[:16] if dictionary is not None else None
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+
+    def compress(self, data: bytes) -> bytes:
+        level = self.level if self.level is not None else zlib.Z_DEFAULT_COMPRESSION
+        if self.dictionary is None:
+            return zlib.compress(data, level)
+        compressor = zlib.compressobj(level, zdict=self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.dictionary is None:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj(zdict=self.dictionary)
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+class LzmaCodec(Codec):
+    name = 'lzma'
+
+    def __init__(self, level: Optional[int] = None, dictionary: Optional[bytes] = None) -> None:
+        if dictionary is not None:
+            raise ValueError('lzma codec does not support dictionaries')
+        super().__init__(level, dictionary)
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+
+class ZstdCodec(Codec):
+    '''Requires the optional `zstandard` package'''
+    name = 'zstd'
+
+    def __init__(self, level: Optional[int] = None, dictionary: Optional[bytes] = None) -> None:
+        import zstandard
+        super().__init__(level, dictionary)
+        self._zstd = zstandard
+        self._dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+        # zstandard (de)compressors must not be shared between threads
+        self._local = threading.local()
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = self._zstd.ZstdCompressor(level=self.level if self.level is not None else 3, dict_data=self._dict_data)
+            self._local.compressor = compressor
+        return compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        decompressor = getattr(self._local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self._zstd.ZstdDecompressor(dict_data=self._dict_data)
+            self._local.decompressor = decompressor
+        return decompressor.decompress(data)
+
+
+_CODECS: Dict[str, Callable[..., Codec]] = {}
+
+def register_codec(name: str, factory: Callable[..., Codec]) -> None:
+    '''Makes a codec available under `name` for use in `CompressionConfig.codec`.
+    `factory` is called with the keyword arguments `level` and `dictionary`.'''
+    _CODECS[name] = factory
+
+register_codec(ZlibCodec.name, ZlibCodec)
+register_codec(LzmaCodec.name, LzmaCodec)
+register_codec(ZstdCodec.name, ZstdCodec)
+
+
+def create_codec(config: CompressionConfig) -> Optional[Codec]:
+    '''Returns None if compression is disabled'''
+    if config.codec == 'none':
+        return None
+    if config.codec not in _CODECS:
+        raise ValueError(f'Unknown compression codec {config.codec} (available: {", ".join(_CODECS)})')
+
+    dictionary = None
+    if config.dictionary_path is not None:
+        with open(config.dictionary_path, 'rb') as f:
+            dictionary = f.read()
+
+    return _CODECS[config.codec](level=config.level, dictionary=dictionary)
+
+
+def codec_fields(codec: Codec) -> Dict[str, str]:
+    fields = {CODEC_FIELD: codec.name}
+    if codec.dictionary_id is not None:
+        fields[DICTIONARY_FIELD] = codec.dictionary_id
+    return fields
+
+
+class PayloadCompressor:
+    '''Compresses payloads with the codec configured for their target stream and marks them accordingly'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        # Streams without a mapping specific compression config (e.g. the aggregate stream) use the default
+        self._default = self._create(config.target_redis.compression)
+        self._mapping_table = MappingTable(config.mapping_config)
+        self._by_mapping: Dict[int, Tuple[Optional[Codec], CompressionConfig]] = {
+            id(mapping): self._create(mapping.compression)
+            for mapping in config.mapping_config
+            if mapping.compression is not None
+        }
+        self._by_stream: Dict[str, Tuple[Optional[Codec], CompressionConfig]] = {}
+
+    def _codec_for(self, stream_key: str) -> Tuple[Optional[Codec], CompressionConfig]:
+        try:
+            return self._by_stream[stream_key]
+        except KeyError:
+            pass
+        mapping = self._mapping_table.mapping_for_target(stream_key)
+        codec = self._by_mapping.get(id(mapping), self._default) if mapping is not None else self._default
+        self._by_stream[stream_key] = codec
+        return codec
+
+    @staticmethod
+    def _create(compression_config: CompressionConfig) -> Tuple[Optional[Codec], CompressionConfig]:
+        return create_codec(compression_config), compression_config
+
+    def compress(self, stream_key: str, msg_bytes: bytes, fields: Optional[Dict[str, str]]) -> Tuple[bytes, Optional[Dict[str, str]]]:
+        codec, compression_config = self._codec_for(stream_key)
+        if codec is None or len(msg_bytes) < compression_config.min_size_bytes:
+            return msg_bytes, fields
+
+        with COMPRESSION_DURATION.time():
+            compressed = codec.compress(msg_bytes)
+
+        COMPRESSION_RAW_BYTES.labels(stream_key).inc(len(msg_bytes))
+        if len(compressed) >= len(msg_bytes):
+            COMPRESSION_COMPRESSED_BYTES.labels(stream_key).inc(len(msg_bytes))
+            return msg_bytes, fields
+        COMPRESSION_COMPRESSED_BYTES.labels(stream_key).inc(len(compressed))
+
+        # `fields` may be shared between messages, so it must not be modified
+        marked_fields = dict(fields) if fields is not None else {}
+        marked_fields.update(codec_fields(codec))
+        return compressed, marked_fields
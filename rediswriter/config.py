@@ -1,37 +1,193 @@
-from typing import List
+from enum import Enum
+from typing import List, Optional, Tuple, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing_extensions import Annotated
 from visionlib.pipeline.settings import LogLevel, YamlConfigSettingsSource
 
 
+class TransformMode(str, Enum):
+    PROTO = 'PROTO'
+    WIRE = 'WIRE'
+
+class ExecutionMode(str, Enum):
+    INLINE = 'INLINE'
+    THREAD = 'THREAD'
+    PROCESS = 'PROCESS'
+
+class PipelineMode(str, Enum):
+    THREADED = 'THREADED'
+    ASYNCIO = 'ASYNCIO'
+
+class PatternType(str, Enum):
+    GLOB = 'GLOB'
+    REGEX = 'REGEX'
+
+class Priority(str, Enum):
+    HIGH = 'HIGH'
+    NORMAL = 'NORMAL'
+    LOW = 'LOW'
+
+class ConflationKey(str, Enum):
+    STREAM = 'STREAM'
+    SOURCE = 'SOURCE'
+
+class GeofenceCoordinates(str, Enum):
+    BOUNDING_BOX = 'BOUNDING_BOX'
+    GEO = 'GEO'
+
+class CheckpointStore(str, Enum):
+    FILE = 'FILE'
+    REDIS = 'REDIS'
+
+class FsyncPolicy(str, Enum):
+    ALWAYS = 'ALWAYS'
+    SEGMENT = 'SEGMENT'
+    NEVER = 'NEVER'
+
 class RedisConfig(BaseModel):
     host: str = 'localhost'
     port: Annotated[int, Field(ge=1, le=65536)] = 6379
+    read_count: Annotated[int, Field(ge=1)] = 100
+    read_block_ms: Annotated[int, Field(ge=1)] = 1000
+    discovery_interval_s: Annotated[float, Field(gt=0)] = 30
+
+class CompressionConfig(BaseModel):
+    codec: str = 'none'
+    level: Optional[int] = None
+    dictionary_path: Optional[str] = None
+    min_size_bytes: Annotated[int, Field(ge=0)] = 256
+
+class SpillConfig(BaseModel):
+    enabled: bool = False
+    directory: str = 'spill'
+    segment_size_bytes: Annotated[int, Field(ge=1)] = 16_000_000
+    max_bytes: Annotated[int, Field(ge=1)] = 1_000_000_000
+    retention_s: Annotated[float, Field(gt=0)] = 3600
+    fsync: FsyncPolicy = FsyncPolicy.SEGMENT
+    replay_batch_size: Annotated[int, Field(ge=1)] = 1000
+    replay_batch_bytes: Annotated[int, Field(ge=1)] = 16_000_000
+
+class AdaptiveBatchingConfig(BaseModel):
+    enabled: bool = False
+    min_batch_size: Annotated[int, Field(ge=1)] = 1
+    min_batch_bytes: Annotated[int, Field(ge=1)] = 64_000
+    target_duration_ms: Annotated[float, Field(gt=0)] = 1000
+    increase_step: Annotated[int, Field(ge=1)] = 10
+    decrease_factor: Annotated[float, Field(gt=0, lt=1)] = 0.5
+
+class BandwidthConfig(BaseModel):
+    max_bytes_per_s: Optional[Annotated[int, Field(ge=1)]] = None
+    burst_bytes: Annotated[int, Field(ge=1)] = 1_000_000
+
+class PackingConfig(BaseModel):
+    enabled: bool = False
+    max_messages: Annotated[int, Field(ge=1)] = 20
+    max_bytes: Annotated[int, Field(ge=1)] = 256_000
 
 class TargetRedisConfig(BaseModel):
+    # Required if there is more than one target (used in metrics and to assign mappings to targets)
+    name: Optional[str] = None
     host: str
     port: Annotated[int, Field(ge=1, le=65536)]
     buffer_length: Annotated[int, Field(ge=1)] = 100
+    buffer_max_bytes: Annotated[int, Field(ge=1)] = 64_000_000
     target_stream_maxlen: Annotated[int, Field(ge=1)] = 100
     tls: bool = False
     socket_timeout_s: Annotated[float, Field(ge=0)] = 5
+    spill: SpillConfig = SpillConfig()
+    compression: CompressionConfig = CompressionConfig()
+    linger_ms: Annotated[float, Field(ge=0)] = 5
+    max_batch_size: Annotated[int, Field(ge=1)] = 100
+    max_batch_bytes: Annotated[int, Field(ge=1)] = 4_000_000
+    adaptive_batching: AdaptiveBatchingConfig = AdaptiveBatchingConfig()
+    bandwidth: BandwidthConfig = BandwidthConfig()
+    packing: PackingConfig = PackingConfig()
+    sender_workers: Annotated[int, Field(ge=1)] = 1
     
+class CheckpointConfig(BaseModel):
+    enabled: bool = False
+    store: CheckpointStore = CheckpointStore.FILE
+    path: str = 'checkpoints.json'
+    key: str = 'rediswriter:checkpoints'
+    interval_s: Annotated[float, Field(gt=0)] = 5
+    catch_up_read_count: Annotated[int, Field(ge=1)] = 1000
+    catch_up_batch_size: Annotated[int, Field(ge=1)] = 1000
+    catch_up_batch_bytes: Annotated[int, Field(ge=1)] = 16_000_000
+
+class TransformPoolConfig(BaseModel):
+    mode: ExecutionMode = ExecutionMode.INLINE
+    workers: Annotated[int, Field(ge=1)] = 4
+    max_in_flight: Annotated[int, Field(ge=1)] = 256
+    
+class RateLimitConfig(BaseModel):
+    max_rate_hz: Optional[Annotated[float, Field(gt=0)]] = None
+    keep_every_nth: Optional[Annotated[int, Field(ge=1)]] = None
+    min_interval_ms: Optional[Annotated[int, Field(ge=0)]] = None
+
+class ProjectionConfig(BaseModel):
+    include: Optional[List[str]] = None
+    exclude: Optional[List[str]] = None
+
+class GeofenceConfig(BaseModel):
+    coordinates: GeofenceCoordinates = GeofenceCoordinates.BOUNDING_BOX
+    # Vertices as [x, y] (bottom center of the bounding box) or [longitude, latitude]
+    polygon: Annotated[List[Tuple[float, float]], Field(min_length=3)]
+
+class DetectionFilterConfig(BaseModel):
+    min_confidence: Optional[Annotated[float, Field(ge=0, le=1)]] = None
+    class_ids: Optional[List[int]] = None
+    geofence: Optional[GeofenceConfig] = None
+
 class MappingConfig(BaseModel):
     source: str = None
+    source_pattern: Optional[str] = None
+    pattern_type: PatternType = PatternType.GLOB
     target: str = None
+    compression: Optional[CompressionConfig] = None
+    rate_limit: Optional[RateLimitConfig] = None
+    projection: Optional[ProjectionConfig] = None
+    detection_filter: Optional[DetectionFilterConfig] = None
+    priority: Optional[Priority] = None
+    # Keep only the newest pending message per target stream (STREAM) or per target stream and `frame.source_id` (SOURCE)
+    conflate: Optional[ConflationKey] = None
+    # Names of the targets the mapping is delivered to (all targets if not set)
+    targets: Optional[List[str]] = None
 
 class RedisWriterConfig(BaseSettings):
     log_level: LogLevel = LogLevel.WARNING
     redis: RedisConfig = RedisConfig()
-    target_redis: TargetRedisConfig
+    target_redis: Union[TargetRedisConfig, Annotated[List[TargetRedisConfig], Field(min_length=1)]]
     remove_frame_data: bool = True
+    transform_mode: TransformMode = TransformMode.PROTO
+    transform_pool: TransformPoolConfig = TransformPoolConfig()
+    pipeline_mode: PipelineMode = PipelineMode.THREADED
+    checkpoint: CheckpointConfig = CheckpointConfig()
     prometheus_port: Annotated[int, Field(gt=1024, le=65536)] = 8000
     mapping_config: List[MappingConfig]
+    aggregate_stream: Optional[str] = None
 
     model_config = SettingsConfigDict(env_nested_delimiter='__')
 
+    @property
+    def targets(self) -> List[TargetRedisConfig]:
+        return self.target_redis if isinstance(self.target_redis, list) else [self.target_redis]
+
+    @model_validator(mode='after')
+    def check_target_names(self):
+        if isinstance(self.target_redis, list) and len(self.target_redis) == 1:
+            # Everything that only handles a single target reads `target_redis` directly
+            self.target_redis = self.target_redis[0]
+        names = [target.name for target in self.targets]
+        if len(names) > 1 and (None in names or len(set(names)) < len(names)):
+            raise ValueError('Every target needs a unique name if there are several targets')
+        for mapping in self.mapping_config:
+            unknown = set(mapping.targets or ()) - set(names)
+            if len(unknown) > 0:
+                raise ValueError(f'Mapping refers to unknown targets {sorted(unknown)}')
+        return self
+
     @classmethod
     def settings_customise_sources(cls, settings_cls, init_settings, env_settings, dotenv_settings, file_secret_settings):
         return (init_settings, env_settings, YamlConfigSettingsSource(settings_cls), file_secret_settings)
\ No newline at end of file
@@ -0,0 +1,50 @@
+from typing import Dict, Hashable, Optional
+
+from prometheus_client import Counter
+
+from .config import ConflationKey, RedisWriterConfig
+from .mapping import MappingTable
+from .routing import ENVELOPE_SOURCE_FIELD
+from .wire import peek_sae_source_id
+
+CONFLATED_COUNTER = Counter('redis_writer_conflated_counter', 'How many pending messages were replaced by a newer message with the same conflation key', ['stream'])
+
+
+class Conflator:
+    '''Determines the conflation key of outgoing messages from `MappingConfig.conflate` (None if the message must not be conflated).
+    Keys only have to be unique within one target stream, as the buffer conflates per stream.
+    In aggregation mode the mapping is looked up by the source stream in the envelope, which is also part of the key.'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self._mapping_table = MappingTable(config.mapping_config)
+        self._aggregate_stream = config.aggregate_stream
+        self._enabled = any(mapping.conflate is not None for mapping in config.mapping_config)
+        self._modes: Dict[str, Optional[ConflationKey]] = {}
+
+    def _mode(self, stream_key: str, by_source: bool) -> Optional[ConflationKey]:
+        try:
+            return self._modes[stream_key]
+        except KeyError:
+            pass
+        mapping = self._mapping_table.mapping_for(stream_key) if by_source else self._mapping_table.mapping_for_target(stream_key)
+        mode = mapping.conflate if mapping is not None else None
+        self._modes[stream_key] = mode
+        return mode
+
+    def key_for(self, stream_key: str, msg_bytes: bytes, fields: Optional[Dict[str, str]]) -> Optional[Hashable]:
+        '''Must be called with the uncompressed message'''
+        if not self._enabled:
+            return None
+        source = None
+        if stream_key == self._aggregate_stream and fields is not None:
+            source = fields.get(ENVELOPE_SOURCE_FIELD)
+            mode = self._mode(source, by_source=True) if source is not None else None
+        else:
+            mode = self._mode(stream_key, by_source=False)
+
+        if mode is None:
+            return None
+        if mode == ConflationKey.SOURCE:
+            # Messages without a source id (e.g. positions) are conflated per stream
+            return (source, peek_sae_source_id(msg_bytes))
+        return (source, None)
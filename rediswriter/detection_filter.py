@@ -0,0 +1,157 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from google.protobuf.message import DecodeError
+from prometheus_client import Counter
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import SaeMessage
+
+from .config import (DetectionFilterConfig, GeofenceCoordinates,
+                     RedisWriterConfig)
+from .mapping import MappingTable
+from .wire import peek_message_type
+
+DETECTION_FILTER_INPUT_COUNTER = Counter('redis_writer_detection_filter_input_counter', 'How many detections were checked by the detection filter', ['stream'])
+DETECTION_FILTER_REMOVED_COUNTER = Counter('redis_writer_detection_filter_removed_counter', 'How many detections were removed by the detection filter', ['stream'])
+DETECTION_FILTER_SAVED_BYTES = Counter('redis_writer_detection_filter_saved_bytes', 'How many message bytes were saved by removing detections', ['stream'])
+
+
+class DetectionColumns(NamedTuple):
+    '''The values the filter rules need, one list entry per detection'''
+    confidences: List[float]
+    class_ids: List[int]
+    xs: List[float]
+    ys: List[float]
+
+
+def read_columns(detections, coordinates: Optional[GeofenceCoordinates]) -> DetectionColumns:
+    '''Extracts the values the rules need from the (parsed) detections of a message'''
+    columns = DetectionColumns([detection.confidence for detection in detections], [detection.class_id for detection in detections], [], [])
+    if coordinates == GeofenceCoordinates.BOUNDING_BOX:
+        boxes = [detection.bounding_box for detection in detections]
+        # Objects touch the ground at the bottom center of their bounding box
+        columns.xs.extend((box.min_x + box.max_x) / 2 for box in boxes)
+        columns.ys.extend(box.max_y for box in boxes)
+    elif coordinates == GeofenceCoordinates.GEO:
+        geo_coordinates = [detection.geo_coordinate for detection in detections]
+        columns.xs.extend(geo.longitude for geo in geo_coordinates)
+        columns.ys.extend(geo.latitude for geo in geo_coordinates)
+    return columns
+
+
+class CompiledFilter:
+    '''The rules of one `DetectionFilterConfig`, evaluated column by column over all detections of a message'''
+
+    def __init__(self, config: DetectionFilterConfig) -> None:
+        self.min_confidence = config.min_confidence
+        self.class_ids = frozenset(config.class_ids) if config.class_ids is not None else None
+        self.coordinates = config.geofence.coordinates if config.geofence is not None else None
+        self.edges: List[Tuple[float, float, float, float]] = []
+        if config.geofence is not None:
+            polygon = config.geofence.polygon
+            for (x1, y1), (x2, y2) in zip(polygon, polygon[1:] + polygon[:1]):
+                # Horizontal edges are never crossed by the (horizontal) test ray
+                if y1 != y2:
+                    self.edges.append((x1, y1, y2, (x2 - x1) / (y2 - y1)))
+
+    def keep(self, columns: DetectionColumns) -> List[bool]:
+        '''Returns the mask of the detections that pass all rules'''
+        mask = [True] * len(columns.confidences)
+        if self.min_confidence is not None:
+            mask = [confidence >= self.min_confidence for confidence in columns.confidences]
+        if self.class_ids is not None:
+            mask = [keep and class_id in self.class_ids for keep, class_id in zip(mask, columns.class_ids)]
+        if self.coordinates is not None:
+            candidates = [idx for idx, keep in enumerate(mask) if keep]
+            for idx, inside in zip(candidates, self.inside([columns.xs[idx] for idx in candidates], [columns.ys[idx] for idx in candidates])):
+                mask[idx] = inside
+        return mask
+
+    def inside(self, xs: List[float], ys: List[float]) -> List[bool]:
+        '''Even-odd rule: a point is inside if a ray from it to the right crosses the polygon outline an odd number of times'''
+        inside = [False] * len(xs)
+        for x1, y1, y2, slope in self.edges:
+            for idx, (x, y) in enumerate(zip(xs, ys)):
+                if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * slope:
+                    inside[idx] = not inside[idx]
+        return inside
+
+
+def filter_detections(sae_msg: SaeMessage, detection_filter: CompiledFilter) -> Tuple[int, int]:
+    '''Removes the detections that do not pass the filter from `sae_msg` (in place).
+    Returns the number of detections and the number of removed detections.'''
+    detections = sae_msg.detections
+    if len(detections) == 0:
+        return 0, 0
+    mask = detection_filter.keep(read_columns(detections, detection_filter.coordinates))
+    removed = mask.count(False)
+    if removed > 0:
+        # Deleting from the back keeps the indices valid (and is cheaper than copying the kept detections)
+        for idx in reversed(range(len(mask))):
+            if not mask[idx]:
+                del detections[idx]
+    return len(mask), removed
+
+
+class DetectionFilter:
+    '''Holds the compiled detection filters of all mapped source streams (see `MappingConfig.detection_filter`)'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self._mapping_table = MappingTable(config.mapping_config)
+        self._filters_by_mapping: Dict[int, CompiledFilter] = {
+            id(mapping): CompiledFilter(mapping.detection_filter)
+            for mapping in config.mapping_config
+            if mapping.detection_filter is not None
+        }
+        self._filters: Dict[str, Optional[CompiledFilter]] = {}
+
+    def _filter_for(self, stream_key: str) -> Optional[CompiledFilter]:
+        try:
+            return self._filters[stream_key]
+        except KeyError:
+            pass
+        mapping = self._mapping_table.mapping_for(stream_key)
+        detection_filter = self._filters_by_mapping.get(id(mapping)) if mapping is not None else None
+        self._filters[stream_key] = detection_filter
+        return detection_filter
+
+    def _count(self, stream_key: str, detections: int, removed: int, saved_bytes: int) -> None:
+        DETECTION_FILTER_INPUT_COUNTER.labels(stream_key).inc(detections)
+        if removed > 0:
+            DETECTION_FILTER_REMOVED_COUNTER.labels(stream_key).inc(removed)
+            DETECTION_FILTER_SAVED_BYTES.labels(stream_key).inc(saved_bytes)
+
+    def apply_message(self, stream_key: Optional[str], sae_msg: SaeMessage) -> SaeMessage:
+        '''Filters an already parsed SaeMessage (in place)'''
+        if stream_key is None or len(self._filters_by_mapping) == 0:
+            return sae_msg
+        detection_filter = self._filter_for(stream_key)
+        if detection_filter is None:
+            return sae_msg
+
+        size = sae_msg.ByteSize()
+        detections, removed = filter_detections(sae_msg, detection_filter)
+        self._count(stream_key, detections, removed, size - sae_msg.ByteSize() if removed > 0 else 0)
+        return sae_msg
+
+    def apply(self, stream_key: Optional[str], proto_bytes: bytes) -> bytes:
+        '''Filters a serialized message (only SaeMessages are touched)'''
+        if stream_key is None or len(self._filters_by_mapping) == 0:
+            return proto_bytes
+        detection_filter = self._filter_for(stream_key)
+        if detection_filter is None:
+            return proto_bytes
+
+        try:
+            if peek_message_type(proto_bytes) != MessageType.SAE:
+                return proto_bytes
+            sae_msg = SaeMessage.FromString(proto_bytes)
+        except DecodeError:
+            # Not ours to judge, malformed messages are forwarded like without a filter
+            return proto_bytes
+        detections, removed = filter_detections(sae_msg, detection_filter)
+        if removed == 0:
+            self._count(stream_key, detections, 0, 0)
+            return proto_bytes
+        filtered = sae_msg.SerializeToString()
+        self._count(stream_key, detections, removed, len(proto_bytes) - len(filtered))
+        return filtered
@@ -0,0 +1,105 @@
+import os
+import re
+from contextlib import AsyncExitStack, ExitStack
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from .buffer import BufferEntry
+from .config import RedisWriterConfig
+from .sender import EntryPreparer, OutgoingMessage
+
+# Returns the names of the targets a message for the target stream is delivered to (None: all targets), see `Router.targets_for`
+TargetsFor = Callable[[str, Optional[Dict[str, str]]], Optional[FrozenSet[str]]]
+
+
+def needs_fan_out(config: RedisWriterConfig) -> bool:
+    return len(config.targets) > 1 or any(mapping.targets is not None for mapping in config.mapping_config)
+
+
+def target_configs(config: RedisWriterConfig) -> List[RedisWriterConfig]:
+    '''One config per target (with a single `target_redis`, as expected by `Sender`).
+    If there are several targets, their spill files are kept in a subdirectory per target name.'''
+    targets = config.targets
+    if len(targets) == 1:
+        return [config.model_copy(update={'target_redis': targets[0]})]
+
+    configs = []
+    for target in targets:
+        spill = target.spill.model_copy(update={'directory': os.path.join(target.spill.directory, re.sub(r'[^\w.-]', '_', target.name))})
+        configs.append(config.model_copy(update={'target_redis': target.model_copy(update={'spill': spill})}))
+    return configs
+
+
+class _FanOutBase:
+    '''Hands every message to the senders of all targets it is delivered to.
+    Messages are transformed once, but every target has its own buffer, connection and backoff,
+    so an unreachable target only fills (and evicts from or spills) its own buffer.'''
+
+    def __init__(self, names: List[str], senders: List, targets_for: TargetsFor) -> None:
+        self._names = names
+        self._senders = senders
+        self._targets_for = targets_for
+        # Entries only differ between targets with a different default compression, so every message is prepared
+        # (peeked, classified and compressed) once per distinct compression config instead of once per target
+        preparers: Dict[str, EntryPreparer] = {}
+        self._preparers = [preparers.setdefault(sender.preparer.default_compression.model_dump_json(), sender.preparer) for sender in senders]
+
+    def _publish(self, stream_key, msg_bytes, fields=None):
+        self.publish_batch([(stream_key, msg_bytes, fields)])
+
+    def publish_batch(self, items: List[OutgoingMessage]):
+        item_targets = [self._targets_for(item[0], item[2]) for item in items]
+        prepared: Dict[int, List[Optional[BufferEntry]]] = {}
+        for name, sender, preparer in zip(self._names, self._senders, self._preparers):
+            indices = [idx for idx, targets in enumerate(item_targets) if targets is None or name in targets]
+            if len(indices) == 0:
+                continue
+            entries = prepared.setdefault(id(preparer), [None] * len(items))
+            for idx in indices:
+                if entries[idx] is None:
+                    entries[idx] = preparer.prepare(*items[idx])
+            sender.publish_entries([entries[idx] for idx in indices])
+
+    def pending_since(self) -> Optional[float]:
+        return min((since for since in (sender.pending_since() for sender in self._senders) if since is not None), default=None)
+
+    def has_room(self) -> bool:
+        return all(sender.has_room() for sender in self._senders)
+
+    def room(self) -> int:
+        return min(sender.room() for sender in self._senders)
+
+    def set_catch_up(self, catch_up: bool):
+        for sender in self._senders:
+            sender.set_catch_up(catch_up)
+
+
+class FanOutSender(_FanOutBase):
+    '''Fans out to several `Sender`s (one per target)'''
+
+    def __init__(self, names: List[str], senders: List, targets_for: TargetsFor) -> None:
+        super().__init__(names, senders, targets_for)
+        self._exit_stack = ExitStack()
+
+    def __enter__(self):
+        for sender in self._senders:
+            self._exit_stack.enter_context(sender)
+        return self._publish
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._exit_stack.__exit__(exc_type, exc_value, traceback)
+
+
+class AsyncFanOutSender(_FanOutBase):
+    '''Fans out to several `AsyncSender`s (one per target)'''
+
+    def __init__(self, names: List[str], senders: List, targets_for: TargetsFor) -> None:
+        super().__init__(names, senders, targets_for)
+        self._exit_stack = AsyncExitStack()
+
+    async def __aenter__(self):
+        for sender in self._senders:
+            await self._exit_stack.enter_async_context(sender)
+        return self._publish
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return await self._exit_stack.__aexit__(exc_type, exc_value, traceback)
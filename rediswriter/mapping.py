@@ -0,0 +1,174 @@
+import re
+import string
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+from .config import MappingConfig, PatternType
+
+
+class SourcePattern(NamedTuple):
+    mapping: MappingConfig
+    source_regex: Pattern
+    # Matches all target stream keys the target template can produce
+    target_regex: Pattern
+    # Pattern for `SCAN MATCH` (regex patterns cannot be translated, so all streams are scanned)
+    scan_match: str
+
+
+def _class_to_regex(glob: str, pos: int) -> Tuple[str, int]:
+    '''Translates the character class starting after its `[` at `pos`, returns the regex and the position after the class'''
+    negate = pos < len(glob) and glob[pos] == '^'
+    if negate:
+        pos += 1
+    items = []
+    while pos < len(glob) and glob[pos] != ']':
+        if glob[pos] == '\\' and pos + 1 < len(glob):
+            items.append(re.escape(glob[pos + 1]))
+            pos += 2
+        elif pos + 2 < len(glob) and glob[pos + 1] == '-':
+            # Like Redis, reversed ranges are accepted
+            start, end = sorted((glob[pos], glob[pos + 2]))
+            items.append(f'{re.escape(start)}-{re.escape(end)}')
+            pos += 3
+        else:
+            items.append(re.escape(glob[pos]))
+            pos += 1
+    if len(items) == 0:
+        # `[]` never matches and `[^]` matches any character
+        return (r'[\s\S]' if negate else r'[^\s\S]'), pos + 1
+    return f'[{"^" if negate else ""}{"".join(items)}]', pos + 1
+
+
+def glob_to_regex(glob: str) -> str:
+    '''Translates a Redis style glob (`*`, `?`, `[...]` classes, `\\` escapes) into a regex with one capture group per wildcard.
+    Follows the semantics of `SCAN MATCH` (Redis `stringmatchlen`), so that routing matches exactly the streams discovery finds,
+    including its leniency: an unterminated class extends to the end of the pattern and a trailing backslash is literal.'''
+    parts = []
+    pos = 0
+    while pos < len(glob):
+        char = glob[pos]
+        pos += 1
+        if char == '*':
+            parts.append('(.*)')
+        elif char == '?':
+            parts.append('(.)')
+        elif char == '[':
+            char_class, pos = _class_to_regex(glob, pos)
+            parts.append(f'({char_class})')
+        elif char == '\\' and pos < len(glob):
+            parts.append(re.escape(glob[pos]))
+            pos += 1
+        else:
+            parts.append(re.escape(char))
+    return ''.join(parts)
+
+
+def _template_to_regex(template: str) -> str:
+    parts = []
+    for literal, field_name, _, _ in string.Formatter().parse(template):
+        parts.append(re.escape(literal))
+        if field_name is not None:
+            parts.append('.*')
+    return ''.join(parts)
+
+
+def _check_template(template: str, source_regex: Pattern) -> None:
+    '''Formats the target template with placeholder groups, so that invalid references fail at startup instead of in the hot path'''
+    groups = [''] * source_regex.groups
+    named_groups = {name: '' for name in source_regex.groupindex}
+    try:
+        template.format(*groups, source='', **named_groups)
+    except (KeyError, IndexError, AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid target template {template!r} for source pattern {source_regex.pattern!r}: {e!r}') from e
+
+
+def compile_source_pattern(mapping: MappingConfig) -> SourcePattern:
+    if mapping.pattern_type == PatternType.GLOB:
+        source_regex = glob_to_regex(mapping.source_pattern)
+        scan_match = mapping.source_pattern
+    else:
+        source_regex = mapping.source_pattern
+        scan_match = '*'
+
+    # Glob wildcards match any character, including newlines (like `SCAN MATCH`)
+    flags = re.DOTALL if mapping.pattern_type == PatternType.GLOB else 0
+    compiled_source_regex = re.compile(source_regex, flags)
+    if mapping.target is not None:
+        _check_template(mapping.target, compiled_source_regex)
+    target_regex = _template_to_regex(mapping.target) if mapping.target is not None else source_regex
+    return SourcePattern(mapping, compiled_source_regex, re.compile(target_regex, re.DOTALL), scan_match)
+
+
+class MappingTable:
+    '''Resolves concrete stream keys to their `MappingConfig` (exact sources first, then patterns in config order).
+    Results are cached per key, so that lookups in the hot loop stay O(1) after the first message of a stream.
+    Target templates are formatted with the positional and named groups of the match and `source` (the source stream key).
+    Templates referring to groups the pattern does not have raise ValueError on construction.'''
+
+    def __init__(self, mapping_config: List[MappingConfig]) -> None:
+        self._exact_sources: Dict[str, MappingConfig] = {}
+        self._exact_targets: Dict[str, MappingConfig] = {}
+        self._patterns: List[SourcePattern] = []
+        for mapping in mapping_config:
+            if mapping.source is not None:
+                self._exact_sources[mapping.source] = mapping
+                self._exact_targets[mapping.target if mapping.target is not None else mapping.source] = mapping
+            elif mapping.source_pattern is not None:
+                self._patterns.append(compile_source_pattern(mapping))
+
+        self._by_source: Dict[str, Optional[Tuple[MappingConfig, str]]] = {}
+        self._by_target: Dict[str, Optional[MappingConfig]] = {}
+
+    @property
+    def source_streams(self):
+        '''The exact source stream keys (pattern matches have to be discovered)'''
+        return self._exact_sources.keys()
+
+    @property
+    def scan_matches(self) -> List[str]:
+        return list(dict.fromkeys(pattern.scan_match for pattern in self._patterns))
+
+    def matches(self, stream_key: str) -> bool:
+        return self.resolve(stream_key) is not None
+
+    def resolve(self, stream_key: str) -> Optional[Tuple[MappingConfig, str]]:
+        '''Returns the mapping and the target stream key, or None if the stream is not mapped'''
+        try:
+            return self._by_source[stream_key]
+        except KeyError:
+            pass
+
+        resolved = None
+        mapping = self._exact_sources.get(stream_key)
+        if mapping is not None:
+            resolved = (mapping, mapping.target if mapping.target is not None else stream_key)
+        else:
+            for pattern in self._patterns:
+                match = pattern.source_regex.fullmatch(stream_key)
+                if match is None:
+                    continue
+                target = stream_key
+                if pattern.mapping.target is not None:
+                    target = pattern.mapping.target.format(*match.groups(), source=stream_key, **match.groupdict())
+                resolved = (pattern.mapping, target)
+                break
+
+        self._by_source[stream_key] = resolved
+        return resolved
+
+    def mapping_for(self, stream_key: str) -> Optional[MappingConfig]:
+        resolved = self.resolve(stream_key)
+        return resolved[0] if resolved is not None else None
+
+    def mapping_for_target(self, target_stream: str) -> Optional[MappingConfig]:
+        '''Finds the mapping that produces `target_stream` (used where only the target is known, e.g. in the sender)'''
+        try:
+            return self._by_target[target_stream]
+        except KeyError:
+            pass
+
+        mapping = self._exact_targets.get(target_stream)
+        if mapping is None:
+            mapping = next((pattern.mapping for pattern in self._patterns if pattern.target_regex.fullmatch(target_stream)), None)
+
+        self._by_target[target_stream] = mapping
+        return mapping
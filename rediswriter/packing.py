@@ -0,0 +1,72 @@
+from typing import Dict, List
+
+from google.protobuf.message import DecodeError
+from prometheus_client import Histogram
+
+from .buffer import BufferEntry
+from .config import PackingConfig
+from .wire import _encode_varint, read_varint
+
+# Marks packed stream entries, the value is the number of messages in the entry
+PACKED_FIELD = 'packed'
+
+PACK_SIZE = Histogram('redis_writer_pack_size', 'How many messages were published in one target stream entry (observed per publish attempt)', ['stream'],
+                      buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+def frame_messages(messages: List[bytes]) -> bytes:
+    '''Concatenates the messages, each prefixed with its length as a varint (like protobuf's `writeDelimitedTo`)'''
+    return b''.join(_encode_varint(len(message)) + message for message in messages)
+
+
+def split_frames(data: bytes) -> List[bytes]:
+    '''Reverses `frame_messages`'''
+    buf = memoryview(data)
+    messages = []
+    pos = 0
+    while pos < len(buf):
+        length, pos = read_varint(buf, pos)
+        if pos + length > len(buf):
+            raise DecodeError('Truncated frame')
+        messages.append(bytes(buf[pos:pos + length]))
+        pos += length
+    return messages
+
+
+def _packed_size(msg_bytes: bytes) -> int:
+    return len(_encode_varint(len(msg_bytes))) + len(msg_bytes)
+
+
+def _pack(entries: List[BufferEntry]) -> BufferEntry:
+    if len(entries) == 1:
+        # Single messages are published as usual, so that consumers only have to handle packed entries if packing pays off
+        return entries[0]
+    first = entries[0]
+    fields = dict(first.fields) if first.fields is not None else {}
+    fields[PACKED_FIELD] = str(len(entries))
+    return BufferEntry(first.stream_key, frame_messages([entry.msg_bytes for entry in entries]), fields,
+                       entries[-1].frame_timestamp_ms, first.priority)
+
+
+def pack_entries(batch: List[BufferEntry], config: PackingConfig) -> List[BufferEntry]:
+    '''Combines the messages of a batch into as few entries per target stream as `max_messages` and `max_bytes` allow.
+    Only consecutive messages (within their stream) with the same additional fields end up in the same entry, so the order per stream is kept.
+    Packs are bounded in time by the batching, i.e. messages are never held back to fill a pack.'''
+    packs: List[List[BufferEntry]] = []
+    # The pack that is currently being filled and its size, per stream
+    open_packs: Dict[str, List[BufferEntry]] = {}
+    open_bytes: Dict[str, int] = {}
+    for entry in batch:
+        size = _packed_size(entry.msg_bytes)
+        pack = open_packs.get(entry.stream_key)
+        if (pack is None or len(pack) >= config.max_messages or open_bytes[entry.stream_key] + size > config.max_bytes or
+                pack[0].fields != entry.fields):
+            pack = open_packs[entry.stream_key] = []
+            open_bytes[entry.stream_key] = 0
+            packs.append(pack)
+        pack.append(entry)
+        open_bytes[entry.stream_key] += size
+
+    for pack in packs:
+        PACK_SIZE.labels(pack[0].stream_key).observe(len(pack))
+    return [_pack(pack) for pack in packs]
@@ -0,0 +1,128 @@
+from typing import Dict, List, NamedTuple, Optional
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from prometheus_client import Counter
+from visionapi.sae_pb2 import SaeMessage
+
+from .config import ProjectionConfig, RedisWriterConfig
+from .mapping import MappingTable
+from .wire import (TYPE_FIELD_NUMBER, WIRETYPE_LENGTH_DELIMITED, _encode_tag,
+                   _encode_varint, iter_fields)
+
+PROJECTION_INPUT_BYTES = Counter('redis_writer_projection_input_bytes', 'How many message bytes were handed to the field projection', ['stream'])
+PROJECTION_OUTPUT_BYTES = Counter('redis_writer_projection_output_bytes', 'How many message bytes were left after the field projection', ['stream'])
+
+
+class ProjectionPlan(NamedTuple):
+    '''One node of a compiled projection, keyed by field number.
+    If `include` is set, only the listed fields are kept, otherwise the listed fields are removed.
+    A child of None applies to the whole field, a child plan is applied to the (sub message) value.'''
+    include: bool
+    children: Dict[int, Optional['ProjectionPlan']]
+
+
+def compile_projection(config: ProjectionConfig, descriptor: Descriptor = SaeMessage.DESCRIPTOR) -> ProjectionPlan:
+    '''Resolves the field paths (e.g. `detections.feature`) against the message schema. Raises ValueError for invalid paths.'''
+    if (config.include is None) == (config.exclude is None):
+        raise ValueError('Exactly one of projection.include and projection.exclude must be set')
+
+    include = config.include is not None
+    paths = config.include if include else config.exclude
+
+    plan = ProjectionPlan(include, {})
+    for path in paths:
+        _add_path(plan, descriptor, path.split('.'), path)
+
+    # Receivers (and the type detection of this stage) rely on the message type
+    if include:
+        plan.children[TYPE_FIELD_NUMBER] = None
+    elif TYPE_FIELD_NUMBER in plan.children:
+        raise ValueError('The type field cannot be excluded')
+
+    return plan
+
+
+def _add_path(plan: ProjectionPlan, descriptor: Descriptor, names: List[str], path: str) -> None:
+    field = descriptor.fields_by_name.get(names[0])
+    if field is None:
+        raise ValueError(f'Unknown field {names[0]} in projection path {path}')
+
+    if len(names) == 1:
+        # A whole field supersedes any sub paths
+        plan.children[field.number] = None
+        return
+
+    if field.type != FieldDescriptor.TYPE_MESSAGE:
+        raise ValueError(f'Field {names[0]} in projection path {path} is not a message')
+    if field.number in plan.children and plan.children[field.number] is None:
+        return
+    child = plan.children.setdefault(field.number, ProjectionPlan(plan.include, {}))
+    _add_path(child, field.message_type, names[1:], path)
+
+
+def project(proto_bytes: bytes, plan: ProjectionPlan) -> bytes:
+    '''Applies a projection directly on the wire format (sub messages are only rewritten where the plan requires it)'''
+    out = bytearray()
+    _project(memoryview(proto_bytes), plan, out)
+    return bytes(out)
+
+
+def _project(buf: memoryview, plan: ProjectionPlan, out: bytearray) -> None:
+    for field_number, wire_type, field_start, value_start, field_end in iter_fields(buf):
+        if field_number not in plan.children:
+            if not plan.include:
+                out += buf[field_start:field_end]
+            continue
+
+        child = plan.children[field_number]
+        if child is None:
+            if plan.include:
+                out += buf[field_start:field_end]
+            continue
+
+        if wire_type != WIRETYPE_LENGTH_DELIMITED:
+            # Does not match the schema (i.e. unknown to the parser anyway), leave it alone
+            out += buf[field_start:field_end]
+            continue
+
+        sub_out = bytearray()
+        _project(buf[value_start:field_end], child, sub_out)
+        out += _encode_tag(field_number, WIRETYPE_LENGTH_DELIMITED)
+        out += _encode_varint(len(sub_out))
+        out += sub_out
+
+
+class FieldProjector:
+    '''Holds the compiled projections of all mapped source streams (see `MappingConfig.projection`)'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self._mapping_table = MappingTable(config.mapping_config)
+        # Compile all plans upfront, so that invalid paths are reported at startup
+        self._plans_by_mapping: Dict[int, ProjectionPlan] = {
+            id(mapping): compile_projection(mapping.projection)
+            for mapping in config.mapping_config
+            if mapping.projection is not None
+        }
+        self._plans: Dict[str, Optional[ProjectionPlan]] = {}
+
+    def _plan_for(self, stream_key: str) -> Optional[ProjectionPlan]:
+        try:
+            return self._plans[stream_key]
+        except KeyError:
+            pass
+        mapping = self._mapping_table.mapping_for(stream_key)
+        plan = self._plans_by_mapping.get(id(mapping)) if mapping is not None else None
+        self._plans[stream_key] = plan
+        return plan
+
+    def apply(self, stream_key: Optional[str], proto_bytes: bytes) -> bytes:
+        if stream_key is None or len(self._plans_by_mapping) == 0:
+            return proto_bytes
+        plan = self._plan_for(stream_key)
+        if plan is None:
+            return proto_bytes
+
+        projected = project(proto_bytes, plan)
+        PROJECTION_INPUT_BYTES.labels(stream_key).inc(len(proto_bytes))
+        PROJECTION_OUTPUT_BYTES.labels(stream_key).inc(len(projected))
+        return projected
@@ -0,0 +1,132 @@
+import base64
+from collections import defaultdict
+from typing import Any, Dict, List, Mapping, Optional
+
+import valkey
+import valkey.asyncio
+from prometheus_client import Counter
+
+from .buffer import BufferEntry
+from .config import PackingConfig, TargetRedisConfig
+from .packing import PACKED_FIELD, pack_entries, split_frames
+from .resp import xadd_size
+
+PAYLOAD_FIELD = 'proto_data_b64'
+
+REDIS_PUBLISH_BYTES_SENT = Counter('redis_writer_target_redis_published_bytes_estimate', 'How many bytes were sent to the Redis stream (RESP encoded size of the XADD commands, see redis_writer_target_wire_bytes)')
+TARGET_WIRE_BYTES = Counter('redis_writer_target_wire_bytes', 'How many bytes were sent to the target per stream (RESP encoded size of the XADD commands, without TLS overhead)', ['target', 'stream'])
+
+
+def redis_args(config: TargetRedisConfig) -> Dict[str, Any]:
+    args = {}
+    if config.tls:
+        args.update({
+            'ssl': True,
+            'ssl_certfile': 'certs/client.crt',
+            'ssl_keyfile': 'certs/client.key',
+            'ssl_cert_reqs': 'required',
+            'ssl_ca_certs': 'certs/ca.crt',
+        })
+    if config.socket_timeout_s:
+        args.update({
+            'socket_timeout': config.socket_timeout_s,
+        })
+    return args
+
+
+def entry_fields(entry: BufferEntry) -> Dict[str, Any]:
+    fields = {PAYLOAD_FIELD: base64.b64encode(entry.msg_bytes)}
+    if entry.fields is not None:
+        fields.update(entry.fields)
+    return fields
+
+
+def decode_entry(fields: Mapping) -> List[bytes]:
+    '''Reference decoder for consumers of the target streams: returns the payloads of a stream entry (as returned by XREAD / XRANGE),
+    which contains several messages if it has been packed. Compressed payloads (see `compression.CODEC_FIELD`) still have to be decompressed.'''
+    def get(name: str):
+        return fields[name] if name in fields else fields.get(name.encode('utf-8'))
+
+    payload = base64.b64decode(get(PAYLOAD_FIELD))
+    if get(PACKED_FIELD) is None:
+        return [payload]
+    return split_frames(payload)
+
+
+def count_wire_bytes(target: str, sizes: Dict[str, int]) -> None:
+    '''Records the RESP sizes of a pipeline (per target stream)'''
+    for stream_key, size in sizes.items():
+        TARGET_WIRE_BYTES.labels(target, stream_key).inc(size)
+    REDIS_PUBLISH_BYTES_SENT.inc(sum(sizes.values()))
+
+
+class StreamPublisher:
+    '''Publishes batches of buffer entries to their target streams using a single (non-transactional) pipeline per batch.
+    Each entry is written as one stream entry containing the base64 encoded payload (like all SAE stages do) plus the entry's extra fields.
+    If `packing` is enabled, the messages of a batch are packed into fewer entries first (see `packing.pack_entries`).'''
+
+    def __init__(self, host: str, port: int, stream_maxlen: int, target_name: Optional[str] = None, packing: Optional[PackingConfig] = None,
+                 **redis_args) -> None:
+        self._host = host
+        self._port = port
+        self._stream_maxlen = stream_maxlen
+        self._target = target_name if target_name is not None else f'{host}:{port}'
+        self._packing = packing if packing is not None and packing.enabled else None
+        self._redis_args = redis_args
+        self._client: valkey.Valkey = None
+
+    def __enter__(self):
+        self._client = valkey.Valkey(host=self._host, port=self._port, **self._redis_args)
+        return self._publish
+
+    def _publish(self, batch: List[BufferEntry]):
+        pipeline = self._client.pipeline(transaction=False)
+        sizes = defaultdict(int)
+        if self._packing is not None:
+            batch = pack_entries(batch, self._packing)
+        for entry in batch:
+            fields = entry_fields(entry)
+            pipeline.xadd(name=entry.stream_key, fields=fields, maxlen=self._stream_maxlen)
+            sizes[entry.stream_key] += xadd_size(entry.stream_key, fields, self._stream_maxlen)
+        # Counted per attempt, as retried pipelines are sent again
+        count_wire_bytes(self._target, sizes)
+        pipeline.execute()
+
+    def __exit__(self, _, __, ___):
+        self._client.close()
+        return False
+
+
+class AsyncStreamPublisher:
+    '''asyncio counterpart of `StreamPublisher`'''
+
+    def __init__(self, host: str, port: int, stream_maxlen: int, target_name: Optional[str] = None, packing: Optional[PackingConfig] = None,
+                 **redis_args) -> None:
+        self._host = host
+        self._port = port
+        self._stream_maxlen = stream_maxlen
+        self._target = target_name if target_name is not None else f'{host}:{port}'
+        self._packing = packing if packing is not None and packing.enabled else None
+        self._redis_args = redis_args
+        self._client: valkey.asyncio.Valkey = None
+
+    async def __aenter__(self):
+        self._client = valkey.asyncio.Valkey(host=self._host, port=self._port, **self._redis_args)
+        return self._publish
+
+    async def _publish(self, batch: List[BufferEntry]):
+        pipeline = self._client.pipeline(transaction=False)
+        sizes = defaultdict(int)
+        if self._packing is not None:
+            batch = pack_entries(batch, self._packing)
+        for entry in batch:
+            fields = entry_fields(entry)
+            pipeline.xadd(name=entry.stream_key, fields=fields, maxlen=self._stream_maxlen)
+            sizes[entry.stream_key] += xadd_size(entry.stream_key, fields, self._stream_maxlen)
+        # Counted per attempt, as retried pipelines are sent again
+        count_wire_bytes(self._target, sizes)
+        await pipeline.execute()
+
+    async def __aexit__(self, _, __, ___):
+        await self._client.aclose()
+        return False
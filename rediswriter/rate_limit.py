@@ -0,0 +1,94 @@
+import time
+from typing import Dict, Optional
+
+from prometheus_client import Counter
+from visionapi.common_pb2 import MessageType
+
+from .config import RateLimitConfig, RedisWriterConfig
+from .mapping import MappingTable
+from .wire import peek_frame_timestamp
+
+RATE_LIMIT_DROPPED_COUNTER = Counter('redis_writer_rate_limit_dropped_counter', 'How many messages were dropped by a rate policy', ['stream', 'policy'])
+
+
+class StreamRateLimiter:
+    '''Applies the rate policies of one source stream. A message is forwarded only if all configured policies let it pass.
+    `keep_every_nth` counts all messages, `min_interval_ms` and `max_rate_hz` only consider forwarded ones.'''
+
+    def __init__(self, stream_key: str, config: RateLimitConfig) -> None:
+        self._config = config
+        self._dropped_counters = {
+            policy: RATE_LIMIT_DROPPED_COUNTER.labels(stream_key, policy)
+            for policy in ('keep_every_nth', 'min_interval_ms', 'max_rate_hz')
+        }
+
+        self._message_count = 0
+        self._last_timestamp: Optional[int] = None
+        # Token bucket with a capacity of one message (i.e. no bursts)
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+
+    def allow(self, message_type: MessageType, proto_data: bytes) -> bool:
+        if self._config.keep_every_nth is not None:
+            self._message_count += 1
+            if (self._message_count - 1) % self._config.keep_every_nth != 0:
+                self._dropped_counters['keep_every_nth'].inc()
+                return False
+
+        timestamp = None
+        if self._config.min_interval_ms is not None:
+            timestamp = _message_timestamp(message_type, proto_data)
+            # A timestamp going backwards (e.g. a restarted source) resets the policy
+            if self._last_timestamp is not None and self._last_timestamp <= timestamp < self._last_timestamp + self._config.min_interval_ms:
+                self._dropped_counters['min_interval_ms'].inc()
+                return False
+
+        if self._config.max_rate_hz is not None:
+            now = time.monotonic()
+            self._tokens = min(1.0, self._tokens + (now - self._last_refill) * self._config.max_rate_hz)
+            self._last_refill = now
+            if self._tokens < 1.0:
+                self._dropped_counters['max_rate_hz'].inc()
+                return False
+            self._tokens -= 1.0
+
+        if timestamp is not None:
+            self._last_timestamp = timestamp
+        return True
+
+
+def _message_timestamp(message_type: MessageType, proto_data: bytes) -> int:
+    timestamp = None
+    if message_type == MessageType.SAE:
+        timestamp = peek_frame_timestamp(proto_data)
+    # Other message types (or frames without timestamp) are limited by arrival time
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    return timestamp
+
+
+class RateLimiter:
+    '''Holds the rate policies of all mapped source streams (see `MappingConfig.rate_limit`).
+    Is applied before the transformation, so that dropped messages never get parsed or sent.'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self._mapping_table = MappingTable(config.mapping_config)
+        # Every concrete stream gets its own limiter (i.e. pattern policies apply per matched stream)
+        self._limiters: Dict[str, Optional[StreamRateLimiter]] = {}
+
+    def allow(self, stream_key: str, message_type: MessageType, proto_data: bytes) -> bool:
+        try:
+            limiter = self._limiters[stream_key]
+        except KeyError:
+            limiter = self._create_limiter(stream_key)
+        if limiter is None:
+            return True
+        return limiter.allow(message_type, proto_data)
+
+    def _create_limiter(self, stream_key: str) -> Optional[StreamRateLimiter]:
+        mapping = self._mapping_table.mapping_for(stream_key)
+        limiter = None
+        if mapping is not None and mapping.rate_limit is not None:
+            limiter = StreamRateLimiter(stream_key, mapping.rate_limit)
+        self._limiters[stream_key] = limiter
+        return limiter
@@ -1,10 +1,14 @@
 import logging
-from typing import Any
+from contextlib import nullcontext
+from typing import Any, List, Optional, Sequence
 
 from prometheus_client import Histogram, Summary
 from visionapi.sae_pb2 import SaeMessage
 
-from .config import RedisWriterConfig
+from .config import RedisWriterConfig, TransformMode
+from .detection_filter import DetectionFilter
+from .projection import FieldProjector
+from .wire import strip_frame_data
 
 logging.basicConfig(format='%(asctime)s %(name)-15s %(levelname)-8s %(processName)-10s %(message)s')
 logger = logging.getLogger(__name__)
@@ -13,24 +17,69 @@ GET_DURATION = Histogram('redis_writer_get_duration', 'The time it takes to dese
                          buckets=(0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.25))
 PROTO_SERIALIZATION_DURATION = Summary('redis_writer_proto_serialization_duration', 'The time it takes to create a serialized output proto')
 PROTO_DESERIALIZATION_DURATION = Summary('redis_writer_proto_deserialization_duration', 'The time it takes to deserialize an input proto')
+GET_BATCH_DURATION = Histogram('redis_writer_get_batch_duration', 'The time it takes to transform a batch of messages',
+                               buckets=(0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 1))
+WIRE_STRIP_DURATION = Summary('redis_writer_wire_strip_duration', 'The time it takes to remove the frame data on the wire format level')
+
+
+def _timer(summary: Summary, timed: bool):
+    return summary.time() if timed else nullcontext()
 
 
 class RedisWriter:
     def __init__(self, config: RedisWriterConfig) -> None:
         self.config = config
         logger.setLevel(self.config.log_level.value)
+        self._detection_filter = DetectionFilter(config)
+        self._projector = FieldProjector(config)
 
-    def __call__(self, input_proto) -> Any:
-        return self.get(input_proto)
+    def __call__(self, input_proto, stream_key: Optional[str] = None) -> Any:
+        return self.get(input_proto, stream_key)
     
     @GET_DURATION.time()
-    def get(self, input_proto):
-        sae_msg = self._unpack_proto(input_proto)
+    def get(self, input_proto, stream_key: Optional[str] = None):
+        '''`stream_key` (the source stream) selects the detection filter and the field projection, if any are configured'''
+        return self._transform(input_proto, stream_key, timed=True)
+
+    @GET_BATCH_DURATION.time()
+    def get_batch(self, input_protos: Sequence[bytes], stream_keys: Sequence[Optional[str]]) -> List[Optional[bytes]]:
+        '''Transforms a batch of messages in one call (the call duration is observed once for the whole batch).
+        Messages that fail to transform are logged and returned as None.'''
+        output_protos = []
+        for input_proto, stream_key in zip(input_protos, stream_keys):
+            try:
+                output_protos.append(self._transform(input_proto, stream_key, timed=False))
+            except Exception:
+                logger.warning('Transformation failed', exc_info=True)
+                output_protos.append(None)
+        return output_protos
+
+    def transform(self, input_proto: bytes, stream_key: Optional[str] = None) -> bytes:
+        '''The transformation behind `get` and `get_batch`, without observing any durations'''
+        return self._transform(input_proto, stream_key, timed=False)
+
+    def _transform(self, input_proto: bytes, stream_key: Optional[str], timed: bool) -> bytes:
+        # The step durations are only observed per message on the `get` path (`get_batch` observes once per batch)
+        if self.config.transform_mode == TransformMode.WIRE:
+            # Semantically identical to the proto path, but never parses (or copies) the frame payload
+            output_proto = input_proto
+            if self.config.remove_frame_data == True:
+                with _timer(WIRE_STRIP_DURATION, timed):
+                    output_proto = strip_frame_data(input_proto)
+            output_proto = self._detection_filter.apply(stream_key, output_proto)
+        else:
+            with _timer(PROTO_DESERIALIZATION_DURATION, timed):
+                sae_msg = SaeMessage()
+                sae_msg.ParseFromString(input_proto)
 
-        if self.config.remove_frame_data == True:
-            sae_msg = self._remove_frame_data(sae_msg)
+            if self.config.remove_frame_data == True:
+                sae_msg = self._remove_frame_data(sae_msg)
+            sae_msg = self._detection_filter.apply_message(stream_key, sae_msg)
 
-        return self._pack_proto(sae_msg)
+            with _timer(PROTO_SERIALIZATION_DURATION, timed):
+                output_proto = sae_msg.SerializeToString()
+
+        return self._projector.apply(stream_key, output_proto)
     
     def _remove_frame_data(self, sae_msg: SaeMessage) -> SaeMessage:
         # Use a whitelist approach, to make 100% sure that no frame_data is leaked
@@ -48,14 +97,3 @@ class RedisWriter:
         sae_msg.frame.camera_location.CopyFrom(camera_location)
 
         return sae_msg
-        
-    @PROTO_DESERIALIZATION_DURATION.time()
-    def _unpack_proto(self, sae_message_bytes):
-        sae_msg = SaeMessage()
-        sae_msg.ParseFromString(sae_message_bytes)
-
-        return sae_msg
-    
-    @PROTO_SERIALIZATION_DURATION.time()
-    def _pack_proto(self, sae_msg: SaeMessage):
-        return sae_msg.SerializeToString()
\ No newline at end of file
@@ -0,0 +1,44 @@
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Sizes of what the client writes to / reads from the connection in the RESP2 encoding (before TLS).
+# Arguments are encoded like the Valkey client does it (str as UTF-8, numbers via `repr`).
+
+
+def _encoded_len(value: Any) -> int:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value) if value.isascii() else len(value.encode('utf-8'))
+    return len(repr(value))
+
+
+def array_header_size(length: int) -> int:
+    # *<length>\r\n
+    return len(str(length)) + 3
+
+
+def bulk_size(value: Any) -> int:
+    # $<len>\r\n<value>\r\n
+    value_len = _encoded_len(value)
+    return len(str(value_len)) + value_len + 5
+
+
+def command_size(args: Iterable[Any]) -> int:
+    args = list(args)
+    return array_header_size(len(args)) + sum(bulk_size(arg) for arg in args)
+
+
+def xadd_size(stream_key: str, fields: Dict[str, Any], maxlen: int) -> int:
+    '''Size of `XADD <stream_key> MAXLEN ~ <maxlen> * <field> <value> ...` (as sent by `StreamPublisher`)'''
+    return (array_header_size(6 + 2 * len(fields)) +
+            bulk_size('XADD') + bulk_size(stream_key) + bulk_size(b'MAXLEN') + bulk_size(b'~') + bulk_size(str(maxlen)) + bulk_size('*') +
+            sum(bulk_size(key) + bulk_size(value) for key, value in fields.items()))
+
+
+def stream_reply_size(stream_key, entries: List[Tuple[Any, Dict[Any, Any]]]) -> int:
+    '''Size of the part of an XREAD reply belonging to one stream (`[stream_key, [[id, [field, value, ...]], ...]]`)'''
+    size = array_header_size(2) + bulk_size(stream_key) + array_header_size(len(entries))
+    for entry_id, fields in entries:
+        size += array_header_size(2) + bulk_size(entry_id) + array_header_size(2 * len(fields))
+        size += sum(bulk_size(key) + bulk_size(value) for key, value in fields.items())
+    return size
@@ -0,0 +1,105 @@
+import logging
+from typing import Dict, FrozenSet, List, NamedTuple, Optional
+
+from prometheus_client import Counter
+from visionapi.common_pb2 import MessageType, TypeMessage
+
+from .config import MappingConfig, RedisWriterConfig, TransformMode
+from .mapping import MappingTable
+from .wire import peek_message_type
+
+logger = logging.getLogger(__name__)
+
+# Fields added to every stream entry in aggregation mode, so that receivers can tell the messages apart
+ENVELOPE_SOURCE_FIELD = 'source'
+ENVELOPE_TYPE_FIELD = 'type'
+
+FRAME_COUNTER = Counter('redis_writer_frame_counter', 'How many frames have been consumed from the Redis input stream')
+
+
+class Route(NamedTuple):
+    target_stream: str
+    message_type: MessageType
+    # Additional stream entry fields (only set in aggregation mode)
+    envelope: Optional[Dict[str, str]]
+
+
+class Router:
+    '''Decides where messages from a source stream go. The message type of each stream is detected from its first message.
+    Used by both the threaded and the asyncio pipeline.'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self._config = config
+        logger.setLevel(config.log_level.value)
+        self._mapping_table = MappingTable(config.mapping_config)
+        self._routes: Dict[str, Route] = {}
+        # Target stream (or source stream in aggregation mode) -> names of the targets it is delivered to (None: all targets)
+        self._targets: Dict[str, Optional[FrozenSet[str]]] = {}
+
+        if config.aggregate_stream is not None:
+            logger.info(f'Aggregating all streams into {config.aggregate_stream}')
+
+    @property
+    def source_streams(self):
+        return self._mapping_table.source_streams
+
+    @property
+    def scan_matches(self) -> List[str]:
+        '''`SCAN MATCH` patterns to discover streams matching the source patterns (empty if there are none)'''
+        return self._mapping_table.scan_matches
+
+    def matches(self, stream_key: str) -> bool:
+        return self._mapping_table.matches(stream_key)
+
+    def targets_for(self, target_stream: str, fields: Optional[Dict[str, str]] = None) -> Optional[FrozenSet[str]]:
+        '''Names of the targets that messages for `target_stream` are delivered to (None: all targets)'''
+        if self._config.aggregate_stream is not None and fields is not None:
+            return self._targets.get(fields.get(ENVELOPE_SOURCE_FIELD))
+        return self._targets.get(target_stream)
+
+    def _register_targets(self, key: str, mapping: MappingConfig) -> None:
+        targets = frozenset(mapping.targets) if mapping.targets is not None else None
+        if key in self._targets:
+            # Several source streams are written into the same target stream
+            known = self._targets[key]
+            targets = known | targets if known is not None and targets is not None else None
+        self._targets[key] = targets
+
+    def route(self, stream_key: str, proto_data: bytes) -> Optional[Route]:
+        '''Returns None if the message must not be forwarded'''
+        FRAME_COUNTER.inc()
+
+        route = self._routes.get(stream_key)
+        if route is not None:
+            return route
+
+        resolved = self._mapping_table.resolve(stream_key)
+        if resolved is None:
+            return None
+
+        # Detect stream type by analyzing first message
+        msg_type = detect_message_type(proto_data, self._config.transform_mode)
+        if msg_type == MessageType.UNSPECIFIED:
+            # if message type can't be determined, messages are NOT forwarded
+            return None
+
+        type = MessageType.Name(msg_type)
+        logger.info(f'Detected message type {type} on stream {stream_key}')
+
+        if self._config.aggregate_stream is not None:
+            route = Route(self._config.aggregate_stream, msg_type, {ENVELOPE_SOURCE_FIELD: stream_key, ENVELOPE_TYPE_FIELD: type})
+            self._register_targets(stream_key, resolved[0])
+        else:
+            route = Route(resolved[1], msg_type, None)
+            self._register_targets(route.target_stream, resolved[0])
+        self._routes[stream_key] = route
+        return route
+
+
+def detect_message_type(proto_data, transform_mode: TransformMode):
+    if transform_mode == TransformMode.WIRE:
+        return peek_message_type(proto_data)
+
+    msg = TypeMessage()
+    msg.ParseFromString(proto_data)
+    return msg.type
@@ -1,25 +1,51 @@
 import logging
+import os
 import time
-from collections import deque
-from threading import Event, Thread
-from typing import Deque, NamedTuple
+from contextlib import ExitStack
+from threading import Condition, Event, Thread
+from typing import Dict, List, Optional, Tuple, TypeVar
 
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 from valkey.exceptions import ConnectionError, TimeoutError
-from visionlib.pipeline import ValkeyPipelinePublisher
 
-from .config import RedisWriterConfig
+from .batching import AdaptiveBatchController, BatchLimits
+from .buffer import BufferEntry, StreamBuffer, entry_size
+from .compression import PayloadCompressor
+from .config import RedisWriterConfig, SpillConfig
+from .conflation import CONFLATED_COUNTER, Conflator
+from .publisher import StreamPublisher, redis_args
+from .shaping import (BANDWIDTH_THROTTLE_DURATION, PRIORITY_DISCARD_COUNTER,
+                      PRIORITY_NAMES, PRIORITY_SENT_BYTES,
+                      PRIORITY_SENT_COUNTER, BandwidthShaper,
+                      PriorityClassifier)
+from .spill import SpillBuffer
+from .transform_pool import shard_for
+from .wire import peek_sae_frame_timestamp
 
 logging.basicConfig(format='%(asctime)s %(name)-15s %(levelname)-8s %(processName)-10s %(message)s')
 logger = logging.getLogger(__name__)
 
-BACKOFF_COUNTER = Counter('redis_writer_backoff_counter', 'How often publishing to Redis has to be backed off (i.e. retried)')
+# Sender metrics are labelled with the target name (`host:port` for an unnamed target)
+BACKOFF_COUNTER = Counter('redis_writer_backoff_counter', 'How often publishing to Redis has to be backed off (i.e. retried)', ['target'])
 GIVEUP_COUNTER = Counter('redis_writer_giveup_counter', 'How many messages were discarded due to exhausted retries')
-DISCARD_BUFFER_COUNTER = Counter('redis_writer_discard_buffer_counter', 'How many input messages have to be discarded because sender cannot keep up')
-REDIS_PUBLISH_DURATION = Histogram('redis_writer_target_redis_publish_duration', 'The time it takes to push a message onto the Redis stream',
+DISCARD_BUFFER_COUNTER = Counter('redis_writer_discard_buffer_counter', 'How many input messages have to be discarded because sender cannot keep up', ['target', 'stream'])
+REDIS_PUBLISH_DURATION = Histogram('redis_writer_target_redis_publish_duration', 'The time it takes to push a message onto the Redis stream', ['target'],
                                    buckets=(0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.25))
-REDIS_PUBLISH_BYTES_SENT = Counter('redis_writer_target_redis_published_bytes_estimate', 'How many bytes were sent to the Redis stream (this is estimated!)')
 REDIS_PUBLISH_MESSAGE_COUNT = Counter('redis_writer_target_redis_message_counter', 'How many messages were sent to the Redis stream')
+ENQUEUE_TO_PUBLISH_LATENCY = Histogram('redis_writer_enqueue_to_publish_latency', 'The time from handing a message to the sender until the (successful) execution of the pipeline containing it', ['target'],
+                                       buckets=(0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+SENDER_WORKER_PUBLISH_DURATION = Histogram('redis_writer_sender_worker_publish_duration', 'The time it takes a sender worker to execute a pipeline', ['worker'],
+                                           buckets=(0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.25, 0.5, 1))
+
+# Per-stream metrics are labelled with the target stream key (and the target name, where targets can differ)
+BUFFER_TIME = Histogram('redis_writer_buffer_time', 'How long a message waited in the sender buffer until it was taken into a batch', ['stream'],
+                        buckets=(0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+STREAM_PUBLISH_DURATION = Histogram('redis_writer_stream_publish_duration', 'The time it takes to execute a pipeline containing messages of the stream (observed once per pipeline)', ['target', 'stream'],
+                                    buckets=(0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.25, 0.5, 1))
+MESSAGE_AGE = Histogram('redis_writer_message_age', 'The age of a SaeMessage (based on `frame.timestamp_utc_ms`) when it has been published', ['stream'],
+                        buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+SENDER_BUFFER_LENGTH = Gauge('redis_writer_sender_buffer_length', 'How many messages are currently waiting in the sender buffer', ['worker'])
+SENDER_BUFFER_BYTES = Gauge('redis_writer_sender_buffer_bytes', 'How many bytes are currently waiting in the sender buffer', ['worker'])
 
 def backoff_gen(max_wait=10):
     wait_time = 0.05
@@ -27,105 +53,408 @@ def backoff_gen(max_wait=10):
         yield wait_time
         wait_time = min(wait_time*2, max_wait)
 
-class BufferEntry(NamedTuple):
-    stream_key: str
-    msg_bytes: bytes
 
+# (target stream key, message bytes, additional fields)
+OutgoingMessage = Tuple[str, bytes, Optional[Dict[str, str]]]
+Item = TypeVar('Item', OutgoingMessage, BufferEntry)
+
+
+def split_by_worker(items: List[Item], worker_count: int) -> List[List[Item]]:
+    '''Splits messages or buffer entries by the worker that is responsible for their stream (keeping their order)'''
+    shards = [[] for _ in range(worker_count)]
+    for item in items:
+        shards[shard_for(item[0], worker_count)].append(item)
+    return shards
+
+
+def worker_spill_config(config: SpillConfig, worker_idx: int, worker_count: int) -> SpillConfig:
+    '''Every sender worker needs its own spill directory (the limits are split evenly)'''
+    if worker_count == 1:
+        return config
+    return config.model_copy(update={
+        'directory': os.path.join(config.directory, f'worker-{worker_idx}'),
+        'max_bytes': max(1, config.max_bytes // worker_count),
+    })
+
+
+class EntryPreparer:
+    '''Turns outgoing messages into buffer entries (frame timestamp, priority, conflation key and compressed payload).
+    It does not touch any buffer, so one instance is shared by all workers of a sender and may be called concurrently.'''
 
-class Sender:
     def __init__(self, config: RedisWriterConfig) -> None:
+        # The only part of the entries that depends on the target (so targets with the same default can share the entries)
+        self.default_compression = config.target_redis.compression
+        self._compressor = PayloadCompressor(config)
+        self._classifier = PriorityClassifier(config)
+        self._conflator = Conflator(config)
+
+    def prepare(self, stream_key, msg_bytes, fields) -> BufferEntry:
+        frame_timestamp_ms = peek_sae_frame_timestamp(msg_bytes)
+        priority = self._classifier.classify(stream_key, msg_bytes)
+        conflation_key = self._conflator.key_for(stream_key, msg_bytes, fields)
+        msg_bytes, fields = self._compressor.compress(stream_key, msg_bytes, fields)
+        return BufferEntry(stream_key, msg_bytes, fields, frame_timestamp_ms, priority, conflation_key)
+
+
+class SenderBase:
+    '''Buffering, spilling and batching logic of one sender worker, shared by the threaded and the asyncio sender.
+    The buffer limits are split evenly between all workers. None of the methods are synchronized, this is up to the subclass.'''
+
+    def __init__(self, config: RedisWriterConfig, worker_idx: int = 0, preparer: Optional[EntryPreparer] = None) -> None:
         self._config = config.target_redis
         logger.setLevel(config.log_level.value)
 
-        self._buffer: Deque[BufferEntry] = deque(maxlen=self._config.buffer_length)
+        worker_count = self._config.sender_workers
+        self._worker_idx = worker_idx
+        # Workers of different targets must not share their metrics
+        worker_label = str(worker_idx) if self._config.name is None else f'{self._config.name}/{worker_idx}'
+        self._target_label = self._config.name if self._config.name is not None else f'{self._config.host}:{self._config.port}'
+        self._buffer = StreamBuffer(max_bytes=max(1, self._config.buffer_max_bytes // worker_count),
+                                    max_length=max(1, self._config.buffer_length // worker_count))
+        self._linger_s = self._config.linger_ms / 1000
+        self._batch_controller = AdaptiveBatchController(self._config, worker_label)
+        # Whether messages were left in the buffer when the current batch was taken (None for batches replayed from the spill)
+        self._batch_backlog: Optional[bool] = None
+        # While the stage catches up on the source streams, fixed (large) batches are used instead of the adaptive ones
+        self._catch_up = False
+        self._catch_up_limits = BatchLimits(config.checkpoint.catch_up_batch_size, config.checkpoint.catch_up_batch_bytes)
+        self._batch_catch_up = False
+        # Enqueue time of the oldest message in the batch currently being published
+        self._in_flight_since: Optional[float] = None
+
+        self._preparer = preparer if preparer is not None else EntryPreparer(config)
+        self._shaper = BandwidthShaper(self._config.bandwidth, worker_count)
+
+        spill_config = worker_spill_config(self._config.spill, worker_idx, worker_count)
+        self._spill = SpillBuffer(spill_config) if spill_config.enabled else None
+        self._connection_healthy = True
+
+        self._redis_args = redis_args(self._config)
+        self._publish_duration = SENDER_WORKER_PUBLISH_DURATION.labels(worker_label)
+        self._buffer_length = SENDER_BUFFER_LENGTH.labels(worker_label)
+        self._buffer_bytes = SENDER_BUFFER_BYTES.labels(worker_label)
+        self._backoff_counter = BACKOFF_COUNTER.labels(self._target_label)
+        self._redis_publish_duration = REDIS_PUBLISH_DURATION.labels(self._target_label)
+        self._enqueue_to_publish_latency = ENQUEUE_TO_PUBLISH_LATENCY.labels(self._target_label)
+
+    def _report_occupancy(self):
+        self._buffer_length.set(len(self._buffer))
+        self._buffer_bytes.set(self._buffer.bytes)
+
+    def _enqueue(self, entry: BufferEntry) -> bool:
+        '''Returns True if the sender needs to be woken up'''
+        evicted = self._buffer.replace(entry) if entry.conflation_key is not None else None
+        if evicted is not None:
+            CONFLATED_COUNTER.labels(entry.stream_key).inc()
+        else:
+            evicted = self._buffer.append(entry, time.monotonic())
+        if len(evicted) > 0:
+            self._handle_evicted(evicted)
+        self._report_occupancy()
+
+        # The sender only needs to be woken up if it is idle or if it is lingering and a flush trigger has been reached
+        return len(self._buffer) == 1 or self._batch_ready()
+
+    def _enqueue_all(self, entries: List[BufferEntry]) -> bool:
+        wake_up = False
+        for entry in entries:
+            wake_up = self._enqueue(entry) or wake_up
+        return wake_up
+
+    def _handle_evicted(self, evicted):
+        # Spill to disk during outages. While spilled messages are being replayed, keep spilling to preserve the order.
+        if self._spill is not None and (not self._connection_healthy or len(self._spill) > 0):
+            self._spill.append(evicted)
+            return
+
+        for entry in evicted:
+            DISCARD_BUFFER_COUNTER.labels(self._target_label, entry.stream_key).inc()
+            PRIORITY_DISCARD_COUNTER.labels(PRIORITY_NAMES[entry.priority]).inc()
+
+    def _has_spilled(self) -> bool:
+        return self._spill is not None and len(self._spill) > 0
+
+    def _limits(self) -> BatchLimits:
+        return self._catch_up_limits if self._catch_up else self._batch_controller.limits
+
+    def _pending_since(self) -> Optional[float]:
+        '''Enqueue time of the oldest message that is buffered or being published (spilled messages do not count, they survive restarts)'''
+        pending = [self._buffer.oldest_enqueue_time()] if len(self._buffer) > 0 else []
+        if self._in_flight_since is not None:
+            pending.append(self._in_flight_since)
+        return min(pending, default=None)
+
+    def _has_room(self) -> bool:
+        '''Whether more messages can be read without risking that they have to be evicted'''
+        return (self._connection_healthy and
+                len(self._buffer) * 2 <= self._buffer.max_length and
+                self._buffer.bytes * 2 <= self._buffer.max_bytes)
+
+    def _room(self) -> int:
+        '''How many messages can be enqueued without evicting any (none while the target is unreachable).
+        The byte limit is estimated with the average size of the buffered messages.'''
+        if not self._connection_healthy:
+            return 0
+        room = self._buffer.max_length - len(self._buffer)
+        if len(self._buffer) > 0:
+            room = min(room, (self._buffer.max_bytes - self._buffer.bytes) * len(self._buffer) // self._buffer.bytes)
+        return max(0, room)
+
+    def _batch_ready(self) -> bool:
+        limits = self._limits()
+        return (len(self._buffer) >= limits.size or 
+                self._buffer.bytes >= limits.bytes or
+                self._buffer.is_full())
+
+    def _linger_remaining(self) -> float:
+        return self._buffer.oldest_enqueue_time() + self._linger_s - time.monotonic()
+
+    def _take_batch(self):
+        if self._has_spilled():
+            # Spilled messages are older than everything in the buffer, so they have to go first
+            max_bytes = min(self._config.spill.replay_batch_bytes, self._shaper.available())
+            batch = self._spill.read_batch(self._config.spill.replay_batch_size, max_bytes)
+            enqueue_times = []
+            # Replay batches have their own limits, so they must not influence the adaptive batching
+            self._batch_backlog = None
+        else:
+            limits = self._limits()
+            batch, enqueue_times = self._buffer.drain(limits.size, min(limits.bytes, self._shaper.available()))
+            self._batch_backlog = len(self._buffer) > 0
+            self._batch_catch_up = self._catch_up
+            self._report_occupancy()
+            drain_time = time.monotonic()
+            for entry, enqueue_time in zip(batch, enqueue_times):
+                BUFFER_TIME.labels(entry.stream_key).observe(drain_time - enqueue_time)
+
+        self._in_flight_since = min(enqueue_times, default=None)
+        if len(batch) > 0:
+            self._shaper.consume(sum(entry_size(entry) for entry in batch))
+            REDIS_PUBLISH_MESSAGE_COUNT.inc(len(batch))
+
+        return batch, enqueue_times
+
+    def _publish_succeeded(self, execution_time: float, batch: List[BufferEntry], enqueue_times) -> bool:
+        '''Returns True if the connection recovered (i.e. the backoff has to be reset)'''
+        publish_duration = time.monotonic() - execution_time
+        self._publish_duration.observe(publish_duration)
+        for enqueue_time in enqueue_times:
+            self._enqueue_to_publish_latency.observe(execution_time - enqueue_time)
+        for stream_key in {entry.stream_key for entry in batch}:
+            STREAM_PUBLISH_DURATION.labels(self._target_label, stream_key).observe(publish_duration)
+        self._in_flight_since = None
+        if self._batch_backlog is not None:
+            if not self._batch_catch_up:
+                self._batch_controller.on_success(publish_duration, self._batch_backlog)
+            # Replayed entries do not know their priority anymore
+            for entry in batch:
+                priority = PRIORITY_NAMES[entry.priority]
+                PRIORITY_SENT_COUNTER.labels(priority).inc()
+                PRIORITY_SENT_BYTES.labels(priority).inc(entry_size(entry))
+
+        now_ms = time.time() * 1000
+        for entry in batch:
+            if entry.frame_timestamp_ms is not None:
+                MESSAGE_AGE.labels(entry.stream_key).observe(max(0, now_ms - entry.frame_timestamp_ms) / 1000)
+
+        if not self._connection_healthy:
+            self._connection_healthy = True
+            logger.info(f'Connection to {self._config.host}:{self._config.port} healthy. Resuming.')
+            return True
+        return False
 
+    def _publish_failed(self, backoff_time) -> float:
+        '''Returns the time to wait before retrying'''
+        self._connection_healthy = False
+        self._batch_controller.on_failure()
+        sleep_time = next(backoff_time)
+        logger.warning(f'Connection unhealthy, retrying in {sleep_time}s...')
+        self._backoff_counter.inc()
+        return sleep_time
+
+    def _close_spill(self):
+        if self._spill is not None:
+            self._spill.close()
+
+
+class SenderWorker(SenderBase):
+    '''Publishes the messages of its share of the streams on its own thread and connection'''
+
+    def __init__(self, config: RedisWriterConfig, worker_idx: int = 0, preparer: Optional[EntryPreparer] = None) -> None:
+        super().__init__(config, worker_idx, preparer)
+
+        self._buffer_changed = Condition()
         self._stop_event = Event()
-        self._sender_thread = Thread(target=self._run)
-
-        self._redis_args = {}
-        if self._config.tls:
-            self._redis_args.update({
-                'ssl': True,
-                'ssl_certfile': 'certs/client.crt',
-                'ssl_keyfile': 'certs/client.key',
-                'ssl_cert_reqs': 'required',
-                'ssl_ca_certs': 'certs/ca.crt',
-            })
-        if self._config.socket_timeout_s:
-            self._redis_args.update({
-                'socket_timeout': self._config.socket_timeout_s,
-            })
+        self._sender_thread = Thread(target=self._run, name=f'sender-{worker_idx}')
         
-    def _publish(self, stream_key, msg_bytes):
-        if len(self._buffer) == self._buffer.maxlen:
-            DISCARD_BUFFER_COUNTER.inc()
+    def _publish(self, stream_key, msg_bytes, fields=None):
+        entry = self._preparer.prepare(stream_key, msg_bytes, fields)
+
+        with self._buffer_changed:
+            if self._enqueue(entry):
+                self._buffer_changed.notify()
+
+    def publish_batch(self, items: List[OutgoingMessage]):
+        self.publish_entries([self._preparer.prepare(*item) for item in items])
+
+    def publish_entries(self, entries: List[BufferEntry]):
+        # Take the lock (and wake up the sender) only once per batch
+        with self._buffer_changed:
+            if self._enqueue_all(entries):
+                self._buffer_changed.notify()
+
+    def pending_since(self) -> Optional[float]:
+        with self._buffer_changed:
+            return self._pending_since()
 
-        self._buffer.append(BufferEntry(stream_key, msg_bytes))
+    def has_room(self) -> bool:
+        with self._buffer_changed:
+            return self._has_room()
+
+    def room(self) -> int:
+        with self._buffer_changed:
+            return self._room()
+
+    def set_catch_up(self, catch_up: bool):
+        with self._buffer_changed:
+            self._catch_up = catch_up
+
+    def _wait_for_batch(self) -> bool:
+        '''Blocks until a batch should be sent (i.e. a flush trigger has been reached or the oldest entry lingered long enough).
+        Returns False if the sender is being stopped.'''
+        with self._buffer_changed:
+            # Spilled messages are replayed without delay
+            if self._has_spilled():
+                return self._wait_for_bandwidth()
+
+            while len(self._buffer) == 0:
+                if self._stop_event.is_set():
+                    return False
+                self._buffer_changed.wait()
+
+            while not self._batch_ready():
+                if self._stop_event.is_set():
+                    return False
+                remaining = self._linger_remaining()
+                if remaining <= 0:
+                    break
+                self._buffer_changed.wait(remaining)
+
+            return self._wait_for_bandwidth()
+
+    def _wait_for_bandwidth(self) -> bool:
+        '''Blocks while the bandwidth limit is exhausted (must be called with the lock held). Returns False if the sender is being stopped.'''
+        delay = self._shaper.delay()
+        while delay > 0:
+            if self._stop_event.is_set():
+                return False
+            wait_start = time.monotonic()
+            self._buffer_changed.wait(delay)
+            BANDWIDTH_THROTTLE_DURATION.inc(time.monotonic() - wait_start)
+            delay = self._shaper.delay()
+        return not self._stop_event.is_set()
 
     def __enter__(self):
         self._sender_thread.start()
         return self._publish
     
     def _run(self):
-        publisher = ValkeyPipelinePublisher(
+        publisher = StreamPublisher(
             host=self._config.host,
             port=self._config.port,
             stream_maxlen=self._config.target_stream_maxlen,
+            target_name=self._config.name,
+            packing=self._config.packing,
             **self._redis_args
         )
 
         backoff_time = backoff_gen()
-        connection_healthy = True
         batch = []
+        enqueue_times = []
 
         with publisher as publish:
             while not self._stop_event.is_set():
-                if connection_healthy:
-                    batch = self._get_next_batch()
+                if self._connection_healthy:
+                    if not self._wait_for_batch():
+                        break
+                    batch, enqueue_times = self._get_next_batch()
                     if len(batch) == 0:
-                        time.sleep(0.05)
                         continue
 
                 try:
-                    with REDIS_PUBLISH_DURATION.time():
+                    execution_time = time.monotonic()
+                    with self._redis_publish_duration.time():
                         publish(batch)
-                    if not connection_healthy:
-                        connection_healthy = True
+                    if self._publish_succeeded(execution_time, batch, enqueue_times):
                         backoff_time = backoff_gen()
-                        logger.info(f'Connection to {self._config.host}:{self._config.port} healthy. Resuming.')
-                        
+                    continue
                 except (ConnectionError, TimeoutError) as _:
-                    connection_healthy = False
                     logger.debug('Publish failed with error', exc_info=True)
                 except Exception as _:
-                    connection_healthy = False
                     logger.warning('Got unexpected exception', exc_info=True)
 
-                if not connection_healthy:
-                    sleep_time = next(backoff_time)
-                    logger.warning(f'Connection unhealthy, retrying in {sleep_time}s...')
-                    BACKOFF_COUNTER.inc()
-                    time.sleep(sleep_time)
+                self._stop_event.wait(self._publish_failed(backoff_time))
 
     def _get_next_batch(self):
-        batch = []
-        batch_bytes = 0
-        try:
-            while len(batch) < self._config.buffer_length: 
-                entry = self._buffer.popleft()
-                batch.append(entry)
-                # Assume 33% overhead for b64 encoding
-                batch_bytes += round(len(entry.msg_bytes) * 1.33) + len(entry.stream_key)
-        except IndexError:
-            pass
-
-        if len(batch) > 0:
-            REDIS_PUBLISH_BYTES_SENT.inc(batch_bytes)
-            REDIS_PUBLISH_MESSAGE_COUNT.inc(len(batch))
-
-        return batch
+        with self._buffer_changed:
+            return self._take_batch()
 
     def __exit__(self, _, __, ___):
         self._stop_event.set()
+        with self._buffer_changed:
+            self._buffer_changed.notify_all()
         self._sender_thread.join(timeout=10)
-        return False
\ No newline at end of file
+        with self._buffer_changed:
+            self._close_spill()
+        return False
+
+
+class Sender:
+    '''Distributes messages onto `target_redis.sender_workers` workers by stream key,
+    so that a slow pipeline does not hold up all streams while the order within each stream is preserved.'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self.preparer = EntryPreparer(config)
+        self._workers = [SenderWorker(config, idx, self.preparer) for idx in range(config.target_redis.sender_workers)]
+        self._exit_stack = ExitStack()
+
+    def __enter__(self):
+        publish_fns = [self._exit_stack.enter_context(worker) for worker in self._workers]
+        if len(publish_fns) == 1:
+            return publish_fns[0]
+
+        def publish(stream_key, msg_bytes, fields=None):
+            publish_fns[shard_for(stream_key, len(publish_fns))](stream_key, msg_bytes, fields)
+        return publish
+
+    def publish_batch(self, items: List[OutgoingMessage]):
+        self.publish_entries([self.preparer.prepare(*item) for item in items])
+
+    def publish_entries(self, entries: List[BufferEntry]):
+        '''Enqueues entries that have already been prepared (by `preparer` or an equivalent one, see `FanOutSender`)'''
+        if len(self._workers) == 1:
+            self._workers[0].publish_entries(entries)
+            return
+        for worker, worker_entries in zip(self._workers, split_by_worker(entries, len(self._workers))):
+            if len(worker_entries) > 0:
+                worker.publish_entries(worker_entries)
+
+    def pending_since(self) -> Optional[float]:
+        '''Enqueue time of the oldest message not published yet (over all workers), None if everything has been published'''
+        return min((since for since in (worker.pending_since() for worker in self._workers) if since is not None), default=None)
+
+    def has_room(self) -> bool:
+        '''Whether all workers are healthy and can take more messages without evicting'''
+        return all(worker.has_room() for worker in self._workers)
+
+    def room(self) -> int:
+        '''How many messages can be published at once without any worker having to evict (all of them could go to the same worker)'''
+        return min(worker.room() for worker in self._workers)
+
+    def set_catch_up(self, catch_up: bool):
+        '''Switches all workers to the large catch-up batches (or back to the regular ones)'''
+        for worker in self._workers:
+            worker.set_catch_up(catch_up)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._exit_stack.__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,91 @@
+import time
+from typing import Dict, Optional
+
+from google.protobuf.message import DecodeError
+from prometheus_client import Counter
+from visionapi.common_pb2 import MessageType
+
+from .config import BandwidthConfig, Priority, RedisWriterConfig
+from .mapping import MappingTable
+from .wire import peek_message_type
+
+PRIORITY_SENT_BYTES = Counter('redis_writer_priority_sent_bytes', 'How many message bytes were published per priority class', ['priority'])
+PRIORITY_SENT_COUNTER = Counter('redis_writer_priority_sent_counter', 'How many messages were published per priority class', ['priority'])
+PRIORITY_DISCARD_COUNTER = Counter('redis_writer_priority_discard_counter', 'How many messages were discarded from the sender buffer per priority class', ['priority'])
+BANDWIDTH_THROTTLE_DURATION = Counter('redis_writer_bandwidth_throttle_duration', 'How long (in seconds) the sender waited because of the bandwidth limit')
+
+# Buffer priorities (lower values are sent first)
+PRIORITY_ORDER = {priority: idx for idx, priority in enumerate(Priority)}
+PRIORITY_NAMES = {idx: priority.value for priority, idx in PRIORITY_ORDER.items()}
+
+
+def default_priority(message_type: MessageType) -> Priority:
+    # SaeMessages are by far the largest messages, everything else (e.g. positions) is small and should get through first
+    return Priority.NORMAL if message_type == MessageType.SAE else Priority.HIGH
+
+
+class PriorityClassifier:
+    '''Determines the priority class of outgoing messages: `MappingConfig.priority` if set, otherwise derived from the message type'''
+
+    def __init__(self, config: RedisWriterConfig) -> None:
+        self._mapping_table = MappingTable(config.mapping_config)
+        self._configured: Dict[str, Optional[int]] = {}
+
+    def _configured_priority(self, stream_key: str) -> Optional[int]:
+        try:
+            return self._configured[stream_key]
+        except KeyError:
+            pass
+        mapping = self._mapping_table.mapping_for_target(stream_key)
+        priority = PRIORITY_ORDER[mapping.priority] if mapping is not None and mapping.priority is not None else None
+        self._configured[stream_key] = priority
+        return priority
+
+    def classify(self, stream_key: str, msg_bytes: bytes) -> int:
+        priority = self._configured_priority(stream_key)
+        if priority is not None:
+            return priority
+        # Aggregated streams carry different message types, so the type has to be checked for every message
+        try:
+            message_type = peek_message_type(msg_bytes)
+        except DecodeError:
+            message_type = MessageType.UNSPECIFIED
+        return PRIORITY_ORDER[default_priority(message_type)]
+
+
+class BandwidthShaper:
+    '''Token bucket limiting the message bytes sent per second (`target_redis.bandwidth`, split evenly between the sender workers).
+    A batch may overdraw the bucket, the following batches are then delayed until the debt is paid off.'''
+
+    def __init__(self, config: BandwidthConfig, worker_count: int = 1) -> None:
+        self.enabled = config.max_bytes_per_s is not None
+        if self.enabled:
+            self._rate = config.max_bytes_per_s / worker_count
+            self._capacity = max(1, config.burst_bytes / worker_count)
+            self._tokens = self._capacity
+            self._last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def available(self) -> float:
+        '''How many bytes can be sent right now'''
+        if not self.enabled:
+            return float('inf')
+        self._refill()
+        return max(0, self._tokens)
+
+    def delay(self) -> float:
+        '''How long to wait until anything can be sent'''
+        if not self.enabled:
+            return 0
+        self._refill()
+        if self._tokens > 0:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def consume(self, byte_count: int) -> None:
+        if self.enabled:
+            self._tokens -= byte_count
@@ -0,0 +1,253 @@
+import asyncio
+import base64
+import logging
+import time
+from typing import (AsyncIterator, Callable, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Tuple)
+
+import valkey
+import valkey.asyncio
+from prometheus_client import Counter, Gauge, Histogram
+from valkey.exceptions import ConnectionError, TimeoutError
+
+from .config import RedisConfig
+from .publisher import PAYLOAD_FIELD
+from .resp import stream_reply_size
+from .sender import backoff_gen
+
+logging.basicConfig(format='%(asctime)s %(name)-15s %(levelname)-8s %(processName)-10s %(message)s')
+logger = logging.getLogger(__name__)
+
+READ_BATCH_SIZE = Histogram('redis_writer_read_batch_size', 'How many messages were returned by a single read from the source streams',
+                            buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+SOURCE_STREAMS = Gauge('redis_writer_source_streams', 'How many source streams are being read (including discovered ones)')
+SOURCE_WIRE_BYTES = Counter('redis_writer_source_wire_bytes', 'How many bytes were read from the source per stream (RESP encoded size of the XREAD replies, without TLS overhead)', ['stream'])
+CATCH_UP = Gauge('redis_writer_catch_up', 'Whether the reader is catching up on a backlog in the source streams (1) or reading at their head (0)')
+
+_PAYLOAD_FIELD_BYTES = PAYLOAD_FIELD.encode('utf-8')
+
+Message = Tuple[str, bytes]
+
+
+class StreamDiscovery:
+    '''Periodically finds source streams matching the mapping patterns (with `SCAN ... TYPE stream`)'''
+
+    def __init__(self, scan_matches: List[str], matches: Callable[[str], bool], interval_s: float) -> None:
+        self.scan_matches = scan_matches
+        self.matches = matches
+        self.interval_s = interval_s
+
+
+class CatchUp(NamedTuple):
+    # Messages per stream and read while catching up
+    read_count: int
+
+
+# Returns how many messages the sender can take at once without evicting any (counted over all streams)
+Room = Callable[[], int]
+
+
+class _SourceReaderBase:
+    '''Reads the source streams with XREAD, up to `read_count` messages per read (counted per stream).
+    Like `visionlib.pipeline.ValkeyConsumer`, it only delivers messages that arrive after startup, unless `start_ids` (e.g. checkpoints) are given.
+    If `catch_up` is set, a read that returns `read_count` messages (the configured count, not a lowered one) for any stream switches to larger reads
+    until the head of all streams is reached.
+    If `room` is passed to the iterator, no read returns more messages than the sender can take, i.e. the read counts are lowered as far as necessary
+    (if there is less room than streams, the streams take turns with one message each).
+    Every read yields one (possibly empty) batch, so that the caller can check for shutdown in between.'''
+
+    def __init__(self, config: RedisConfig, stream_keys: Iterable[str], discovery: Optional[StreamDiscovery] = None,
+                 start_ids: Optional[Dict[str, str]] = None, catch_up: Optional[CatchUp] = None) -> None:
+        self._config = config
+        self._stream_keys = list(stream_keys)
+        self._last_ids: Dict[str, str] = {}
+        self._start_ids = start_ids if start_ids is not None else {}
+        # Streams whose start id still has to be determined
+        self._pending_start_ids = list(self._stream_keys)
+        self._discovery = discovery
+        self._next_discovery = 0.0
+        self._initial_discovery_done = False
+        self._catch_up = catch_up
+        self._catching_up = False
+        # Where the next turn starts if not all streams can be read at once
+        self._next_turn = 0
+        SOURCE_STREAMS.set(len(self._stream_keys))
+        CATCH_UP.set(0)
+
+    @property
+    def last_ids(self) -> Dict[str, str]:
+        '''The id of the last message read from each stream (i.e. handed out in a batch)'''
+        return self._last_ids
+
+    @property
+    def catching_up(self) -> bool:
+        return self._catching_up
+
+    def _discovery_due(self) -> bool:
+        return self._discovery is not None and time.monotonic() >= self._next_discovery
+
+    def _add_discovered(self, stream_keys: Iterable[str]) -> None:
+        known = set(self._stream_keys)
+        for stream_key in stream_keys:
+            stream_key = stream_key.decode('utf-8') if isinstance(stream_key, bytes) else stream_key
+            if stream_key in known or not self._discovery.matches(stream_key):
+                continue
+            known.add(stream_key)
+            self._stream_keys.append(stream_key)
+            logger.info(f'Discovered source stream {stream_key}')
+            if stream_key in self._start_ids:
+                self._last_ids[stream_key] = self._start_ids[stream_key]
+            elif self._initial_discovery_done:
+                # The stream appeared while we are running, so nothing it contains has been seen yet
+                self._last_ids[stream_key] = '0-0'
+            else:
+                self._pending_start_ids.append(stream_key)
+
+        self._initial_discovery_done = True
+        self._next_discovery = time.monotonic() + self._discovery.interval_s
+        SOURCE_STREAMS.set(len(self._stream_keys))
+
+    def _set_start_id(self, stream_key: str, last_entries) -> None:
+        # XREAD with `$` would skip everything written between two reads, so start from the current last entry instead
+        self._last_ids[stream_key] = last_entries[0][0] if len(last_entries) > 0 else '0-0'
+        self._pending_start_ids.remove(stream_key)
+
+    def _resolve_start_ids(self) -> List[str]:
+        '''Takes the start ids of the pending streams from `start_ids` and returns the streams that have to start from their current end'''
+        for stream_key in [stream_key for stream_key in self._pending_start_ids if stream_key in self._start_ids]:
+            self._last_ids[stream_key] = self._start_ids[stream_key]
+            self._pending_start_ids.remove(stream_key)
+        return list(self._pending_start_ids)
+
+    def _next_read(self, room: Optional[Room]) -> Tuple[Dict[str, str], int]:
+        '''The streams (with their last ids) and the count of the next XREAD (no streams if there is no room)'''
+        read_count = self._config.read_count
+        if self._catching_up:
+            read_count = max(read_count, self._catch_up.read_count)
+        if room is None:
+            return self._last_ids, read_count
+
+        free = room()
+        stream_keys = list(self._last_ids)
+        if free >= len(stream_keys):
+            return self._last_ids, min(read_count, free // len(stream_keys))
+        if free <= 0:
+            return {}, 0
+        start = self._next_turn % len(stream_keys)
+        self._next_turn = start + free
+        turn = (stream_keys[start:] + stream_keys[:start])[:free]
+        return {stream_key: self._last_ids[stream_key] for stream_key in turn}, 1
+
+    def _update_catch_up(self, result, read_count: int) -> None:
+        if self._catch_up is None:
+            return
+        # A stream that returned a whole regular read most likely has more messages waiting.
+        # Reads lowered below `read_count` by the room in the sender only tell that the head has been reached if they are not full either.
+        longest = max((len(entries) for _, entries in result or ()), default=0)
+        if longest >= self._config.read_count:
+            catching_up = True
+        elif longest >= read_count:
+            catching_up = self._catching_up
+        else:
+            catching_up = False
+        if catching_up != self._catching_up:
+            logger.info('Catching up on the source streams' if catching_up else 'Reached the head of the source streams')
+            self._catching_up = catching_up
+            CATCH_UP.set(int(catching_up))
+
+    def _decode(self, result) -> List[Message]:
+        batch = []
+        for stream_key, entries in result or ():
+            reply_size = stream_reply_size(stream_key, entries)
+            stream_key = stream_key.decode('utf-8') if isinstance(stream_key, bytes) else stream_key
+            SOURCE_WIRE_BYTES.labels(stream_key).inc(reply_size)
+            for entry_id, fields in entries:
+                self._last_ids[stream_key] = entry_id
+                proto_data_b64 = fields.get(_PAYLOAD_FIELD_BYTES)
+                if proto_data_b64 is None:
+                    continue
+                batch.append((stream_key, base64.b64decode(proto_data_b64)))
+        READ_BATCH_SIZE.observe(len(batch))
+        return batch
+
+    def _read_failed(self, backoff_time) -> float:
+        sleep_time = next(backoff_time)
+        logger.warning(f'Reading from {self._config.host}:{self._config.port} failed, retrying in {sleep_time}s...', exc_info=True)
+        return sleep_time
+
+
+class SourceReader(_SourceReaderBase):
+    def __enter__(self):
+        self._client = valkey.Valkey(host=self._config.host, port=self._config.port)
+        return self._iter_batches
+
+    def _iter_batches(self, room: Optional[Room] = None) -> Iterator[List[Message]]:
+        backoff_time = backoff_gen()
+        while True:
+            try:
+                if self._discovery_due():
+                    self._add_discovered([
+                        stream_key for scan_match in self._discovery.scan_matches
+                        for stream_key in self._client.scan_iter(match=scan_match, count=1000, _type='stream')
+                    ])
+                for stream_key in self._resolve_start_ids():
+                    self._set_start_id(stream_key, self._client.xrevrange(stream_key, count=1))
+                streams, read_count = self._next_read(room) if len(self._last_ids) > 0 else ({}, 0)
+                if len(streams) == 0:
+                    # Nothing to read (yet) or no room in the sender, XREAD needs at least one stream
+                    time.sleep(self._config.read_block_ms / 1000)
+                    yield []
+                    continue
+                result = self._client.xread(streams, count=read_count, block=self._config.read_block_ms)
+                backoff_time = backoff_gen()
+            except (ConnectionError, TimeoutError) as _:
+                time.sleep(self._read_failed(backoff_time))
+                yield []
+                continue
+
+            self._update_catch_up(result, read_count)
+            yield self._decode(result)
+
+    def __exit__(self, _, __, ___):
+        self._client.close()
+        return False
+
+
+class AsyncSourceReader(_SourceReaderBase):
+    '''asyncio counterpart of `SourceReader`'''
+
+    async def __aenter__(self):
+        self._client = valkey.asyncio.Valkey(host=self._config.host, port=self._config.port)
+        return self._iter_batches
+
+    async def _iter_batches(self, room: Optional[Room] = None) -> AsyncIterator[List[Message]]:
+        backoff_time = backoff_gen()
+        while True:
+            try:
+                if self._discovery_due():
+                    self._add_discovered([
+                        stream_key for scan_match in self._discovery.scan_matches
+                        async for stream_key in self._client.scan_iter(match=scan_match, count=1000, _type='stream')
+                    ])
+                for stream_key in self._resolve_start_ids():
+                    self._set_start_id(stream_key, await self._client.xrevrange(stream_key, count=1))
+                streams, read_count = self._next_read(room) if len(self._last_ids) > 0 else ({}, 0)
+                if len(streams) == 0:
+                    # Nothing to read (yet) or no room in the sender, XREAD needs at least one stream
+                    await asyncio.sleep(self._config.read_block_ms / 1000)
+                    yield []
+                    continue
+                result = await self._client.xread(streams, count=read_count, block=self._config.read_block_ms)
+                backoff_time = backoff_gen()
+            except (ConnectionError, TimeoutError) as _:
+                await asyncio.sleep(self._read_failed(backoff_time))
+                yield []
+                continue
+
+            self._update_catch_up(result, read_count)
+            yield self._decode(result)
+
+    async def __aexit__(self, _, __, ___):
+        await self._client.aclose()
+        return False
@@ -0,0 +1,280 @@
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from .buffer import BufferEntry
+from .config import FsyncPolicy, SpillConfig
+
+logging.basicConfig(format='%(asctime)s %(name)-15s %(levelname)-8s %(processName)-10s %(message)s')
+logger = logging.getLogger(__name__)
+
+SPILLED_BYTES = Counter('redis_writer_spill_spilled_bytes', 'How many bytes were written to the spill files')
+REPLAYED_BYTES = Counter('redis_writer_spill_replayed_bytes', 'How many bytes were read back from the spill files for publishing')
+SPILL_DROPPED_BYTES = Counter('redis_writer_spill_dropped_bytes', 'How many spilled bytes were discarded (due to max size or retention) before being replayed', ['reason'])
+SPILL_SIZE = Gauge('redis_writer_spill_size_bytes', 'How many spilled bytes are waiting to be replayed')
+
+# payload length, crc32 (of key, fields and payload), wall-clock time of spilling, key length, fields length
+_HEADER = struct.Struct('<IIdHI')
+_FIELD_HEADER = struct.Struct('<HI')
+_SEGMENT_SUFFIX = '.spill'
+
+
+def _encode_fields(fields: Optional[Dict[str, str]]) -> bytes:
+    if fields is None:
+        return b''
+    out = bytearray()
+    for name, value in fields.items():
+        name_bytes = name.encode('utf-8')
+        value_bytes = value.encode('utf-8')
+        out += _FIELD_HEADER.pack(len(name_bytes), len(value_bytes))
+        out += name_bytes
+        out += value_bytes
+    return bytes(out)
+
+
+def _decode_fields(fields_bytes: bytes) -> Optional[Dict[str, str]]:
+    if len(fields_bytes) == 0:
+        return None
+    fields = {}
+    pos = 0
+    while pos < len(fields_bytes):
+        name_length, value_length = _FIELD_HEADER.unpack_from(fields_bytes, pos)
+        pos += _FIELD_HEADER.size
+        name = fields_bytes[pos:pos + name_length].decode('utf-8')
+        pos += name_length
+        fields[name] = fields_bytes[pos:pos + value_length].decode('utf-8')
+        pos += value_length
+    return fields
+
+
+def _record_size(key_bytes: bytes, fields_bytes: bytes, payload: bytes) -> int:
+    return _HEADER.size + len(key_bytes) + len(fields_bytes) + len(payload)
+
+
+class _Segment:
+    '''A preallocated, memory-mapped file holding a sequence of records. Only ever appended to and read front to back.'''
+
+    def __init__(self, path: str, size: Optional[int] = None) -> None:
+        self.path = path
+        with open(path, 'r+b' if size is None else 'w+b') as f:
+            if size is not None:
+                f.truncate(size)
+            self._mm = mmap.mmap(f.fileno(), 0)
+        self.size = len(self._mm)
+        self.write_pos = 0
+        self.read_pos = 0
+        self.record_count = 0
+        self.newest_time = 0.0
+
+    @property
+    def unread_bytes(self) -> int:
+        return self.write_pos - self.read_pos
+
+    def recover(self) -> None:
+        '''Determines the end of the valid data after a restart (the rest of the file is zeroed or torn).'''
+        pos = 0
+        while True:
+            record = self._parse(pos)
+            if record is None:
+                break
+            _, spill_time, pos = record
+            self.record_count += 1
+            self.newest_time = max(self.newest_time, spill_time)
+        self.write_pos = pos
+
+    def try_append(self, key_bytes: bytes, fields_bytes: bytes, payload: bytes, spill_time: float) -> bool:
+        if self.write_pos + _record_size(key_bytes, fields_bytes, payload) > self.size:
+            return False
+        pos = self.write_pos
+        crc = zlib.crc32(payload, zlib.crc32(fields_bytes, zlib.crc32(key_bytes)))
+        _HEADER.pack_into(self._mm, pos, len(payload), crc, spill_time, len(key_bytes), len(fields_bytes))
+        pos += _HEADER.size
+        for part in (key_bytes, fields_bytes, payload):
+            self._mm[pos:pos + len(part)] = part
+            pos += len(part)
+        self.write_pos = pos
+        self.record_count += 1
+        self.newest_time = max(self.newest_time, spill_time)
+        return True
+
+    def _parse(self, pos: int) -> Optional[Tuple[BufferEntry, float, int]]:
+        if pos + _HEADER.size > self.size:
+            return None
+        payload_length, crc, spill_time, key_length, fields_length = _HEADER.unpack_from(self._mm, pos)
+        if key_length == 0:
+            return None
+        key_start = pos + _HEADER.size
+        fields_start = key_start + key_length
+        payload_start = fields_start + fields_length
+        end = payload_start + payload_length
+        if end > self.size:
+            return None
+        key_bytes = self._mm[key_start:fields_start]
+        fields_bytes = self._mm[fields_start:payload_start]
+        payload = self._mm[payload_start:end]
+        if zlib.crc32(payload, zlib.crc32(fields_bytes, zlib.crc32(key_bytes))) != crc:
+            return None
+        return BufferEntry(key_bytes.decode('utf-8'), payload, _decode_fields(fields_bytes)), spill_time, end
+
+    def read(self) -> Optional[Tuple[BufferEntry, float]]:
+        if self.read_pos >= self.write_pos:
+            return None
+        entry, spill_time, self.read_pos = self._parse(self.read_pos)
+        self.record_count -= 1
+        return entry, spill_time
+
+    def flush(self) -> None:
+        self._mm.flush()
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def delete(self) -> None:
+        self._mm.close()
+        os.remove(self.path)
+
+
+class SpillBuffer:
+    '''Append-only, segment-based spill files that messages are written to while the target is unreachable.
+    Messages are read back in the order they were written. Fully read segments are deleted.
+    After a restart, all remaining segments are replayed from the start (i.e. messages may be sent twice).
+    This class is not thread-safe, synchronization is up to the caller.'''
+
+    def __init__(self, config: SpillConfig) -> None:
+        self._config = config
+        self._segments: Deque[_Segment] = deque()
+        self._next_segment_no = 0
+        self._unread_bytes = 0
+        self._record_count = 0
+        # Several spill buffers (one per sender worker) share the size gauge, so each one reports its changes only
+        self._reported_bytes = 0
+
+        os.makedirs(self._config.directory, exist_ok=True)
+        self._recover()
+
+    def _recover(self) -> None:
+        segment_files = sorted(f for f in os.listdir(self._config.directory) if f.endswith(_SEGMENT_SUFFIX))
+        for segment_file in segment_files:
+            segment = _Segment(os.path.join(self._config.directory, segment_file))
+            segment.recover()
+            self._next_segment_no = int(segment_file.removesuffix(_SEGMENT_SUFFIX)) + 1
+            if segment.record_count == 0:
+                segment.delete()
+                continue
+            self._segments.append(segment)
+            self._unread_bytes += segment.unread_bytes
+            self._record_count += segment.record_count
+
+        if self._record_count > 0:
+            logger.info(f'Recovered {self._record_count} spilled messages ({self._unread_bytes} bytes) from {self._config.directory}')
+        self._report_size()
+
+    def _report_size(self) -> None:
+        SPILL_SIZE.inc(self._unread_bytes - self._reported_bytes)
+        self._reported_bytes = self._unread_bytes
+
+    def __len__(self) -> int:
+        return self._record_count
+
+    @property
+    def unread_bytes(self) -> int:
+        return self._unread_bytes
+
+    def _new_segment(self, min_size: int) -> _Segment:
+        if self._config.fsync != FsyncPolicy.NEVER and len(self._segments) > 0:
+            self._segments[-1].flush()
+        path = os.path.join(self._config.directory, f'{self._next_segment_no:016d}{_SEGMENT_SUFFIX}')
+        self._next_segment_no += 1
+        segment = _Segment(path, size=max(self._config.segment_size_bytes, min_size))
+        self._segments.append(segment)
+        return segment
+
+    def append(self, entries: List[BufferEntry]) -> None:
+        spill_time = time.time()
+        written_bytes = 0
+        for entry in entries:
+            key_bytes = entry.stream_key.encode('utf-8')
+            fields_bytes = _encode_fields(entry.fields)
+            segment = self._segments[-1] if len(self._segments) > 0 else None
+            if segment is None or not segment.try_append(key_bytes, fields_bytes, entry.msg_bytes, spill_time):
+                segment = self._new_segment(_record_size(key_bytes, fields_bytes, entry.msg_bytes))
+                segment.try_append(key_bytes, fields_bytes, entry.msg_bytes, spill_time)
+            written_bytes += _record_size(key_bytes, fields_bytes, entry.msg_bytes)
+
+        if self._config.fsync == FsyncPolicy.ALWAYS and len(self._segments) > 0:
+            self._segments[-1].flush()
+
+        self._unread_bytes += written_bytes
+        self._record_count += len(entries)
+        SPILLED_BYTES.inc(written_bytes)
+
+        self._enforce_limits()
+
+    def read_batch(self, max_count: int, max_bytes: int) -> List[BufferEntry]:
+        '''Reads up to `max_count` entries (and up to `max_bytes`, but at least one entry) in the order they were spilled.'''
+        self._enforce_limits()
+
+        expiry_time = time.time() - self._config.retention_s
+        batch: List[BufferEntry] = []
+        read_bytes = 0
+        expired_bytes = 0
+        while len(self._segments) > 0 and len(batch) < max_count and (len(batch) == 0 or read_bytes < max_bytes):
+            segment = self._segments[0]
+            read_pos = segment.read_pos
+            record = segment.read()
+            if record is None:
+                # Fully read segments are deleted right away, so that they are not replayed again after a restart
+                self._drop_head()
+                continue
+            entry, spill_time = record
+            record_bytes = segment.read_pos - read_pos
+            self._unread_bytes -= record_bytes
+            self._record_count -= 1
+            if spill_time < expiry_time:
+                expired_bytes += record_bytes
+                continue
+            batch.append(entry)
+            read_bytes += record_bytes
+
+        if expired_bytes > 0:
+            SPILL_DROPPED_BYTES.labels('retention').inc(expired_bytes)
+        REPLAYED_BYTES.inc(read_bytes)
+        self._report_size()
+        return batch
+
+    def _drop_head(self) -> Tuple[int, int]:
+        segment = self._segments.popleft()
+        dropped = (segment.unread_bytes, segment.record_count)
+        segment.delete()
+        self._unread_bytes -= dropped[0]
+        self._record_count -= dropped[1]
+        return dropped
+
+    def _enforce_limits(self) -> None:
+        expiry_time = time.time() - self._config.retention_s
+        while len(self._segments) > 0 and self._segments[0].newest_time < expiry_time:
+            dropped_bytes, dropped_count = self._drop_head()
+            if dropped_count > 0:
+                SPILL_DROPPED_BYTES.labels('retention').inc(dropped_bytes)
+                logger.warning(f'Discarded {dropped_count} spilled messages older than {self._config.retention_s}s')
+
+        while len(self._segments) > 1 and sum(segment.size for segment in self._segments) > self._config.max_bytes:
+            dropped_bytes, dropped_count = self._drop_head()
+            SPILL_DROPPED_BYTES.labels('max_bytes').inc(dropped_bytes)
+            logger.warning(f'Spill files exceed {self._config.max_bytes} bytes, discarded {dropped_count} spilled messages')
+
+        self._report_size()
+
+    def close(self) -> None:
+        for segment in self._segments:
+            if self._config.fsync != FsyncPolicy.NEVER:
+                segment.flush()
+            segment.close()
+        self._segments.clear()
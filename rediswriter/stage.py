@@ -1,20 +1,44 @@
+import asyncio
 import logging
 import signal
 import threading
-from enum import Enum
-from typing import Dict
-
-from prometheus_client import Counter, start_http_server
-from visionapi.common_pb2 import TypeMessage, MessageType
-from visionlib.pipeline import ValkeyConsumer
-
-from .config import RedisWriterConfig
+import time
+from contextlib import nullcontext
+from typing import Optional, Union
+
+from prometheus_client import start_http_server
+from visionapi.common_pb2 import MessageType
+
+from .aio_stage import run_async_pipeline
+from .checkpoint import (PAUSE_POLL_S, READ_PAUSE_DURATION, Checkpointer,
+                         read_room)
+from .config import PipelineMode, RedisWriterConfig
+from .fanout import FanOutSender, needs_fan_out, target_configs
+from .rate_limit import RateLimiter
 from .rediswriter import RedisWriter
+from .routing import Router
 from .sender import Sender
+from .source import SourceReader, StreamDiscovery
+from .transform_pool import TransformPool, observe_consume_to_enqueue
 
 logger = logging.getLogger(__name__)
 
-FRAME_COUNTER = Counter('redis_writer_frame_counter', 'How many frames have been consumed from the Redis input stream')
+def _checkpoint(checkpointer: Checkpointer, reader: SourceReader, transform_pool: TransformPool, sender: Union[Sender, FanOutSender], stop_event: threading.Event):
+    '''Commits checkpoints and holds back the next read while the sender cannot take more messages without evicting them.
+    While catching up, it also waits for the transform pool, as its results would otherwise pile up in the sender.'''
+    sender.set_catch_up(reader.catching_up)
+    pause_start: Optional[float] = None
+    while True:
+        ids = checkpointer.poll(reader.last_ids, transform_pool.pending_since, sender.pending_since)
+        if ids is not None:
+            checkpointer.commit(ids)
+        if stop_event.is_set() or (sender.has_room() and (not reader.catching_up or transform_pool.pending_since() is None)):
+            break
+        pause_start = pause_start or time.monotonic()
+        stop_event.wait(PAUSE_POLL_S)
+
+    if pause_start is not None:
+        READ_PAUSE_DURATION.inc(time.monotonic() - pause_start)
 
 def run_stage():
 
@@ -40,60 +64,63 @@ def run_stage():
 
     logger.info(f'Starting redis writer stage. Config: {CONFIG.model_dump_json(indent=2)}')
 
+    if CONFIG.pipeline_mode == PipelineMode.ASYNCIO:
+        asyncio.run(run_async_pipeline(CONFIG, stop_event))
+        return
+
     redis_writer = RedisWriter(CONFIG)
     
-    stream_mapping = map_config(CONFIG.mapping_config)
+    router = Router(CONFIG)
+    rate_limiter = RateLimiter(CONFIG)
     
-    consumer_ctx = ValkeyConsumer(CONFIG.redis.host, CONFIG.redis.port, stream_mapping.keys())
-    logger.debug(f"Listening to stream keys {stream_mapping.keys()}")
-    
-    sender = Sender(CONFIG)
-
-    message_type_by_stream: Dict[str, MessageType] = {}
+    discovery = None
+    if len(router.scan_matches) > 0:
+        discovery = StreamDiscovery(router.scan_matches, router.matches, CONFIG.redis.discovery_interval_s)
+    checkpointer = Checkpointer(CONFIG) if CONFIG.checkpoint.enabled else None
+    if checkpointer is not None:
+        reader = SourceReader(CONFIG.redis, router.source_streams, discovery, checkpointer.start_ids, checkpointer.catch_up)
+    else:
+        reader = SourceReader(CONFIG.redis, router.source_streams, discovery)
+    logger.debug(f"Listening to stream keys {router.source_streams}")
     
-    with consumer_ctx as iter_messages, sender as send:
-        for stream_key, proto_data in iter_messages():
-            if stop_event.is_set():
-                break
-
-            if stream_key is None:
-                continue
-
-            FRAME_COUNTER.inc()
-
-            # Detect stream type by analyzing first message
-            if not stream_key in message_type_by_stream:                
-                msg = TypeMessage()
-                msg.ParseFromString(proto_data)
-                if msg.type != MessageType.UNSPECIFIED:
-                    message_type_by_stream[stream_key] = msg.type
-                else:
-                    # if message type can't be determined, messages are NOT forwarded
-                    continue
-                
-                type = MessageType.Name(msg.type)
-                logger.info(f'Detected message type {type} on stream {stream_key}')
-
-            # Only process SaeMessage messages, otherwise pass verbatim
-            if message_type_by_stream[stream_key] == MessageType.SAE:
-                output_proto_data = redis_writer.get(proto_data)
-            else:
-                output_proto_data = proto_data
-
-            if output_proto_data is None:
-                continue
-
-            target_stream = stream_mapping.get(stream_key)
-            send(target_stream, output_proto_data)
-
-            
-def map_config(mapping_config):
-    stream_mapping = {}
-    for mapping in mapping_config:
-        if mapping.source == None:
-            continue
-        if mapping.target == None:
-            stream_mapping[mapping.source] = mapping.source
-        else:            
-            stream_mapping[mapping.source] = mapping.target
-    return stream_mapping
\ No newline at end of file
+    if needs_fan_out(CONFIG):
+        sender = FanOutSender([target.name for target in CONFIG.targets],
+                              [Sender(target_config) for target_config in target_configs(CONFIG)], router.targets_for)
+    else:
+        sender = Sender(CONFIG)
+
+    with reader as iter_batches, sender, checkpointer or nullcontext():
+        transform_pool = TransformPool(CONFIG, redis_writer, sender.publish_batch)
+        with transform_pool:
+            # With checkpoints, a read must never make the sender evict messages, as they would be committed without being published
+            room = read_room(sender.room, transform_pool.pending_count) if checkpointer is not None else None
+            for batch in iter_batches(room):
+                if stop_event.is_set():
+                    break
+                consume_time = time.monotonic()
+
+                to_transform = []
+                to_forward = []
+                for stream_key, proto_data in batch:
+                    route = router.route(stream_key, proto_data)
+                    if route is None:
+                        continue
+
+                    # Drop messages according to the rate policies before any further work is spent on them
+                    if not rate_limiter.allow(stream_key, route.message_type, proto_data):
+                        continue
+
+                    # Only process SaeMessage messages, otherwise pass verbatim
+                    if route.message_type == MessageType.SAE:
+                        to_transform.append((stream_key, route.target_stream, proto_data, route.envelope))
+                    else:
+                        to_forward.append((route.target_stream, proto_data, route.envelope))
+
+                # The order is only preserved within each stream (every stream carries a single message type)
+                if len(to_forward) > 0:
+                    sender.publish_batch(to_forward)
+                    observe_consume_to_enqueue(to_forward, consume_time)
+                transform_pool.transform_batch(to_transform, consume_time)
+
+                if checkpointer is not None:
+                    _checkpoint(checkpointer, reader, transform_pool, sender, stop_event)
@@ -0,0 +1,200 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock, Thread
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .config import ExecutionMode, RedisWriterConfig
+from .rediswriter import RedisWriter
+
+logging.basicConfig(format='%(asctime)s %(name)-15s %(levelname)-8s %(processName)-10s %(message)s')
+logger = logging.getLogger(__name__)
+
+TRANSFORM_WORKERS = Gauge('redis_writer_transform_workers', 'How many transform workers are running')
+TRANSFORM_IN_FLIGHT = Gauge('redis_writer_transform_in_flight', 'How many messages are currently submitted to the transform workers and not yet handed to the sender')
+TRANSFORM_ERROR_COUNTER = Counter('redis_writer_transform_error_counter', 'How many messages were discarded because the transformation failed')
+CONSUME_TO_ENQUEUE_LATENCY = Histogram('redis_writer_consume_to_enqueue_latency', 'The time from reading a message from the source stream until handing it to the sender (i.e. routing and transformation)', ['stream'],
+                                       buckets=(0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 1, 2.5))
+
+# Each worker process gets its own RedisWriter instance (set up by `_init_worker`)
+_worker_writer: Optional[RedisWriter] = None
+
+def _init_worker(config: RedisWriterConfig):
+    global _worker_writer
+    # Shutdown is coordinated by the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_writer = RedisWriter(config)
+
+def _transform_batch_in_worker(proto_datas, stream_keys):
+    return _worker_writer.get_batch(proto_datas, stream_keys)
+
+# (source stream key, target stream key, message bytes, additional fields)
+TransformItem = Tuple[str, str, bytes, Optional[Dict[str, str]]]
+
+def shard_for(stream_key: str, shard_count: int) -> int:
+    # Must be stable across processes and restarts (unlike `hash()`)
+    return zlib.crc32(stream_key.encode('utf-8')) % shard_count
+
+def observe_consume_to_enqueue(items: List[Tuple[str, bytes, Optional[Dict[str, str]]]], consume_time: Optional[float]) -> None:
+    '''To be called after the messages of a batch read at `consume_time` (monotonic) have been handed to the sender'''
+    if consume_time is None:
+        return
+    latency = time.monotonic() - consume_time
+    for item in items:
+        CONSUME_TO_ENQUEUE_LATENCY.labels(item[0]).observe(latency)
+
+def oldest_submission(submitted: List[Deque[float]]) -> Optional[float]:
+    '''Submission time of the oldest work item still in progress, given the submission times per shard (oldest first)'''
+    oldest = None
+    for shard_submitted in submitted:
+        try:
+            shard_oldest = shard_submitted[0]
+        except IndexError:
+            continue
+        oldest = shard_oldest if oldest is None else min(oldest, shard_oldest)
+    return oldest
+
+def collect_batch_results(items: List[TransformItem], output_protos: List[Optional[bytes]]) -> List[Tuple[str, bytes, Optional[Dict[str, str]]]]:
+    '''Pairs the results of `RedisWriter.get_batch` with their target streams and counts the failed ones'''
+    results = []
+    for (_, target_stream, _, fields), output_proto_data in zip(items, output_protos):
+        if output_proto_data is None:
+            TRANSFORM_ERROR_COUNTER.inc()
+            continue
+        results.append((target_stream, output_proto_data, fields))
+    return results
+
+
+class TransformPool:
+    '''Runs `RedisWriter.get_batch` for batches of SaeMessages and hands the results to `send_batch`.
+    In THREAD and PROCESS mode, work is sharded by source stream key onto single-worker executors,
+    so that the order of messages within a stream is preserved while different streams are transformed in parallel.'''
+
+    def __init__(self, config: RedisWriterConfig, redis_writer: RedisWriter,
+                 send_batch: Callable[[List[Tuple[str, bytes, Optional[Dict[str, str]]]]], None]) -> None:
+        self._config = config.transform_pool
+        self._writer_config = config
+        self._redis_writer = redis_writer
+        self._send_batch = send_batch
+        logger.setLevel(config.log_level.value)
+
+        self._executors: List[Executor] = []
+        self._result_queues: List[queue.Queue] = []
+        self._collector_threads: List[Thread] = []
+        self._in_flight = BoundedSemaphore(self._config.max_in_flight)
+        # Submission times of the work items of each shard that have not been handed to the sender yet
+        self._submitted: List[Deque[float]] = []
+        # Messages submitted and not handed to the sender yet (updated by the collector threads)
+        self._pending = 0
+        self._pending_lock = Lock()
+
+    def __enter__(self):
+        if self._config.mode == ExecutionMode.INLINE:
+            return self
+
+        for idx in range(self._config.workers):
+            self._executors.append(self._create_executor())
+            result_queue = queue.Queue()
+            self._result_queues.append(result_queue)
+            self._submitted.append(deque())
+            collector_thread = Thread(target=self._collect, args=(result_queue, self._submitted[idx]), name=f'transform-collector-{idx}')
+            collector_thread.start()
+            self._collector_threads.append(collector_thread)
+
+        TRANSFORM_WORKERS.set(self._config.workers)
+        logger.info(f'Started {self._config.workers} transform workers in {self._config.mode.value} mode')
+
+        return self
+
+    def _create_executor(self) -> Executor:
+        if self._config.mode == ExecutionMode.PROCESS:
+            # Do not fork, as the sender thread is already running at this point
+            return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(self._writer_config,))
+        return ThreadPoolExecutor(max_workers=1)
+
+    def _send_results(self, results, consume_time: Optional[float]):
+        self._send_batch(results)
+        observe_consume_to_enqueue(results, consume_time)
+
+    def pending_since(self) -> Optional[float]:
+        '''Submission time (monotonic) of the oldest message whose result has not been handed to the sender yet, None if there is none'''
+        return oldest_submission(self._submitted)
+
+    def pending_count(self) -> int:
+        '''How many messages have been submitted and not handed to the sender yet'''
+        with self._pending_lock:
+            return self._pending
+
+    def _add_pending(self, count: int):
+        with self._pending_lock:
+            self._pending += count
+
+    def transform_batch(self, items: List[TransformItem], consume_time: Optional[float] = None):
+        '''Transforms a batch of messages with `RedisWriter.get_batch` (one call per shard) and hands the results to `send_batch`.
+        `consume_time` is the (monotonic) time the batch was read, if it should be tracked.'''
+        if len(items) == 0:
+            return
+
+        if self._config.mode == ExecutionMode.INLINE:
+            output_protos = self._redis_writer.get_batch([item[2] for item in items], [item[0] for item in items])
+            self._send_results(collect_batch_results(items, output_protos), consume_time)
+            return
+
+        shards: List[List[TransformItem]] = [[] for _ in range(self._config.workers)]
+        for item in items:
+            shards[shard_for(item[0], self._config.workers)].append(item)
+
+        for shard, shard_items in enumerate(shards):
+            # Never wait for more permits than there are in total
+            for start in range(0, len(shard_items), self._config.max_in_flight):
+                chunk = shard_items[start:start + self._config.max_in_flight]
+                for _ in chunk:
+                    self._in_flight.acquire()
+                TRANSFORM_IN_FLIGHT.inc(len(chunk))
+                self._add_pending(len(chunk))
+
+                proto_datas = [item[2] for item in chunk]
+                stream_keys = [item[0] for item in chunk]
+                if self._config.mode == ExecutionMode.PROCESS:
+                    future = self._executors[shard].submit(_transform_batch_in_worker, proto_datas, stream_keys)
+                else:
+                    future = self._executors[shard].submit(self._redis_writer.get_batch, proto_datas, stream_keys)
+                self._submitted[shard].append(time.monotonic())
+                self._result_queues[shard].put((chunk, future, consume_time))
+
+    def _collect(self, result_queue: queue.Queue, submitted: Deque[float]):
+        # Futures of a shard are put into the queue in submission order, which preserves the per-stream order
+        while True:
+            item = result_queue.get()
+            if item is None:
+                break
+            items, future, consume_time = item
+            try:
+                self._send_results(collect_batch_results(items, future.result()), consume_time)
+            except Exception:
+                TRANSFORM_ERROR_COUNTER.inc(len(items))
+                logger.warning('Transformation failed, discarding message', exc_info=True)
+            finally:
+                submitted.popleft()
+                self._add_pending(-len(items))
+                TRANSFORM_IN_FLIGHT.dec(len(items))
+                for _ in items:
+                    self._in_flight.release()
+
+    def __exit__(self, _, __, ___):
+        for result_queue in self._result_queues:
+            result_queue.put(None)
+        for collector_thread in self._collector_threads:
+            collector_thread.join()
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+        TRANSFORM_WORKERS.set(0)
+        return False
@@ -0,0 +1,224 @@
+from typing import Iterator, List, Optional, Tuple
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message import DecodeError
+from visionapi.common_pb2 import MessageType, TypeMessage
+from visionapi.sae_pb2 import SaeMessage
+
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_START_GROUP = 3
+WIRETYPE_END_GROUP = 4
+WIRETYPE_FIXED32 = 5
+
+# The frame fields we keep when removing frame data (must match the whitelist in `RedisWriter._remove_frame_data`)
+FRAME_FIELD_WHITELIST = ('source_id', 'timestamp_utc_ms', 'shape', 'camera_location')
+
+
+def _expected_wire_type(field: FieldDescriptor) -> int:
+    if field.type in (FieldDescriptor.TYPE_STRING, FieldDescriptor.TYPE_BYTES, FieldDescriptor.TYPE_MESSAGE):
+        return WIRETYPE_LENGTH_DELIMITED
+    if field.type in (FieldDescriptor.TYPE_DOUBLE, FieldDescriptor.TYPE_FIXED64, FieldDescriptor.TYPE_SFIXED64):
+        return WIRETYPE_FIXED64
+    if field.type in (FieldDescriptor.TYPE_FLOAT, FieldDescriptor.TYPE_FIXED32, FieldDescriptor.TYPE_SFIXED32):
+        return WIRETYPE_FIXED32
+    return WIRETYPE_VARINT
+
+
+def _encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _encode_tag(field_number: int, wire_type: int) -> bytes:
+    return _encode_varint((field_number << 3) | wire_type)
+
+
+# Field numbers are taken from the generated descriptors, so that the scanner follows the schema of the installed visionapi
+_FRAME_FIELD = SaeMessage.DESCRIPTOR.fields_by_name['frame']
+FRAME_FIELD_NUMBER = _FRAME_FIELD.number
+FRAME_WHITELIST = {
+    field.number: _expected_wire_type(field)
+    for field in (_FRAME_FIELD.message_type.fields_by_name[name] for name in FRAME_FIELD_WHITELIST)
+}
+TYPE_FIELD_NUMBER = TypeMessage.DESCRIPTOR.fields_by_name['type'].number
+FRAME_TIMESTAMP_FIELD_NUMBER = _FRAME_FIELD.message_type.fields_by_name['timestamp_utc_ms'].number
+FRAME_SOURCE_ID_FIELD_NUMBER = _FRAME_FIELD.message_type.fields_by_name['source_id'].number
+
+# `_remove_frame_data` always sets these sub messages (even if they are empty), so we have to emit them, too
+_FRAME_PRESENCE_MARKERS = b''.join(
+    _encode_tag(_FRAME_FIELD.message_type.fields_by_name[name].number, WIRETYPE_LENGTH_DELIMITED) + b'\x00'
+    for name in ('shape', 'camera_location')
+)
+_FRAME_TAG = _encode_tag(FRAME_FIELD_NUMBER, WIRETYPE_LENGTH_DELIMITED)
+
+
+def read_varint(buf: memoryview, pos: int) -> Tuple[int, int]:
+    '''Decodes a varint starting at `pos`. Returns the value and the position after the varint.'''
+    result = 0
+    shift = 0
+    end = len(buf)
+    while True:
+        if pos >= end:
+            raise DecodeError('Truncated varint')
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 64:
+            raise DecodeError('Too many bytes when decoding varint')
+
+
+def _skip_value(buf: memoryview, pos: int, field_number: int, wire_type: int) -> int:
+    if wire_type == WIRETYPE_VARINT:
+        _, pos = read_varint(buf, pos)
+    elif wire_type == WIRETYPE_FIXED64:
+        pos += 8
+    elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+        length, pos = read_varint(buf, pos)
+        pos += length
+    elif wire_type == WIRETYPE_FIXED32:
+        pos += 4
+    elif wire_type == WIRETYPE_START_GROUP:
+        while True:
+            tag, pos = read_varint(buf, pos)
+            if tag & 0x7 == WIRETYPE_END_GROUP:
+                if tag >> 3 != field_number:
+                    raise DecodeError('Mismatched end group tag')
+                break
+            pos = _skip_value(buf, pos, tag >> 3, tag & 0x7)
+    else:
+        raise DecodeError(f'Invalid wire type {wire_type}')
+
+    if pos > len(buf):
+        raise DecodeError('Truncated message')
+    return pos
+
+
+def iter_fields(buf: memoryview) -> Iterator[Tuple[int, int, int, int, int]]:
+    '''Walks over the top-level fields of a serialized message without decoding any values.
+    Yields (field_number, wire_type, field_start, value_start, field_end) for each field, where
+    `field_start` points at the tag and `value_start` at the value (after the length prefix for length-delimited fields).'''
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        field_start = pos
+        tag, pos = read_varint(buf, pos)
+        field_number = tag >> 3
+        wire_type = tag & 0x7
+        if field_number == 0 or wire_type == WIRETYPE_END_GROUP:
+            raise DecodeError('Invalid tag')
+        if wire_type == WIRETYPE_LENGTH_DELIMITED:
+            length, value_start = read_varint(buf, pos)
+            pos = value_start + length
+            if pos > end:
+                raise DecodeError('Truncated message')
+        else:
+            value_start = pos
+            pos = _skip_value(buf, pos, field_number, wire_type)
+        yield field_number, wire_type, field_start, value_start, pos
+
+
+def strip_frame_data(sae_message_bytes: bytes) -> bytes:
+    '''Removes all frame fields except the whitelisted metadata from a serialized SaeMessage,
+    working directly on the wire format (i.e. without parsing the message or copying the frame payload).
+    Produces a message that parses to the same result as the `RedisWriter._remove_frame_data` path.'''
+    buf = memoryview(sae_message_bytes)
+    frame_parts: List[memoryview] = []
+    other_parts: List[memoryview] = []
+
+    copy_start = 0
+    for field_number, wire_type, field_start, value_start, field_end in iter_fields(buf):
+        if field_number != FRAME_FIELD_NUMBER or wire_type != WIRETYPE_LENGTH_DELIMITED:
+            continue
+
+        # Copy everything between the last frame field and this one verbatim
+        if field_start > copy_start:
+            other_parts.append(buf[copy_start:field_start])
+        copy_start = field_end
+
+        frame_buf = buf[value_start:field_end]
+        for sub_number, sub_wire_type, sub_start, _, sub_end in iter_fields(frame_buf):
+            if FRAME_WHITELIST.get(sub_number) == sub_wire_type:
+                frame_parts.append(frame_buf[sub_start:sub_end])
+
+    if copy_start < len(buf):
+        other_parts.append(buf[copy_start:])
+
+    frame_length = len(_FRAME_PRESENCE_MARKERS) + sum(len(part) for part in frame_parts)
+
+    out = bytearray(_FRAME_TAG)
+    out += _encode_varint(frame_length)
+    out += _FRAME_PRESENCE_MARKERS
+    for part in frame_parts:
+        out += part
+    for part in other_parts:
+        out += part
+
+    return bytes(out)
+
+
+def peek_message_type(proto_bytes: bytes) -> int:
+    '''Reads the `type` field (as defined by `TypeMessage`) from a serialized message without parsing the rest of it.
+    Returns `MessageType.UNSPECIFIED` if the field is not present.'''
+    buf = memoryview(proto_bytes)
+    message_type = MessageType.UNSPECIFIED
+    for field_number, wire_type, _, value_start, _ in iter_fields(buf):
+        if field_number == TYPE_FIELD_NUMBER and wire_type == WIRETYPE_VARINT:
+            # Last occurrence wins (same as the protobuf parser)
+            message_type, _ = read_varint(buf, value_start)
+    if message_type >= 1 << 63:
+        message_type -= 1 << 64
+    return message_type
+
+
+def peek_frame_timestamp(sae_message_bytes: bytes) -> Optional[int]:
+    '''Reads `frame.timestamp_utc_ms` from a serialized SaeMessage without parsing the rest of it.
+    Returns None if the field is not present.'''
+    buf = memoryview(sae_message_bytes)
+    timestamp = None
+    for field_number, wire_type, _, value_start, field_end in iter_fields(buf):
+        if field_number != FRAME_FIELD_NUMBER or wire_type != WIRETYPE_LENGTH_DELIMITED:
+            continue
+        # Repeated occurrences of the frame are merged by the parser, i.e. the last timestamp wins
+        frame_buf = buf[value_start:field_end]
+        for sub_number, sub_wire_type, _, sub_value_start, _ in iter_fields(frame_buf):
+            if sub_number == FRAME_TIMESTAMP_FIELD_NUMBER and sub_wire_type == WIRETYPE_VARINT:
+                timestamp, _ = read_varint(frame_buf, sub_value_start)
+    return timestamp
+
+
+def peek_sae_frame_timestamp(proto_bytes: bytes) -> Optional[int]:
+    '''Like `peek_frame_timestamp`, but for messages of any type. Returns None for anything that is not a (valid) SaeMessage.'''
+    try:
+        if peek_message_type(proto_bytes) != MessageType.SAE:
+            return None
+        return peek_frame_timestamp(proto_bytes)
+    except DecodeError:
+        return None
+
+
+def peek_sae_source_id(proto_bytes: bytes) -> Optional[bytes]:
+    '''Reads the (raw) `frame.source_id` of a serialized SaeMessage. Returns None for anything that is not a (valid) SaeMessage or has no source id.'''
+    try:
+        if peek_message_type(proto_bytes) != MessageType.SAE:
+            return None
+        buf = memoryview(proto_bytes)
+        source_id = None
+        for field_number, wire_type, _, value_start, field_end in iter_fields(buf):
+            if field_number != FRAME_FIELD_NUMBER or wire_type != WIRETYPE_LENGTH_DELIMITED:
+                continue
+            frame_buf = buf[value_start:field_end]
+            for sub_number, sub_wire_type, _, sub_value_start, sub_field_end in iter_fields(frame_buf):
+                if sub_number == FRAME_SOURCE_ID_FIELD_NUMBER and sub_wire_type == WIRETYPE_LENGTH_DELIMITED:
+                    source_id = bytes(frame_buf[sub_value_start:sub_field_end])
+        return source_id
+    except DecodeError:
+        return None
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from collections import defaultdict
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import PositionMessage, SaeMessage
+
+from rediswriter.aio_stage import (AsyncSender, AsyncTransformDispatcher,
+                                   run_async_pipeline)
+from rediswriter.config import (ExecutionMode, MappingConfig, PipelineMode,
+                                RedisWriterConfig, TargetRedisConfig,
+                                TransformPoolConfig)
+from rediswriter.rediswriter import RedisWriter
+
+
+def _make_config(mode: ExecutionMode = ExecutionMode.INLINE, mappings=None) -> RedisWriterConfig:
+    return RedisWriterConfig(
+        target_redis=TargetRedisConfig(host='dummy', port=1234, buffer_length=10),
+        mapping_config=mappings if mappings is not None else [MappingConfig()],
+        transform_pool=TransformPoolConfig(mode=mode, workers=3),
+        pipeline_mode=PipelineMode.ASYNCIO,
+    )
+
+@pytest.fixture
+def publisher_mock():
+    with patch('rediswriter.aio_stage.AsyncStreamPublisher') as mock_publisher:
+        publish = AsyncMock()
+        mock_publisher.return_value.__aenter__.return_value = publish
+        yield publish
+
+def test_sender_batches(publisher_mock):
+    async def run():
+        async with AsyncSender(_make_config()) as publish:
+            publish('key', b'msg_bytes')
+            publish('key', b'msg_bytes')
+            publish('key', b'msg_bytes')
+            await asyncio.sleep(0.1)
+            publish('key', b'msg_bytes')
+            await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+    assert publisher_mock.await_count == 2
+    assert len(publisher_mock.await_args_list[0].args[0]) == 3
+    assert len(publisher_mock.await_args_list[1].args[0]) == 1
+
+@pytest.mark.parametrize('mode', [ExecutionMode.INLINE, ExecutionMode.THREAD])
+def test_dispatcher_per_stream_order(mode):
+    config = _make_config(mode)
+    received = defaultdict(list)
+
+    def send_batch(items):
+        for target_stream, msg_bytes, _ in items:
+            received[target_stream].append(_timestamp(msg_bytes))
+
+    async def run():
+        async with AsyncTransformDispatcher(config, RedisWriter(config), send_batch) as dispatcher:
+            for ts in range(20):
+                await dispatcher.transform_batch([
+                    (f'source:{stream_idx}', f'target:{stream_idx}', _make_sae_msg_bytes(ts), None) for stream_idx in range(5)
+                ])
+
+    asyncio.run(run())
+
+    assert len(received) == 5
+    for timestamps in received.values():
+        assert timestamps == list(range(20))
+
+def test_pipeline(publisher_mock):
+    config = _make_config(ExecutionMode.THREAD, mappings=[
+        MappingConfig(source='stage:sae', target='stage:sae_copy'),
+        MappingConfig(source='stage:position', target='stage:position_copy'),
+    ])
+
+    async def iter_batches(room=None):
+        yield [('stage:sae', _make_sae_msg_bytes(1))]
+        yield []
+        yield [('stage:position', _make_position_msg_bytes(2)), ('stage:sae', _make_sae_msg_bytes(3))]
+        # Give the transform workers and the sender time to finish
+        await asyncio.sleep(0.2)
+
+    with patch('rediswriter.aio_stage.AsyncSourceReader') as mock_reader:
+        mock_reader.return_value.__aenter__.return_value = iter_batches
+        asyncio.run(run_async_pipeline(config, threading.Event()))
+
+    published = [entry for call in publisher_mock.await_args_list for entry in call.args[0]]
+    sae_entries = [entry for entry in published if entry.stream_key == 'stage:sae_copy']
+    position_entries = [entry for entry in published if entry.stream_key == 'stage:position_copy']
+    assert [_timestamp(entry.msg_bytes) for entry in sae_entries] == [1, 3]
+    assert len(position_entries) == 1
+
+def _make_sae_msg_bytes(timestamp: int) -> bytes:
+    sae_msg = SaeMessage()
+    sae_msg.frame.timestamp_utc_ms = timestamp
+    sae_msg.frame.frame_data = b'dummy_frame_data'
+    sae_msg.type = MessageType.SAE
+    return sae_msg.SerializeToString()
+
+def _make_position_msg_bytes(timestamp: int) -> bytes:
+    position_msg = PositionMessage()
+    position_msg.timestamp_utc_ms = timestamp
+    position_msg.type = MessageType.POSITION
+    return position_msg.SerializeToString()
+
+def _timestamp(sae_msg_bytes: bytes) -> int:
+    sae_msg = SaeMessage()
+    sae_msg.ParseFromString(sae_msg_bytes)
+    assert len(sae_msg.frame.frame_data) == 0
+    return sae_msg.frame.timestamp_utc_ms
@@ -0,0 +1,61 @@
+import pytest
+
+from rediswriter.batching import AdaptiveBatchController, BatchLimits
+from rediswriter.config import AdaptiveBatchingConfig, TargetRedisConfig
+
+
+@pytest.fixture
+def config():
+    return TargetRedisConfig(
+        host='localhost',
+        port=6379,
+        max_batch_size=100,
+        max_batch_bytes=1_000_000,
+        adaptive_batching=AdaptiveBatchingConfig(enabled=True, min_batch_size=5, min_batch_bytes=50_000, target_duration_ms=100, increase_step=10),
+    )
+
+def test_disabled(config):
+    config.adaptive_batching.enabled = False
+    testee = AdaptiveBatchController(config)
+
+    testee.on_failure()
+    testee.on_success(10, backlog=True)
+
+    assert testee.limits == BatchLimits(100, 1_000_000)
+
+def test_additive_increase(config):
+    testee = AdaptiveBatchController(config)
+    assert testee.limits == BatchLimits(5, 50_000)
+
+    testee.on_success(0.05, backlog=True)
+    assert testee.limits == BatchLimits(15, 150_000)
+
+    # Without backlog the limits are not binding, so there is no reason to increase them
+    testee.on_success(0.05, backlog=False)
+    assert testee.limits == BatchLimits(15, 150_000)
+
+    for _ in range(20):
+        testee.on_success(0.05, backlog=True)
+    assert testee.limits == BatchLimits(100, 1_000_000)
+
+def test_multiplicative_decrease(config):
+    testee = AdaptiveBatchController(config)
+    for _ in range(20):
+        testee.on_success(0.05, backlog=True)
+
+    testee.on_success(0.2, backlog=True)
+    assert testee.limits == BatchLimits(50, 500_000)
+
+    testee.on_failure()
+    assert testee.limits == BatchLimits(25, 250_000)
+
+    for _ in range(10):
+        testee.on_failure()
+    assert testee.limits == BatchLimits(5, 50_000)
+
+def test_minimum_above_maximum(config):
+    config.adaptive_batching.min_batch_size = 1000
+
+    testee = AdaptiveBatchController(config)
+
+    assert testee.limits.size == 100
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+import valkey
+from valkey.exceptions import ConnectionError, TimeoutError
+from visionapi.sae_pb2 import SaeMessage
+
+from benchmarks.generator import MessageProfile, make_message_pool
+from benchmarks.resp_server import Faults, RespParser, RespServer
+from benchmarks.standin import InMemoryStreams
+from benchmarks.suite import EndToEndScenario, bench_end_to_end, bench_sender_get_next_batch, bench_sender_network, percentile
+from rediswriter.config import PipelineMode, TransformMode
+
+PROFILE = MessageProfile(jpeg_bytes=1000, detections=3)
+
+
+def test_generator():
+    messages = make_message_pool(PROFILE, 2)
+
+    sae_msg = SaeMessage.FromString(messages[0])
+    assert len(sae_msg.frame.frame_data_jpeg) == 1000
+    assert len(sae_msg.detections) == 3
+    assert messages[0] != messages[1]
+    assert make_message_pool(PROFILE, 2) == messages
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3
+
+def test_standin_streams():
+    testee = InMemoryStreams()
+    testee.xadd('a', {'proto_data_b64': b'1'})
+    testee.xadd('b', {'proto_data_b64': b'2'})
+    last_id = testee.xadd('a', {'proto_data_b64': b'3'}, maxlen=1)
+
+    assert testee.xrevrange('a', count=1)[0][0] == last_id
+    result = testee.xread({'a': '0-0', 'b': '0-0'}, count=1)
+    assert result == [[b'a', [(b'1-0', {b'proto_data_b64': b'1'})]], [b'b', [(b'2-0', {b'proto_data_b64': b'2'})]]]
+    assert testee.xread({'a': last_id}, block=1) == []
+    assert testee.message_count() == 3
+
+def test_resp_parser():
+    testee = RespParser()
+    testee.feed(b'*2\r\n$4\r\nECHO\r\n$5\r\nhel')
+    assert testee.commands() == []
+    testee.feed(b'lo\r\nPING\r\n*1\r\n$4\r\nPI')
+    assert testee.commands() == [[b'ECHO', b'hello'], [b'PING']]
+    testee.feed(b'NG\r\n')
+    assert testee.commands() == [[b'PING']]
+
+@pytest.fixture
+def resp_server():
+    with RespServer() as server:
+        yield server
+
+def test_resp_server_commands(resp_server):
+    client = valkey.Valkey(host=resp_server.host, port=resp_server.port)
+    assert client.ping()
+    first_id = client.xadd('a', {'f': 'v'}, maxlen=10)
+
+    pipeline = client.pipeline(transaction=False)
+    pipeline.xadd('a', {'f': 'w'}, maxlen=10)
+    pipeline.xadd('b', {'f': 'x'}, maxlen=10)
+    second_id, _ = pipeline.execute()
+
+    assert client.xread({'a': first_id}) == [[b'a', [(second_id, {b'f': b'w'})]]]
+    assert client.xrevrange('a', count=1) == [(second_id, {b'f': b'w'})]
+    assert sorted(client.scan_iter(match='*', _type='stream')) == [b'a', b'b']
+    assert client.xread({'a': '$'}, block=10) == []
+    assert len(client.client_list()) == 1
+    client.close()
+
+def test_resp_server_faults(resp_server):
+    client = valkey.Valkey(host=resp_server.host, port=resp_server.port, socket_timeout=0.2)
+    client.ping()
+
+    resp_server.faults = Faults(latency_ms=50)
+    start = time.monotonic()
+    client.ping()
+    assert time.monotonic() - start >= 0.05
+
+    resp_server.faults = Faults(blackhole=True)
+    with pytest.raises(TimeoutError):
+        client.ping()
+
+    # Reconnect before the next fault, which would also hit the connection handshake
+    resp_server.faults = Faults()
+    client.ping()
+    resp_server.faults = Faults(disconnect_probability=1)
+    with pytest.raises(ConnectionError):
+        client.xadd('a', {'f': 'v'})
+    # The command was executed, only the reply got lost
+    assert resp_server.streams.message_count() == 1
+    assert resp_server.disconnects == 1
+    client.close()
+
+def test_sender_network():
+    result = bench_sender_network(PROFILE, count=200, streams=2, faults=Faults(latency_ms=2, disconnect_probability=0.01), timeout_s=30)
+
+    assert result.extra['delivered_ratio'] == 1
+    assert result.extra['backoffs'] >= result.extra['disconnects'] > 0
+
+def test_sender_get_next_batch():
+    result = bench_sender_get_next_batch(PROFILE, count=250, streams=2)
+
+    assert result.messages == 250
+    assert result.extra['batches'] == 3
+
+def test_end_to_end():
+    for pipeline_mode in PipelineMode:
+        result = bench_end_to_end(PROFILE, count=20, streams=2, scenario=EndToEndScenario(pipeline_mode, TransformMode.WIRE), timeout_s=10)
+
+        assert result.messages == 20
+        assert result.extra['delivered_ratio'] == 1
+        assert result.latency_p50_ms <= result.latency_p99_ms
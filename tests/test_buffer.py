@@ -0,0 +1,148 @@
+import random
+
+from rediswriter.buffer import BufferEntry, StreamBuffer, entry_size
+
+
+def test_round_robin_drain():
+    testee = StreamBuffer(max_bytes=1000, max_length=100)
+
+    for i in range(3):
+        testee.append(BufferEntry('a', f'a{i}'.encode()), i)
+    testee.append(BufferEntry('b', b'b0'), 3)
+    testee.append(BufferEntry('c', b'c0'), 4)
+    testee.append(BufferEntry('c', b'c1'), 5)
+
+    batch, enqueue_times = testee.drain(max_count=100, max_bytes=1000)
+
+    assert [entry.msg_bytes for entry in batch] == [b'a0', b'b0', b'c0', b'a1', b'c1', b'a2']
+    assert enqueue_times == [0, 3, 4, 1, 5, 2]
+    assert len(testee) == 0
+    assert testee.bytes == 0
+
+def test_drain_limits():
+    testee = StreamBuffer(max_bytes=1000, max_length=100)
+
+    for i in range(5):
+        testee.append(BufferEntry('a', b'0123456789'), i)
+
+    batch, _ = testee.drain(max_count=2, max_bytes=1000)
+    assert len(batch) == 2
+
+    # Every entry is 11 bytes
+    batch, _ = testee.drain(max_count=100, max_bytes=25)
+    assert len(batch) == 2
+
+    # At least one entry is returned, even if it exceeds the byte limit
+    batch, _ = testee.drain(max_count=100, max_bytes=1)
+    assert len(batch) == 1
+    assert len(testee) == 0
+
+def test_byte_budget_evicts_largest_stream():
+    testee = StreamBuffer(max_bytes=100, max_length=100)
+
+    testee.append(BufferEntry('quiet', b'0123456789'), 0)
+    for i in range(10):
+        evicted = testee.append(BufferEntry('chatty', b'0123456789'), i)
+
+    # 11 entries with 11 bytes each exceed the budget by one entry, which must be taken from the chatty stream
+    assert len(evicted) == 1
+    assert evicted[0].stream_key == 'chatty'
+    assert testee.bytes <= 100
+
+    batch, _ = testee.drain(max_count=100, max_bytes=1000)
+    assert batch[0].stream_key == 'quiet'
+
+def test_length_bound():
+    testee = StreamBuffer(max_bytes=1000, max_length=2)
+
+    testee.append(BufferEntry('a', b'0'), 0)
+    testee.append(BufferEntry('a', b'1'), 1)
+    evicted = testee.append(BufferEntry('a', b'2'), 2)
+
+    assert [entry.msg_bytes for entry in evicted] == [b'0']
+    assert testee.oldest_enqueue_time() == 1
+
+def test_priorities():
+    testee = StreamBuffer(max_bytes=1000, max_length=4)
+
+    testee.append(BufferEntry('low', b'l0', priority=2), 0)
+    testee.append(BufferEntry('high', b'h0', priority=0), 1)
+    testee.append(BufferEntry('normal', b'n0', priority=1), 2)
+    testee.append(BufferEntry('high', b'h1', priority=0), 3)
+    evicted = testee.append(BufferEntry('high', b'h2', priority=0), 4)
+
+    # Overflow evicts the lowest priority first, draining starts with the highest
+    assert [entry.msg_bytes for entry in evicted] == [b'l0']
+    batch, enqueue_times = testee.drain(max_count=3, max_bytes=1000)
+    assert [entry.msg_bytes for entry in batch] == [b'h0', b'h1', b'h2']
+    assert enqueue_times == [1, 3, 4]
+    assert testee.oldest_enqueue_time() == 2
+
+def test_conflation():
+    testee = StreamBuffer(max_bytes=1000, max_length=10)
+
+    testee.append(BufferEntry('a', b'a0', conflation_key='x'), 0)
+    testee.append(BufferEntry('a', b'plain'), 1)
+    testee.append(BufferEntry('a', b'a1', conflation_key='y'), 2)
+    bytes_before = testee.bytes
+
+    # The newest entry takes the slot (and enqueue time) of the pending one
+    assert testee.replace(BufferEntry('a', b'a0-newer', conflation_key='x')) == []
+    assert testee.replace(BufferEntry('b', b'b0', conflation_key='x')) is None
+    assert len(testee) == 3
+    assert testee.bytes == bytes_before + 6
+
+    batch, enqueue_times = testee.drain(max_count=1, max_bytes=1000)
+    assert [entry.msg_bytes for entry in batch] == [b'a0-newer']
+    assert enqueue_times == [0]
+
+    # Once taken, an entry cannot be replaced anymore
+    assert testee.replace(BufferEntry('a', b'a0-newest', conflation_key='x')) is None
+    assert testee.replace(BufferEntry('a', b'a1-newer', conflation_key='y')) == []
+    batch, _ = testee.drain(max_count=10, max_bytes=1000)
+    assert [entry.msg_bytes for entry in batch] == [b'plain', b'a1-newer']
+    assert testee.bytes == 0
+
+def test_conflation_evicts_on_growth():
+    testee = StreamBuffer(max_bytes=30, max_length=10)
+
+    testee.append(BufferEntry('a', b'0123456789' * 2), 0)
+    testee.append(BufferEntry('b', b'0', conflation_key='x'), 1)
+    evicted = testee.replace(BufferEntry('b', b'0123456789', conflation_key='x'))
+
+    assert [entry.stream_key for entry in evicted] == ['a']
+    assert testee.bytes == 11
+
+def _reference_drain(queues, active, max_count, max_bytes):
+    '''Takes one entry at a time, round-robin over the `active` streams (the rotation is kept between calls)'''
+    batch = []
+    batch_bytes = 0
+    while len(active) > 0 and len(batch) < max_count:
+        entry = queues[active[0]][0]
+        if len(batch) > 0 and batch_bytes + entry_size(entry) > max_bytes:
+            break
+        key = active.pop(0)
+        batch.append(queues[key].pop(0))
+        batch_bytes += entry_size(entry)
+        if len(queues[key]) > 0:
+            active.append(key)
+    return batch
+
+def test_bulk_drain_matches_round_robin():
+    rng = random.Random(0)
+    for _ in range(200):
+        testee = StreamBuffer(max_bytes=10**9, max_length=10**6)
+        queues = {}
+        for i in range(rng.randrange(1, 60)):
+            stream_key = f'stream{rng.randrange(5)}'
+            entry = BufferEntry(stream_key, bytes(rng.randrange(1, 20)))
+            testee.append(entry, i)
+            queues.setdefault(stream_key, []).append(entry)
+
+        active = list(queues)
+        while len(testee) > 0:
+            max_count, max_bytes = rng.randrange(1, 30), rng.randrange(1, 300)
+            expected = _reference_drain(queues, active, max_count, max_bytes)
+            batch, _ = testee.drain(max_count, max_bytes)
+            assert batch == expected
+            assert testee.bytes == sum(entry_size(entry) for entries in queues.values() for entry in entries)
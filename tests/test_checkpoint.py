@@ -0,0 +1,93 @@
+import time
+from unittest.mock import patch
+
+from valkey.exceptions import ResponseError
+
+from rediswriter.checkpoint import Checkpointer, FileCheckpointStore
+from rediswriter.config import (CheckpointConfig, CheckpointStore,
+                                MappingConfig, RedisWriterConfig,
+                                TargetRedisConfig)
+
+
+def _make_config(**checkpoint) -> RedisWriterConfig:
+    return RedisWriterConfig(
+        target_redis=TargetRedisConfig(host='dummy', port=1234, buffer_length=40),
+        mapping_config=[MappingConfig(source='stream1')],
+        checkpoint=CheckpointConfig(enabled=True, **checkpoint),
+    )
+
+def test_file_store(tmp_path):
+    store = FileCheckpointStore(str(tmp_path / 'checkpoints.json'))
+    assert store.load() == {}
+
+    store.save({'stream1': '5-0'})
+    store.save({'stream1': '7-0', 'stream2': '1-0'})
+
+    assert FileCheckpointStore(str(tmp_path / 'checkpoints.json')).load() == {'stream1': '7-0', 'stream2': '1-0'}
+    assert not (tmp_path / 'checkpoints.json.tmp').exists()
+
+def test_unparsable_file_is_ignored(tmp_path):
+    path = tmp_path / 'checkpoints.json'
+    path.write_text('{"stream1": "5-')
+    assert FileCheckpointStore(str(path)).load() == {}
+
+    path.write_text('["5-0"]')
+    assert Checkpointer(_make_config(path=str(path))).start_ids == {}
+
+def test_redis_store():
+    with patch('rediswriter.checkpoint.valkey.Valkey') as mock_valkey:
+        client = mock_valkey.return_value
+        client.hgetall.return_value = {b'stream1': b'5-0'}
+
+        with Checkpointer(_make_config(store=CheckpointStore.REDIS, key='checkpoints')) as checkpointer:
+            assert checkpointer.start_ids == {'stream1': '5-0'}
+            checkpointer.commit({'stream1': '7-0'})
+            # An empty hash cannot be written (and nothing would be gained)
+            checkpointer.commit({})
+
+    client.hgetall.assert_called_once_with('checkpoints')
+    client.hset.assert_called_once_with('checkpoints', mapping={'stream1': '7-0'})
+    client.close.assert_called_once()
+
+def test_unreadable_redis_store_is_ignored():
+    with patch('rediswriter.checkpoint.valkey.Valkey') as mock_valkey:
+        mock_valkey.return_value.hgetall.side_effect = ResponseError('WRONGTYPE Operation against a key holding the wrong kind of value')
+
+        assert Checkpointer(_make_config(store=CheckpointStore.REDIS, key='checkpoints')).start_ids == {}
+
+def test_commits_only_published_positions(tmp_path):
+    path = str(tmp_path / 'checkpoints.json')
+    FileCheckpointStore(path).save({'stream1': '1-0'})
+    checkpointer = Checkpointer(_make_config(path=path, interval_s=0.01))
+    assert checkpointer.start_ids == {'stream1': '1-0'}
+    assert checkpointer.catch_up.read_count == 1000
+
+    before = time.monotonic()
+    last_ids = {b'stream1': b'5-0'}
+    assert checkpointer.poll(last_ids, lambda: None, lambda: None) is None
+
+    time.sleep(0.02)
+    # Messages submitted before the snapshot are still being transformed or published
+    assert checkpointer.poll(last_ids, lambda: before, lambda: None) is None
+    assert checkpointer.poll(last_ids, lambda: None, lambda: before) is None
+    # Messages read after the snapshot do not hold it back
+    last_ids[b'stream1'] = b'8-0'
+    ids = checkpointer.poll(last_ids, lambda: None, lambda: time.monotonic())
+    assert ids == {'stream1': '5-0'}
+
+    checkpointer.commit(ids)
+    assert FileCheckpointStore(path).load() == {'stream1': '5-0'}
+
+    # Unchanged positions are not written again
+    time.sleep(0.02)
+    assert checkpointer.poll({'stream1': '5-0'}, lambda: None, lambda: None) is None
+
+def test_commit_failure_is_retried(tmp_path):
+    checkpointer = Checkpointer(_make_config(path=str(tmp_path / 'missing' / 'checkpoints.json'), interval_s=0.01))
+
+    time.sleep(0.02)
+    ids = checkpointer.poll({'stream1': '5-0'}, lambda: None, lambda: None)
+    checkpointer.commit(ids)
+
+    time.sleep(0.02)
+    assert checkpointer.poll({'stream1': '5-0'}, lambda: None, lambda: None) == {'stream1': '5-0'}
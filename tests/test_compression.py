@@ -0,0 +1,47 @@
+import pytest
+
+from rediswriter.compression import (Codec, LzmaCodec, ZlibCodec, codec_fields,
+                                     create_codec, register_codec)
+from rediswriter.config import CompressionConfig
+
+PAYLOAD = b'detection bounding box confidence class_id object_id' * 20
+
+
+@pytest.mark.parametrize('codec', [ZlibCodec(), ZlibCodec(level=9), LzmaCodec()])
+def test_roundtrip(codec):
+    compressed = codec.compress(PAYLOAD)
+
+    assert len(compressed) < len(PAYLOAD)
+    assert codec.decompress(compressed) == PAYLOAD
+
+def test_zlib_dictionary(tmp_path):
+    dictionary_path = tmp_path / 'dict'
+    dictionary_path.write_bytes(PAYLOAD[:200])
+
+    codec = create_codec(CompressionConfig(codec='zlib', dictionary_path=str(dictionary_path)))
+    compressed = codec.compress(PAYLOAD[:200])
+
+    assert len(compressed) < len(ZlibCodec().compress(PAYLOAD[:200]))
+    assert codec.decompress(compressed) == PAYLOAD[:200]
+    assert codec_fields(codec) == {'codec': 'zlib', 'codec_dict': codec.dictionary_id}
+
+def test_none():
+    assert create_codec(CompressionConfig()) is None
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        create_codec(CompressionConfig(codec='does_not_exist'))
+
+def test_register_codec():
+    class ReverseCodec(Codec):
+        name = 'reverse'
+        def compress(self, data):
+            return data[::-1]
+        def decompress(self, data):
+            return data[::-1]
+
+    register_codec('reverse', ReverseCodec)
+    codec = create_codec(CompressionConfig(codec='reverse'))
+
+    assert codec.compress(b'abc') == b'cba'
+    assert codec_fields(codec) == {'codec': 'reverse'}
@@ -0,0 +1,105 @@
+import random
+
+import pytest
+from pydantic import ValidationError
+from prometheus_client import REGISTRY
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import Detection, PositionMessage, SaeMessage
+
+from rediswriter.config import (DetectionFilterConfig, GeofenceConfig,
+                                GeofenceCoordinates, MappingConfig,
+                                RedisWriterConfig, TargetRedisConfig,
+                                TransformMode)
+from rediswriter.detection_filter import (CompiledFilter, DetectionFilter,
+                                         filter_detections)
+from rediswriter.rediswriter import RedisWriter
+
+# A concave (U-shaped) area, the notch between x=0.4 and x=0.6 is outside
+U_SHAPE = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.6, 1.0), (0.6, 0.5), (0.4, 0.5), (0.4, 1.0), (0.0, 1.0)]
+
+
+def _sae_msg(seed: int = 0, count: int = 50) -> SaeMessage:
+    rnd = random.Random(seed)
+    sae_msg = SaeMessage(type=MessageType.SAE)
+    sae_msg.frame.source_id = 'camera01'
+    sae_msg.frame.timestamp_utc_ms = 1234
+    for _ in range(count):
+        det = Detection()
+        det.confidence = rnd.random()
+        det.class_id = rnd.randint(0, 3)
+        det.bounding_box.min_x = rnd.random() / 2
+        det.bounding_box.max_x = det.bounding_box.min_x + rnd.random() / 2
+        det.bounding_box.min_y = rnd.random() / 2
+        det.bounding_box.max_y = det.bounding_box.min_y + rnd.random() / 2
+        det.geo_coordinate.longitude = rnd.random()
+        det.geo_coordinate.latitude = rnd.random()
+        det.object_id = rnd.randbytes(16)
+        sae_msg.detections.append(det)
+    return sae_msg
+
+def _in_u_shape(x: float, y: float) -> bool:
+    return 0 < x < 1 and 0 < y < 1 and not (0.4 < x < 0.6 and y > 0.5)
+
+@pytest.mark.parametrize('config, expected', [
+    (DetectionFilterConfig(min_confidence=0.5), lambda det: det.confidence >= 0.5),
+    (DetectionFilterConfig(class_ids=[1, 2]), lambda det: det.class_id in (1, 2)),
+    (DetectionFilterConfig(geofence=GeofenceConfig(polygon=U_SHAPE)),
+     lambda det: _in_u_shape((det.bounding_box.min_x + det.bounding_box.max_x) / 2, det.bounding_box.max_y)),
+    (DetectionFilterConfig(min_confidence=0.3, class_ids=[0], geofence=GeofenceConfig(coordinates=GeofenceCoordinates.GEO, polygon=U_SHAPE)),
+     lambda det: det.confidence >= 0.3 and det.class_id == 0 and _in_u_shape(det.geo_coordinate.longitude, det.geo_coordinate.latitude)),
+])
+def test_filter_matches_proto_semantics(config, expected):
+    sae_msg = _sae_msg()
+    filtered = SaeMessage()
+    filtered.CopyFrom(sae_msg)
+
+    detections, removed = filter_detections(filtered, CompiledFilter(config))
+
+    expected_msg = SaeMessage()
+    expected_msg.CopyFrom(sae_msg)
+    del expected_msg.detections[:]
+    expected_msg.detections.extend(det for det in sae_msg.detections if expected(det))
+    assert filtered.SerializeToString() == expected_msg.SerializeToString()
+    assert (detections, removed) == (50, 50 - len(expected_msg.detections))
+    assert 0 < removed < 50
+
+def test_nothing_removed():
+    config = RedisWriterConfig(
+        target_redis=TargetRedisConfig(host='dummy', port=1234),
+        mapping_config=[MappingConfig(source='filtered', detection_filter=DetectionFilterConfig(min_confidence=0))],
+    )
+    proto_bytes = _sae_msg().SerializeToString()
+
+    filtered = DetectionFilter(config).apply('filtered', proto_bytes)
+
+    assert filtered is proto_bytes
+
+def test_invalid_polygon():
+    with pytest.raises(ValidationError):
+        GeofenceConfig(polygon=[(0, 0), (1, 1)])
+
+@pytest.mark.parametrize('transform_mode', list(TransformMode))
+def test_writer_applies_filter(transform_mode):
+    config = RedisWriterConfig(
+        target_redis=TargetRedisConfig(host='dummy', port=1234),
+        mapping_config=[MappingConfig(source='filtered', detection_filter=DetectionFilterConfig(min_confidence=0.5)), MappingConfig(source='all')],
+        transform_mode=transform_mode,
+    )
+    testee = RedisWriter(config)
+    sae_msg = _sae_msg(seed=1)
+    labels = {'stream': 'filtered'}
+    removed_before = REGISTRY.get_sample_value('redis_writer_detection_filter_removed_counter_total', labels) or 0
+    saved_before = REGISTRY.get_sample_value('redis_writer_detection_filter_saved_bytes_total', labels) or 0
+
+    filtered = SaeMessage.FromString(testee.get(sae_msg.SerializeToString(), 'filtered'))
+    unfiltered = SaeMessage.FromString(testee.get(sae_msg.SerializeToString(), 'all'))
+    position_bytes = PositionMessage(type=MessageType.POSITION).SerializeToString()
+
+    assert all(det.confidence >= 0.5 for det in filtered.detections)
+    assert len(unfiltered.detections) == 50
+    removed = REGISTRY.get_sample_value('redis_writer_detection_filter_removed_counter_total', labels) - removed_before
+    assert removed == 50 - len(filtered.detections)
+    assert REGISTRY.get_sample_value('redis_writer_detection_filter_saved_bytes_total', labels) - saved_before == len(unfiltered.SerializeToString()) - len(filtered.SerializeToString())
+    # Other message types (and malformed messages) pass unchanged
+    assert DetectionFilter(config).apply('filtered', position_bytes) == position_bytes
+    assert DetectionFilter(config).apply('filtered', b'\xff\xff') == b'\xff\xff'
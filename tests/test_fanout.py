@@ -0,0 +1,125 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from prometheus_client import REGISTRY
+from pydantic import ValidationError
+from valkey.exceptions import ConnectionError
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import SaeMessage
+
+from rediswriter.config import (CompressionConfig, MappingConfig,
+                                RedisWriterConfig, SpillConfig,
+                                TargetRedisConfig)
+from rediswriter.aio_stage import AsyncSender
+from rediswriter.fanout import FanOutSender, needs_fan_out, target_configs
+from rediswriter.sender import EntryPreparer, Sender
+from rediswriter.stage import run_stage
+
+
+def _make_config(mappings=None, **kwargs) -> RedisWriterConfig:
+    return RedisWriterConfig(
+        log_level='WARNING',
+        target_redis=[
+            TargetRedisConfig(name='backend', host='backend', port=6379, spill=SpillConfig(directory='/tmp/spill')),
+            TargetRedisConfig(name='archive', host='archive', port=6379),
+        ],
+        mapping_config=mappings if mappings is not None else [MappingConfig()],
+        **kwargs
+    )
+
+def _make_sae_msg_bytes(timestamp: int) -> bytes:
+    sae_msg = SaeMessage()
+    sae_msg.frame.timestamp_utc_ms = timestamp
+    sae_msg.frame.frame_data_jpeg = b'dummy_frame_data_jpeg'
+    sae_msg.type = MessageType.SAE
+    return sae_msg.SerializeToString()
+
+def test_config_validation():
+    with pytest.raises(ValidationError):
+        RedisWriterConfig(target_redis=[TargetRedisConfig(host='a', port=1), TargetRedisConfig(host='b', port=1)], mapping_config=[])
+    with pytest.raises(ValidationError):
+        _make_config(mappings=[MappingConfig(source='stream', targets=['unknown'])])
+
+    # A single target does not need a name
+    assert RedisWriterConfig(target_redis=TargetRedisConfig(host='a', port=1), mapping_config=[]).targets[0].host == 'a'
+
+def test_single_target_list():
+    config = RedisWriterConfig(target_redis=[{'host': 'a', 'port': 1, 'sender_workers': 2}], mapping_config=[MappingConfig(source='stream')])
+
+    # A list with a single target is the same as the target itself
+    assert config.target_redis == TargetRedisConfig(host='a', port=1, sender_workers=2)
+    assert not needs_fan_out(config)
+    assert len(Sender(config)._workers) == 2
+    assert len(AsyncSender(config)._workers) == 2
+
+def test_target_configs():
+    configs = target_configs(_make_config())
+
+    assert [config.target_redis.name for config in configs] == ['backend', 'archive']
+    assert configs[0].target_redis.spill.directory == '/tmp/spill/backend'
+    assert configs[1].target_redis.spill.directory == 'spill/archive'
+
+def test_stage_transforms_once_and_fans_out():
+    config = _make_config(mappings=[
+        MappingConfig(source='stream1', target='out1'),
+        MappingConfig(source='stream2', target='out2', targets=['archive']),
+    ])
+    published = {}
+
+    def make_sender(target_config):
+        sender = MagicMock(preparer=EntryPreparer(target_config))
+        sent = published.setdefault(target_config.target_redis.name, [])
+        sender.publish_entries.side_effect = lambda entries: sent.extend(entry.stream_key for entry in entries)
+        return sender
+
+    with patch('rediswriter.stage.start_http_server'), \
+            patch('rediswriter.stage.RedisWriterConfig', return_value=config), \
+            patch('rediswriter.stage.Sender', side_effect=make_sender), \
+            patch('rediswriter.stage.SourceReader') as mock_reader, \
+            patch('rediswriter.rediswriter.RedisWriter.get_batch', autospec=True, side_effect=lambda _, protos, __: protos) as get_batch:
+        mock_reader.return_value.__enter__.return_value.return_value.__iter__.return_value = iter([
+            [('stream1', _make_sae_msg_bytes(1)), ('stream2', _make_sae_msg_bytes(2))],
+        ])
+        run_stage()
+
+    assert get_batch.call_count == 1
+    assert published == {'backend': ['out1'], 'archive': ['out1', 'out2']}
+
+def test_entries_are_prepared_once_per_compression():
+    config = _make_config()
+    config.target_redis.append(TargetRedisConfig(name='cold', host='cold', port=6379, compression=CompressionConfig(codec='zlib', min_size_bytes=0)))
+    senders = [MagicMock(preparer=EntryPreparer(target_config)) for target_config in target_configs(config)]
+    testee = FanOutSender(['backend', 'archive', 'cold'], senders, lambda *_: None)
+
+    with patch.object(EntryPreparer, 'prepare', autospec=True, side_effect=EntryPreparer.prepare) as prepare:
+        testee.publish_batch([('stream', b'msg' * 100, None)])
+
+    # backend and archive share the uncompressed entry
+    assert prepare.call_count == 2
+    entries = [sender.publish_entries.call_args.args[0][0] for sender in senders]
+    assert entries[0] is entries[1]
+    assert entries[0].msg_bytes == b'msg' * 100
+    assert entries[2].fields == {'codec': 'zlib'}
+
+def test_dead_target_does_not_stall_others():
+    configs = target_configs(_make_config())
+    publishers = {'backend': MagicMock(side_effect=ConnectionError()), 'archive': MagicMock()}
+
+    def backoffs(target):
+        return REGISTRY.get_sample_value('redis_writer_backoff_counter_total', {'target': target}) or 0
+    backoffs_before = {target: backoffs(target) for target in publishers}
+
+    with patch('rediswriter.sender.StreamPublisher') as mock_publisher:
+        mock_publisher.side_effect = lambda host, **_: MagicMock(**{'__enter__.return_value': publishers[host]})
+        testee = FanOutSender(['backend', 'archive'], [Sender(config) for config in configs], lambda *_: None)
+        with testee as publish:
+            for idx in range(5):
+                publish('stream', f'msg{idx}'.encode())
+                time.sleep(0.02)
+
+    assert [entry.msg_bytes for call in publishers['archive'].call_args_list for entry in call.args[0]] == [f'msg{idx}'.encode() for idx in range(5)]
+    assert not testee.has_room()
+    # Sender metrics tell the targets apart
+    assert backoffs('backend') > backoffs_before['backend']
+    assert backoffs('archive') == backoffs_before['archive']
@@ -0,0 +1,96 @@
+import pytest
+
+from rediswriter.config import MappingConfig, PatternType
+from rediswriter.mapping import MappingTable, glob_to_regex
+
+
+def test_exact_mappings():
+    testee = MappingTable([
+        MappingConfig(source='geomapper:device01'),
+        MappingConfig(source='positionsource:self', target='positionsource:other'),
+    ])
+
+    assert testee.resolve('geomapper:device01')[1] == 'geomapper:device01'
+    assert testee.resolve('positionsource:self')[1] == 'positionsource:other'
+    assert testee.resolve('geomapper:device02') is None
+    assert list(testee.source_streams) == ['geomapper:device01', 'positionsource:self']
+    assert testee.scan_matches == []
+
+def test_glob_pattern():
+    testee = MappingTable([
+        MappingConfig(source_pattern='geomapper:*', target='backend:{0}'),
+        MappingConfig(source_pattern='objectdetector:device0?'),
+    ])
+
+    assert testee.resolve('geomapper:device01')[1] == 'backend:device01'
+    assert testee.resolve('objectdetector:device02')[1] == 'objectdetector:device02'
+    assert testee.resolve('objectdetector:device10') is None
+    assert testee.scan_matches == ['geomapper:*', 'objectdetector:device0?']
+
+def test_regex_pattern():
+    mapping = MappingConfig(source_pattern=r'(?P<stage>\w+):cam(?P<no>\d+)', pattern_type=PatternType.REGEX, target='{stage}:camera{no}')
+    testee = MappingTable([mapping])
+
+    assert testee.resolve('geomapper:cam7') == (mapping, 'geomapper:camera7')
+    assert testee.resolve('geomapper:cam7:extra') is None
+    # Regexes cannot be handed to SCAN
+    assert testee.scan_matches == ['*']
+
+def test_exact_before_patterns():
+    exact = MappingConfig(source='geomapper:device01', target='special')
+    pattern = MappingConfig(source_pattern='geomapper:*', target='{source}_copy')
+    testee = MappingTable([pattern, exact])
+
+    assert testee.resolve('geomapper:device01') == (exact, 'special')
+    assert testee.resolve('geomapper:device02') == (pattern, 'geomapper:device02_copy')
+
+def test_mapping_for_target():
+    exact = MappingConfig(source='positionsource:self', target='positionsource:other')
+    pattern = MappingConfig(source_pattern='geomapper:*', target='backend:{0}')
+    testee = MappingTable([exact, pattern])
+
+    assert testee.mapping_for_target('positionsource:other') is exact
+    assert testee.mapping_for_target('backend:device01') is pattern
+    assert testee.mapping_for_target('somewhere:else') is None
+
+def test_invalid_target_templates():
+    with pytest.raises(ValueError):
+        MappingTable([MappingConfig(source_pattern='geomapper:*', target='out:{foo}')])
+    with pytest.raises(ValueError):
+        MappingTable([MappingConfig(source_pattern='geomapper:*', target='{1}')])
+    with pytest.raises(ValueError):
+        MappingTable([MappingConfig(source_pattern=r'(?P<stage>\w+):cam', pattern_type=PatternType.REGEX, target='{stage}:{no}')])
+    MappingTable([MappingConfig(source_pattern=r'(?P<stage>\w+):cam', pattern_type=PatternType.REGEX, target='{stage}:{0}:{source}')])
+
+def test_glob_to_regex_escapes():
+    assert glob_to_regex('a.b*') == r'a\.b(.*)'
+
+def test_glob_character_classes_and_escapes():
+    testee = MappingTable([
+        MappingConfig(source_pattern='cam[12]:*', target='out:{0}:{1}'),
+        MappingConfig(source_pattern='lit\\*[^a-c][z-x]'),
+    ])
+
+    # Character classes are wildcards like `?`, i.e. they get a group
+    assert testee.resolve('cam1:x')[1] == 'out:1:x'
+    assert testee.resolve('cam2:y')[1] == 'out:2:y'
+    assert testee.resolve('cam3:x') is None
+    assert testee.resolve('lit*dy')[1] == 'lit*dy'
+    assert testee.resolve('lit*by') is None
+    assert testee.resolve('litxdy') is None
+    # Handed to SCAN unchanged, as it understands the same syntax
+    assert testee.scan_matches == ['cam[12]:*', 'lit\\*[^a-c][z-x]']
+
+def test_glob_wildcards_match_newlines():
+    testee = MappingTable([MappingConfig(source_pattern='cam?:*', target='out:{0}:{1}')])
+
+    assert testee.resolve('cam\n:a\nb')[1] == 'out:\n:a\nb'
+    assert testee.mapping_for_target('out:\n:a\nb') is not None
+
+def test_glob_to_regex_edge_cases():
+    assert glob_to_regex('a[]') == r'a([^\s\S])'
+    assert glob_to_regex('a[^]') == r'a([\s\S])'
+    assert glob_to_regex('[\\]]') == r'([\]])'
+    # Unterminated classes end with the pattern and a trailing backslash is literal (like in Redis)
+    assert glob_to_regex('a[bc') == r'a([bc])'
+    assert glob_to_regex('a\\') == r'a\\'
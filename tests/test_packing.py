@@ -0,0 +1,49 @@
+import pytest
+from google.protobuf.message import DecodeError
+from prometheus_client import REGISTRY
+
+from rediswriter.buffer import BufferEntry
+from rediswriter.config import PackingConfig
+from rediswriter.packing import (PACKED_FIELD, frame_messages, pack_entries,
+                                 split_frames)
+
+
+def test_framing():
+    messages = [b'', b'a', b'x' * 300]
+
+    assert split_frames(frame_messages(messages)) == messages
+    assert split_frames(b'') == []
+    with pytest.raises(DecodeError):
+        split_frames(frame_messages(messages)[:-1])
+
+def test_pack_entries():
+    batch = [
+        BufferEntry('a', b'a0', frame_timestamp_ms=1),
+        BufferEntry('b', b'b0'),
+        BufferEntry('a', b'a1', frame_timestamp_ms=2),
+        BufferEntry('a', b'a2', {'codec': 'zlib'}),
+        BufferEntry('a', b'a3'),
+        BufferEntry('a', b'a4'),
+        BufferEntry('a', b'a5'),
+    ]
+    before = REGISTRY.get_sample_value('redis_writer_pack_size_sum', {'stream': 'a'}) or 0
+
+    packed = pack_entries(batch, PackingConfig(enabled=True, max_messages=2))
+
+    # Messages with different fields are not packed together and the order within each stream is kept
+    assert [(entry.stream_key, entry.fields) for entry in packed] == [
+        ('a', {PACKED_FIELD: '2'}), ('b', None), ('a', {'codec': 'zlib'}), ('a', {PACKED_FIELD: '2'}), ('a', None),
+    ]
+    assert split_frames(packed[0].msg_bytes) == [b'a0', b'a1']
+    assert packed[0].frame_timestamp_ms == 2
+    assert packed[1] is batch[1]
+    assert split_frames(packed[3].msg_bytes) == [b'a3', b'a4']
+    assert REGISTRY.get_sample_value('redis_writer_pack_size_sum', {'stream': 'a'}) - before == 6
+
+def test_pack_entries_max_bytes():
+    batch = [BufferEntry('a', b'0123456789') for _ in range(5)]
+
+    # Every framed message takes 11 bytes
+    packed = pack_entries(batch, PackingConfig(enabled=True, max_bytes=22))
+
+    assert [entry.fields[PACKED_FIELD] if entry.fields is not None else '1' for entry in packed] == ['2', '2', '1']
@@ -0,0 +1,87 @@
+import pytest
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import SaeMessage
+
+from rediswriter.config import (MappingConfig, ProjectionConfig,
+                                RedisWriterConfig, TargetRedisConfig,
+                                TransformMode)
+from rediswriter.projection import compile_projection, project
+from rediswriter.rediswriter import RedisWriter
+
+
+def _make_sae_msg() -> SaeMessage:
+    sae_msg = SaeMessage()
+    sae_msg.type = MessageType.SAE
+    sae_msg.frame.source_id = 'camera01'
+    sae_msg.frame.timestamp_utc_ms = 1234
+    sae_msg.metrics.detection_inference_time_us = 42
+    for i in range(3):
+        detection = sae_msg.detections.add()
+        detection.bounding_box.min_x = 0.1 * i
+        detection.bounding_box.max_y = 0.2 * i
+        detection.confidence = 0.9
+        detection.class_id = i
+        detection.object_id = b'object'
+        detection.feature.extend([0.5] * 64)
+    return sae_msg
+
+def _project(sae_msg: SaeMessage, **projection) -> SaeMessage:
+    plan = compile_projection(ProjectionConfig(**projection))
+    projected = SaeMessage()
+    projected.ParseFromString(project(sae_msg.SerializeToString(), plan))
+    return projected
+
+def test_exclude():
+    expected = _make_sae_msg()
+    for detection in expected.detections:
+        detection.ClearField('feature')
+        detection.ClearField('object_id')
+    expected.ClearField('metrics')
+
+    assert _project(_make_sae_msg(), exclude=['detections.feature', 'detections.object_id', 'metrics']) == expected
+
+def test_include():
+    expected = SaeMessage()
+    expected.type = MessageType.SAE
+    expected.frame.CopyFrom(_make_sae_msg().frame)
+    for detection in _make_sae_msg().detections:
+        expected_detection = expected.detections.add()
+        expected_detection.bounding_box.CopyFrom(detection.bounding_box)
+        expected_detection.class_id = detection.class_id
+
+    # The type is always kept
+    assert _project(_make_sae_msg(), include=['frame', 'detections.bounding_box', 'detections.class_id']) == expected
+
+def test_whole_field_supersedes_sub_paths():
+    assert _project(_make_sae_msg(), include=['detections.class_id', 'detections']).detections == _make_sae_msg().detections
+    assert len(_project(_make_sae_msg(), exclude=['detections', 'detections.class_id']).detections) == 0
+
+@pytest.mark.parametrize('projection', [
+    dict(include=['frame.unknown']),
+    dict(exclude=['detections.confidence.value']),
+    dict(exclude=['type']),
+    dict(include=['frame'], exclude=['metrics']),
+    dict(),
+])
+def test_invalid_projection(projection):
+    with pytest.raises(ValueError):
+        compile_projection(ProjectionConfig(**projection))
+
+@pytest.mark.parametrize('transform_mode', [TransformMode.PROTO, TransformMode.WIRE])
+def test_projection_in_transform(transform_mode):
+    config = RedisWriterConfig(
+        target_redis=TargetRedisConfig(host='dummy', port=1234),
+        mapping_config=[MappingConfig(source='projected', projection=ProjectionConfig(exclude=['detections.feature']))],
+        transform_mode=transform_mode,
+    )
+    testee = RedisWriter(config)
+    input_bytes = _make_sae_msg().SerializeToString()
+
+    projected = SaeMessage()
+    projected.ParseFromString(testee.get(input_bytes, 'projected'))
+    unprojected = SaeMessage()
+    unprojected.ParseFromString(testee.get(input_bytes, 'other'))
+
+    assert all(len(detection.feature) == 0 for detection in projected.detections)
+    assert all(len(detection.feature) == 64 for detection in unprojected.detections)
+    assert projected.frame.timestamp_utc_ms == 1234
@@ -0,0 +1,54 @@
+import base64
+from unittest.mock import call, patch
+
+import pytest
+from prometheus_client import REGISTRY
+
+from rediswriter.buffer import BufferEntry
+from rediswriter.config import PackingConfig
+from rediswriter.publisher import StreamPublisher, decode_entry
+from rediswriter.resp import xadd_size
+
+
+@pytest.fixture
+def pipeline_mock():
+    with patch('rediswriter.publisher.valkey.Valkey') as mock_valkey:
+        yield mock_valkey.return_value.pipeline.return_value
+
+def test_publish_batch(pipeline_mock):
+    testee = StreamPublisher('localhost', 6379, stream_maxlen=10)
+
+    with testee as publish:
+        publish([
+            BufferEntry('stream1', b'msg1'),
+            BufferEntry('aggregate', b'msg2', {'source': 'stream2', 'type': 'SAE'}),
+        ])
+
+    assert pipeline_mock.xadd.call_args_list == [
+        call(name='stream1', fields={'proto_data_b64': base64.b64encode(b'msg1')}, maxlen=10),
+        call(name='aggregate', fields={'proto_data_b64': base64.b64encode(b'msg2'), 'source': 'stream2', 'type': 'SAE'}, maxlen=10),
+    ]
+    pipeline_mock.execute.assert_called_once()
+
+def test_wire_bytes(pipeline_mock):
+    testee = StreamPublisher('localhost', 6379, stream_maxlen=10)
+    labels = {'target': 'localhost:6379', 'stream': 'wire:stream1'}
+    before = REGISTRY.get_sample_value('redis_writer_target_wire_bytes_total', labels) or 0
+
+    with testee as publish:
+        publish([BufferEntry('wire:stream1', b'msg1'), BufferEntry('wire:stream1', b'msg2')])
+
+    sent = REGISTRY.get_sample_value('redis_writer_target_wire_bytes_total', labels) - before
+    assert sent == 2 * xadd_size('wire:stream1', {'proto_data_b64': base64.b64encode(b'msg1')}, 10)
+
+def test_packed_publish(pipeline_mock):
+    testee = StreamPublisher('localhost', 6379, stream_maxlen=10, packing=PackingConfig(enabled=True))
+
+    with testee as publish:
+        publish([BufferEntry('stream1', b'msg1'), BufferEntry('stream2', b'msg2'), BufferEntry('stream1', b'msg3')])
+
+    entries = [(kwargs['name'], kwargs['fields']) for _, kwargs in pipeline_mock.xadd.call_args_list]
+    assert [name for name, _ in entries] == ['stream1', 'stream2']
+    assert decode_entry(entries[0][1]) == [b'msg1', b'msg3']
+    # Entries as returned by the client have bytes keys
+    assert decode_entry({key.encode(): value for key, value in entries[1][1].items()}) == [b'msg2']
@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import SaeMessage
+
+from rediswriter.config import RateLimitConfig
+from rediswriter.rate_limit import StreamRateLimiter
+
+
+def test_keep_every_nth():
+    testee = StreamRateLimiter('stream', RateLimitConfig(keep_every_nth=3))
+
+    assert [testee.allow(MessageType.SAE, _make_sae_msg_bytes(ts)) for ts in range(7)] == [True, False, False, True, False, False, True]
+
+def test_min_interval():
+    testee = StreamRateLimiter('stream', RateLimitConfig(min_interval_ms=100))
+
+    timestamps = [1000, 1040, 1099, 1100, 1150, 1250, 500]
+    # The last message goes back in time (e.g. restarted source) and must not be blocked
+    assert [testee.allow(MessageType.SAE, _make_sae_msg_bytes(ts)) for ts in timestamps] == [True, False, False, True, False, True, True]
+
+def test_max_rate():
+    testee = StreamRateLimiter('stream', RateLimitConfig(max_rate_hz=2))
+
+    with patch('rediswriter.rate_limit.time.monotonic') as monotonic_mock:
+        start = testee._last_refill
+        allowed = []
+        # 10 Hz input for two seconds
+        for i in range(20):
+            monotonic_mock.return_value = start + i * 0.1
+            allowed.append(testee.allow(MessageType.SAE, b''))
+
+    assert sum(allowed) == 4
+    assert allowed[0]
+
+def test_combined_policies():
+    testee = StreamRateLimiter('stream', RateLimitConfig(keep_every_nth=2, min_interval_ms=150))
+
+    # Every 2nd message passes the first policy, but only every other one of those is far enough apart
+    assert [testee.allow(MessageType.SAE, _make_sae_msg_bytes(ts)) for ts in range(1000, 1400, 50)] == [True, False, False, False, True, False, False, False]
+
+def _make_sae_msg_bytes(timestamp: int) -> bytes:
+    sae_msg = SaeMessage()
+    sae_msg.frame.timestamp_utc_ms = timestamp
+    sae_msg.type = MessageType.SAE
+    return sae_msg.SerializeToString()
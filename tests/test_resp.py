@@ -0,0 +1,31 @@
+import base64
+
+import valkey
+from valkey.connection import Connection
+
+from rediswriter.resp import command_size, stream_reply_size, xadd_size
+
+
+def _packed_size(*args) -> int:
+    return sum(len(chunk) for chunk in Connection().pack_command(*args))
+
+def test_command_size():
+    args = ('XADD', 'stream:ä', b'MAXLEN', b'~', '100', '*', 'proto_data_b64', base64.b64encode(b'x' * 1000), 'count', 12, 'ratio', 0.5)
+    assert command_size(args) == _packed_size(*args)
+
+def test_xadd_size():
+    fields = {'proto_data_b64': base64.b64encode(b'x' * 70_000), 'source': 'geomapper:device01'}
+
+    # Record the command the client builds (without connecting)
+    pipeline = valkey.Valkey().pipeline(transaction=False)
+    pipeline.xadd(name='aggregate', fields=fields, maxlen=100)
+    args = pipeline.command_stack[0][0]
+
+    assert xadd_size('aggregate', fields, 100) == _packed_size(*args)
+
+def test_stream_reply_size():
+    entries = [(b'1-0', {b'proto_data_b64': b'abc'}), (b'12-3', {b'a': b'', b'b': b'xy'})]
+    reply = (b'*2\r\n$6\r\nstream\r\n*2\r\n'
+             b'*2\r\n$3\r\n1-0\r\n*2\r\n$14\r\nproto_data_b64\r\n$3\r\nabc\r\n'
+             b'*2\r\n$4\r\n12-3\r\n*4\r\n$1\r\na\r\n$0\r\n\r\n$1\r\nb\r\n$2\r\nxy\r\n')
+    assert stream_reply_size(b'stream', entries) == len(reply)
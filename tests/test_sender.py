@@ -1,13 +1,21 @@
+import os
+import threading
 import time
+import zlib
 from collections import Counter
 from unittest.mock import patch
 
 import pytest
+from prometheus_client import REGISTRY
 from valkey.exceptions import ConnectionError
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import PositionMessage, SaeMessage
 
-from rediswriter.config import (MappingConfig, RedisWriterConfig,
+from rediswriter.config import (AdaptiveBatchingConfig, BandwidthConfig,
+                                CheckpointConfig, CompressionConfig,
+                                ConflationKey, MappingConfig, RedisWriterConfig, SpillConfig,
                                 TargetRedisConfig)
-from rediswriter.sender import Sender
+from rediswriter.sender import Sender, SenderWorker
 
 
 @pytest.fixture
@@ -24,7 +32,7 @@ def config():
 
 @pytest.fixture
 def publisher_mock():
-    with patch('rediswriter.sender.ValkeyPipelinePublisher') as mock_publisher:
+    with patch('rediswriter.sender.StreamPublisher') as mock_publisher:
         yield mock_publisher.return_value.__enter__.return_value
 
 def test_simple_publish(publisher_mock, config):
@@ -112,4 +120,296 @@ def test_bug_all_dropped_1904(publisher_mock, config):
 
     # Verify that 'key1' message has been sent after the unexpected exception
     assert len(publisher_mock.mock_calls) == 2
-    assert publisher_mock.call_args_list[1].args[0][0].stream_key == 'key1'
\ No newline at end of file
+    assert publisher_mock.call_args_list[1].args[0][0].stream_key == 'key1'
+
+def test_publish_latency(publisher_mock, config):
+    publish_times = []
+    publisher_mock.side_effect = lambda _: publish_times.append(time.monotonic())
+
+    testee = Sender(config)
+
+    with testee as publish:
+        time.sleep(0.1)
+        enqueue_time = time.monotonic()
+        publish('key', b'msg_bytes')
+        time.sleep(0.1)
+
+    # The sender must be woken up by the publish (instead of polling), so it should only wait for the linger time
+    assert publisher_mock.call_count == 1
+    assert publish_times[0] - enqueue_time < config.target_redis.linger_ms / 1000 + 0.02
+
+def test_linger(publisher_mock, config):
+    config.target_redis.linger_ms = 200
+
+    testee = Sender(config)
+
+    with testee as publish:
+        publish('key', b'msg_bytes')
+        time.sleep(0.1)
+        publish('key', b'msg_bytes')
+        assert publisher_mock.call_count == 0
+        time.sleep(0.2)
+
+    assert publisher_mock.call_count == 1
+    assert len(publisher_mock.call_args_list[0].args[0]) == 2
+
+def test_max_batch_size_trigger(publisher_mock, config):
+    config.target_redis.linger_ms = 10_000
+    config.target_redis.max_batch_size = 3
+
+    testee = Sender(config)
+
+    with testee as publish:
+        for _ in range(7):
+            publish('key', b'msg_bytes')
+        time.sleep(0.1)
+
+    # The last message is still lingering
+    assert publisher_mock.call_count == 2
+    assert len(publisher_mock.call_args_list[0].args[0]) == 3
+    assert len(publisher_mock.call_args_list[1].args[0]) == 3
+
+def test_max_batch_bytes_trigger(publisher_mock, config):
+    config.target_redis.linger_ms = 10_000
+    config.target_redis.max_batch_bytes = 25
+
+    testee = Sender(config)
+
+    with testee as publish:
+        publish('key', b'0123456789')
+        publish('key', b'0123456789')
+        time.sleep(0.1)
+        assert publisher_mock.call_count == 1
+        publish('key', b'0123456789' * 5)
+        time.sleep(0.1)
+
+    # The first two messages exceed the byte limit together, the large one is sent on its own
+    assert publisher_mock.call_count == 3
+    assert len(publisher_mock.call_args_list[0].args[0]) == 1
+    assert len(publisher_mock.call_args_list[1].args[0]) == 1
+    assert len(publisher_mock.call_args_list[2].args[0]) == 1
+
+def test_fair_buffer(publisher_mock, config):
+    config.target_redis.linger_ms = 10_000
+    config.target_redis.buffer_length = 1000
+    config.target_redis.buffer_max_bytes = 100
+    config.target_redis.max_batch_size = 1000
+    config.target_redis.max_batch_bytes = 1000
+
+    testee = SenderWorker(config)
+
+    with testee as publish:
+        publish('quiet', b'0123456789')
+        for _ in range(20):
+            publish('chatty', b'0123456789')
+
+    # Nothing has been sent yet (lingering), but the quiet stream must not have lost its message
+    assert publisher_mock.call_count == 0
+    with testee._buffer_changed:
+        batch, _ = testee._buffer.drain(1000, 1000)
+    assert batch[0].stream_key == 'quiet'
+    # 15 bytes for the quiet entry + 5 * 16 bytes for the chatty entries fit into the budget
+    assert len(batch) == 6
+
+def test_spill_during_outage(publisher_mock, config, tmp_path):
+    config.target_redis.buffer_length = 2
+    config.target_redis.spill = SpillConfig(enabled=True, directory=str(tmp_path), segment_size_bytes=1000)
+
+    outage = True
+    published = []
+    def _publish(batch):
+        if outage:
+            raise ConnectionError()
+        published.extend(entry.msg_bytes for entry in batch)
+    publisher_mock.side_effect = _publish
+
+    testee = Sender(config)
+
+    with testee as publish:
+        publish('key', b'0')
+        time.sleep(0.1)
+        for i in range(1, 20):
+            publish('key', str(i).encode())
+        outage = False
+        time.sleep(1)
+
+    # Nothing must be lost and the order must be preserved
+    assert published == [str(i).encode() for i in range(20)]
+
+def test_compression(publisher_mock, config):
+    config.target_redis.compression = CompressionConfig(codec='zlib', min_size_bytes=10)
+    config.mapping_config = [
+        MappingConfig(source='uncompressed', compression=CompressionConfig()),
+    ]
+    compressible = b'0123456789' * 100
+
+    testee = Sender(config)
+
+    with testee as publish:
+        publish('compressed', compressible, {'source': 'source'})
+        publish('compressed', b'short')
+        publish('compressed', os.urandom(100))
+        publish('uncompressed', compressible)
+        time.sleep(0.1)
+
+    batch = publisher_mock.call_args_list[0].args[0]
+    compressed_entry = next(entry for entry in batch if entry.msg_bytes != compressible and entry.fields is not None)
+    assert zlib.decompress(compressed_entry.msg_bytes) == compressible
+    assert compressed_entry.fields == {'source': 'source', 'codec': 'zlib'}
+
+    # Too short, incompressible or compression disabled for the stream
+    assert sum(1 for entry in batch if entry.fields is None) == 3
+
+def test_sender_workers(publisher_mock, config):
+    config.target_redis.sender_workers = 3
+    config.target_redis.buffer_length = 300
+
+    published = []
+    def _publish(batch):
+        published.extend((threading.current_thread().name, entry.stream_key, entry.msg_bytes) for entry in batch)
+    publisher_mock.side_effect = _publish
+
+    testee = Sender(config)
+
+    with testee as publish:
+        for i in range(20):
+            for stream_idx in range(6):
+                publish(f'stream{stream_idx}', str(i).encode())
+        time.sleep(0.2)
+
+    assert len(published) == 120
+    for stream_idx in range(6):
+        stream_entries = [(thread, msg_bytes) for thread, stream_key, msg_bytes in published if stream_key == f'stream{stream_idx}']
+        # Each stream is handled by exactly one worker, in order
+        assert len({thread for thread, _ in stream_entries}) == 1
+        assert [msg_bytes for _, msg_bytes in stream_entries] == [str(i).encode() for i in range(20)]
+    assert len({thread for thread, _, _ in published}) > 1
+
+def test_pipeline_metrics(publisher_mock, config):
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    sae_msg = SaeMessage(type=MessageType.SAE)
+    sae_msg.frame.timestamp_utc_ms = int(time.time() * 1000) - 2000
+    age_count = sample('redis_writer_message_age_count', stream='metrics_key')
+    age_sum = sample('redis_writer_message_age_sum', stream='metrics_key')
+    buffer_time_count = sample('redis_writer_buffer_time_count', stream='metrics_key')
+    publish_count = sample('redis_writer_stream_publish_duration_count', target='localhost:6379', stream='metrics_key')
+
+    worker = SenderWorker(config)
+    worker.publish_batch([('metrics_key', sae_msg.SerializeToString(), None), ('metrics_key', b'not_sae', None)])
+
+    # The occupancy is reported as soon as messages are buffered
+    assert sample('redis_writer_sender_buffer_length', worker='0') == 2
+    assert sample('redis_writer_sender_buffer_bytes', worker='0') > 0
+
+    with worker:
+        time.sleep(0.1)
+
+    assert sample('redis_writer_sender_buffer_length', worker='0') == 0
+    assert sample('redis_writer_buffer_time_count', stream='metrics_key') == buffer_time_count + 2
+    assert sample('redis_writer_stream_publish_duration_count', target='localhost:6379', stream='metrics_key') == publish_count + 1
+    # Only SaeMessages have an age
+    assert sample('redis_writer_message_age_count', stream='metrics_key') == age_count + 1
+    assert 2 <= sample('redis_writer_message_age_sum', stream='metrics_key') - age_sum < 3
+
+def test_adaptive_batching(publisher_mock, config):
+    config.target_redis.adaptive_batching = AdaptiveBatchingConfig(enabled=True, min_batch_size=2, increase_step=2)
+
+    testee = SenderWorker(config)
+    testee.publish_batch([('key', b'msg_bytes', None)] * 10)
+    with testee:
+        time.sleep(0.1)
+
+    # Batches grow while there is a backlog
+    assert [len(call.args[0]) for call in publisher_mock.call_args_list] == [2, 4, 4]
+
+def test_bandwidth_limit(publisher_mock, config):
+    # Every entry is 100 bytes, the burst allows for one entry
+    config.target_redis.bandwidth = BandwidthConfig(max_bytes_per_s=1000, burst_bytes=100)
+
+    def padded(msg_bytes):
+        # Pad with an unknown (length delimited) field
+        padding = 97 - len(msg_bytes) - 2
+        return msg_bytes + bytes([15 << 3 | 2, padding]) + b'0' * padding
+
+    testee = SenderWorker(config)
+    testee.publish_batch([('sae', padded(SaeMessage(type=MessageType.SAE).SerializeToString()), None)] * 3)
+    testee.publish_batch([('pos', padded(PositionMessage(type=MessageType.POSITION).SerializeToString()), None)] * 3)
+    with testee:
+        time.sleep(0.25)
+
+    sent = [entry.stream_key for call in publisher_mock.call_args_list for entry in call.args[0]]
+    # Position messages go first, after the burst only one entry per 100ms is sent
+    assert sent[:3] == ['pos', 'pos', 'pos']
+    assert len(sent) <= 4
+
+def test_pending_since_and_catch_up(config):
+    config.target_redis.max_batch_size = 2
+    config.checkpoint = CheckpointConfig(enabled=True, catch_up_batch_size=8)
+    worker = SenderWorker(config)
+    assert worker.pending_since() is None
+    assert worker.has_room()
+    assert worker.room() == 10
+
+    before = time.monotonic()
+    worker.publish_batch([('key', b'msg_bytes', None)] * 6)
+    pending_since = worker.pending_since()
+    assert pending_since >= before
+    # Reading more could evict messages once the buffer is more than half full
+    assert not worker.has_room()
+    assert worker.room() == 4
+
+    worker.set_catch_up(True)
+    batch, enqueue_times = worker._get_next_batch()
+    assert len(batch) == 6
+    # The batch is still pending until it has been published
+    assert worker.pending_since() == pending_since
+    worker._publish_succeeded(time.monotonic(), batch, enqueue_times)
+    assert worker.pending_since() is None
+
+def _sae_msg(source_id: str, timestamp_ms: int) -> bytes:
+    sae_msg = SaeMessage(type=MessageType.SAE)
+    sae_msg.frame.source_id = source_id
+    sae_msg.frame.timestamp_utc_ms = timestamp_ms
+    return sae_msg.SerializeToString()
+
+def test_conflation(config):
+    config.mapping_config = [
+        MappingConfig(source='latest', conflate=ConflationKey.STREAM),
+        MappingConfig(source='per_camera', conflate=ConflationKey.SOURCE),
+        MappingConfig(source='all'),
+    ]
+    conflated_before = REGISTRY.get_sample_value('redis_writer_conflated_counter_total', {'stream': 'per_camera'}) or 0
+    worker = SenderWorker(config)
+
+    worker.publish_batch([
+        ('latest', b'l0', None),
+        ('per_camera', _sae_msg('cam1', 1), None),
+        ('per_camera', _sae_msg('cam2', 1), None),
+        ('all', b'a0', None),
+        ('latest', b'l1', None),
+        ('per_camera', _sae_msg('cam1', 2), None),
+        ('all', b'a1', None),
+        ('per_camera', _sae_msg('cam1', 3), None),
+    ])
+
+    batch, _ = worker._get_next_batch()
+    assert [(entry.stream_key, entry.msg_bytes) for entry in batch if entry.stream_key != 'per_camera'] == [('latest', b'l1'), ('all', b'a0'), ('all', b'a1')]
+    assert [entry.msg_bytes for entry in batch if entry.stream_key == 'per_camera'] == [_sae_msg('cam1', 3), _sae_msg('cam2', 1)]
+    assert REGISTRY.get_sample_value('redis_writer_conflated_counter_total', {'stream': 'per_camera'}) - conflated_before == 2
+
+def test_conflation_aggregated(config):
+    config.aggregate_stream = 'aggregate'
+    config.mapping_config = [MappingConfig(source='latest', conflate=ConflationKey.STREAM), MappingConfig(source='all')]
+    worker = SenderWorker(config)
+
+    worker.publish_batch([
+        ('aggregate', b'l0', {'source': 'latest', 'type': 'POSITION'}),
+        ('aggregate', b'a0', {'source': 'all', 'type': 'POSITION'}),
+        ('aggregate', b'l1', {'source': 'latest', 'type': 'POSITION'}),
+        ('aggregate', b'a1', {'source': 'all', 'type': 'POSITION'}),
+    ])
+
+    batch, _ = worker._get_next_batch()
+    assert [entry.msg_bytes for entry in batch] == [b'l1', b'a0', b'a1']
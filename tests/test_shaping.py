@@ -0,0 +1,58 @@
+from unittest.mock import patch
+
+import pytest
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import PositionMessage, SaeMessage
+
+from rediswriter.config import (BandwidthConfig, MappingConfig, Priority,
+                                RedisWriterConfig, TargetRedisConfig)
+from rediswriter.shaping import (PRIORITY_ORDER, BandwidthShaper,
+                                 PriorityClassifier)
+
+
+@pytest.fixture
+def config():
+    return RedisWriterConfig(
+        target_redis=TargetRedisConfig(host='localhost', port=6379),
+        mapping_config=[
+            MappingConfig(source='objectdetector:device01', target='backend:bulk', priority=Priority.LOW),
+            MappingConfig(source='geomapper:device01'),
+        ],
+    )
+
+def test_classifier(config):
+    testee = PriorityClassifier(config)
+    sae_msg_bytes = SaeMessage(type=MessageType.SAE).SerializeToString()
+    position_msg_bytes = PositionMessage(type=MessageType.POSITION).SerializeToString()
+
+    # Configured priorities win over the message type
+    assert testee.classify('backend:bulk', position_msg_bytes) == PRIORITY_ORDER[Priority.LOW]
+    assert testee.classify('geomapper:device01', sae_msg_bytes) == PRIORITY_ORDER[Priority.NORMAL]
+    assert testee.classify('geomapper:device01', position_msg_bytes) == PRIORITY_ORDER[Priority.HIGH]
+    assert testee.classify('aggregated', b'\xff\xff') == PRIORITY_ORDER[Priority.HIGH]
+
+def test_shaper_disabled():
+    testee = BandwidthShaper(BandwidthConfig())
+
+    testee.consume(10**9)
+
+    assert testee.available() == float('inf')
+    assert testee.delay() == 0
+
+def test_shaper_token_bucket():
+    with patch('rediswriter.shaping.time.monotonic') as monotonic:
+        monotonic.return_value = 100
+        testee = BandwidthShaper(BandwidthConfig(max_bytes_per_s=2000, burst_bytes=200), worker_count=2)
+
+        # Rate and burst are split between the workers
+        assert testee.available() == 100
+        testee.consume(300)
+        assert testee.available() == 0
+        assert testee.delay() == pytest.approx(0.201)
+
+        monotonic.return_value = 100.1
+        assert testee.delay() == pytest.approx(0.101)
+
+        # The bucket never fills beyond the burst size
+        monotonic.return_value = 200
+        assert testee.available() == 100
@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import time
+from unittest.mock import AsyncMock, patch
+
+from valkey.exceptions import ConnectionError
+
+from rediswriter.config import RedisConfig
+from rediswriter.source import (AsyncSourceReader, CatchUp, SourceReader,
+                               StreamDiscovery)
+
+
+def _read_results():
+    return [
+        [[b'stream1', [(b'6-0', {b'proto_data_b64': base64.b64encode(b'first')}), (b'7-0', {b'proto_data_b64': base64.b64encode(b'second')})]]],
+        [],
+        [[b'stream2', [(b'1-0', {b'proto_data_b64': base64.b64encode(b'third')}), (b'2-0', {b'other': b'field'})]]],
+    ]
+
+def _recording_xread(read_results, read_ids):
+    def xread(streams, **_):
+        # The reader updates its stream ids in place
+        read_ids.append(dict(streams))
+        result = next(read_results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return xread
+
+def test_reader_batches_and_advances():
+    with patch('rediswriter.source.valkey.Valkey') as mock_valkey:
+        client = mock_valkey.return_value
+        client.xrevrange.side_effect = [[(b'5-0', {})], []]
+        read_ids = []
+        client.xread.side_effect = _recording_xread(iter(_read_results()), read_ids)
+
+        batches = []
+        with SourceReader(RedisConfig(read_count=50), ['stream1', 'stream2']) as iter_batches:
+            for batch in iter_batches():
+                batches.append(batch)
+                if len(batches) == 3:
+                    break
+
+    assert batches == [[('stream1', b'first'), ('stream1', b'second')], [], [('stream2', b'third')]]
+    assert read_ids[0] == {'stream1': b'5-0', 'stream2': '0-0'}
+    assert read_ids[2] == {'stream1': b'7-0', 'stream2': '0-0'}
+    assert client.xread.call_args.kwargs['count'] == 50
+
+def test_reader_recovers_from_errors():
+    with patch('rediswriter.source.valkey.Valkey') as mock_valkey, patch('rediswriter.source.time.sleep'):
+        client = mock_valkey.return_value
+        client.xrevrange.side_effect = [ConnectionError(), [], []]
+        read_ids = []
+        client.xread.side_effect = _recording_xread(iter([ConnectionError()] + _read_results()), read_ids)
+
+        batches = []
+        with SourceReader(RedisConfig(), ['stream1', 'stream2']) as iter_batches:
+            for batch in iter_batches():
+                batches.append(batch)
+                if len(batches) == 3:
+                    break
+
+    assert batches == [[], [], [('stream1', b'first'), ('stream1', b'second')]]
+
+def test_async_reader_batches_and_advances():
+    with patch('rediswriter.source.valkey.asyncio.Valkey') as mock_valkey:
+        client = mock_valkey.return_value
+        client.aclose = AsyncMock()
+        client.xrevrange = AsyncMock(side_effect=[[(b'5-0', {})], []])
+        read_ids = []
+        client.xread = AsyncMock(side_effect=_recording_xread(iter(_read_results()), read_ids))
+
+        async def run():
+            batches = []
+            async with AsyncSourceReader(RedisConfig(), ['stream1', 'stream2']) as iter_batches:
+                async for batch in iter_batches():
+                    batches.append(batch)
+                    if len(batches) == 3:
+                        break
+            return batches
+
+        batches = asyncio.run(run())
+
+    assert batches == [[('stream1', b'first'), ('stream1', b'second')], [], [('stream2', b'third')]]
+    assert read_ids[2] == {'stream1': b'7-0', 'stream2': '0-0'}
+
+def test_discovery():
+    discovery = StreamDiscovery(['geomapper:*'], lambda stream_key: stream_key != 'geomapper:ignored', interval_s=0.01)
+
+    with patch('rediswriter.source.valkey.Valkey') as mock_valkey:
+        client = mock_valkey.return_value
+        client.scan_iter.side_effect = [
+            [b'geomapper:device01', b'geomapper:ignored'],
+            [b'geomapper:device01', b'geomapper:device02'],
+        ]
+        client.xrevrange.side_effect = [[(b'5-0', {})], [(b'3-0', {})]]
+        read_ids = []
+        client.xread.side_effect = _recording_xread(iter([[], []]), read_ids)
+
+        with SourceReader(RedisConfig(), ['exact'], discovery) as iter_batches:
+            batches = iter_batches()
+            next(batches)
+            time.sleep(0.02)
+            next(batches)
+
+    # Streams found at startup are read from their current end, streams appearing later from the start
+    assert read_ids[0] == {'exact': b'3-0', 'geomapper:device01': b'5-0'} or read_ids[0] == {'exact': b'5-0', 'geomapper:device01': b'3-0'}
+    assert read_ids[1]['geomapper:device02'] == '0-0'
+    assert 'geomapper:ignored' not in read_ids[1]
+
+def test_reader_resumes_and_catches_up():
+    with patch('rediswriter.source.valkey.Valkey') as mock_valkey:
+        client = mock_valkey.return_value
+        client.xrevrange.side_effect = [[(b'5-0', {})]]
+        read_ids = []
+        client.xread.side_effect = _recording_xread(iter([
+            [[b'stream1', [(b'2-0', {b'proto_data_b64': base64.b64encode(b'first')}), (b'3-0', {b'proto_data_b64': base64.b64encode(b'second')})]]],
+            [[b'stream1', [(b'4-0', {b'proto_data_b64': base64.b64encode(b'third')})]]],
+            [],
+        ]), read_ids)
+
+        catching_up = []
+        reader = SourceReader(RedisConfig(read_count=2), ['stream1', 'stream2'], start_ids={'stream1': '1-0'},
+                              catch_up=CatchUp(read_count=50))
+        with reader as iter_batches:
+            batches = iter_batches(lambda: 60)
+            for _ in range(3):
+                next(batches)
+                catching_up.append(reader.catching_up)
+
+    # Only streams without a checkpoint start from their current end
+    assert read_ids[0] == {'stream1': '1-0', 'stream2': b'5-0'}
+    assert client.xrevrange.call_count == 1
+    # A full read switches to large reads (split between the streams) until a read is not full anymore
+    assert [call.kwargs['count'] for call in client.xread.call_args_list] == [2, 30, 2]
+    assert catching_up == [True, False, False]
+
+def test_reader_is_bounded_by_room():
+    with patch('rediswriter.source.valkey.Valkey') as mock_valkey, patch('rediswriter.source.time.sleep') as sleep:
+        client = mock_valkey.return_value
+        read_ids = []
+        client.xread.side_effect = _recording_xread(iter([[]] * 4), read_ids)
+        rooms = iter([0, 2, 1, 1, 250])
+
+        reader = SourceReader(RedisConfig(read_count=100), ['stream1', 'stream2', 'stream3'], start_ids={'stream1': '1-0', 'stream2': '1-0', 'stream3': '1-0'})
+        with reader as iter_batches:
+            batches = iter_batches(lambda: next(rooms))
+            for _ in range(5):
+                next(batches)
+
+    # Without room nothing is read, with less room than streams they take turns (there is no minimum count per stream)
+    sleep.assert_called_once()
+    assert [list(ids) for ids in read_ids] == [['stream1', 'stream2'], ['stream3'], ['stream1'], ['stream1', 'stream2', 'stream3']]
+    assert [call.kwargs['count'] for call in client.xread.call_args_list] == [1, 1, 1, 83]
+
+def test_full_reads_lowered_by_room_do_not_start_catch_up():
+    with patch('rediswriter.source.valkey.Valkey') as mock_valkey:
+        client = mock_valkey.return_value
+        entry = (b'2-0', {b'proto_data_b64': base64.b64encode(b'msg')})
+        client.xread.side_effect = _recording_xread(iter([
+            [[b'stream1', [entry]]],
+            [[b'stream1', [entry] * 10]],
+            [[b'stream1', [entry] * 3]],
+            [[b'stream1', [entry] * 5]],
+        ]), [])
+        rooms = iter([1, 100, 3, 100])
+
+        catching_up = []
+        reader = SourceReader(RedisConfig(read_count=10), ['stream1'], start_ids={'stream1': '1-0'}, catch_up=CatchUp(read_count=50))
+        with reader as iter_batches:
+            batches = iter_batches(lambda: next(rooms))
+            for _ in range(4):
+                next(batches)
+                catching_up.append(reader.catching_up)
+
+    # Only a read of the configured size switches to catch-up, a full lowered read keeps the current mode
+    assert [call.kwargs['count'] for call in client.xread.call_args_list] == [1, 10, 3, 50]
+    assert catching_up == [False, True, True, False]
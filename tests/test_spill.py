@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from rediswriter.buffer import BufferEntry
+from rediswriter.config import FsyncPolicy, SpillConfig
+from rediswriter.spill import SpillBuffer
+
+
+@pytest.fixture
+def spill_config(tmp_path):
+    return SpillConfig(
+        enabled=True,
+        directory=str(tmp_path / 'spill'),
+        segment_size_bytes=1000,
+        max_bytes=10_000,
+        fsync=FsyncPolicy.NEVER,
+    )
+
+def _entries(count: int, prefix: str = 'msg', stream_key: str = 'key'):
+    return [BufferEntry(stream_key, f'{prefix}{i}'.encode() * 10) for i in range(count)]
+
+def test_append_and_read_in_order(spill_config):
+    testee = SpillBuffer(spill_config)
+
+    entries = _entries(50)
+    testee.append(entries[:20])
+    testee.append(entries[20:])
+
+    assert len(testee) == 50
+    batch = testee.read_batch(max_count=30, max_bytes=1_000_000)
+    batch += testee.read_batch(max_count=30, max_bytes=1_000_000)
+
+    assert batch == entries
+    assert len(testee) == 0
+    assert testee.unread_bytes == 0
+
+def test_segments_are_deleted_after_replay(spill_config, tmp_path):
+    testee = SpillBuffer(spill_config)
+
+    testee.append(_entries(100))
+    assert len(list((tmp_path / 'spill').iterdir())) > 1
+
+    testee.read_batch(max_count=1000, max_bytes=1_000_000)
+    assert len(list((tmp_path / 'spill').iterdir())) == 0
+
+def test_fields(spill_config):
+    testee = SpillBuffer(spill_config)
+
+    entries = [BufferEntry('key', b'payload', {'source': 'source:stream', 'type': 'SAE'}), BufferEntry('key', b'payload')]
+    testee.append(entries)
+
+    assert testee.read_batch(max_count=10, max_bytes=1_000_000) == entries
+
+def test_oversized_entry(spill_config):
+    testee = SpillBuffer(spill_config)
+
+    entry = BufferEntry('key', b'x' * 5000)
+    testee.append([entry])
+
+    assert testee.read_batch(max_count=10, max_bytes=10) == [entry]
+
+def test_recover_after_restart(spill_config):
+    testee = SpillBuffer(spill_config)
+    entries = _entries(50)
+    testee.append(entries)
+    testee.read_batch(max_count=10, max_bytes=1_000_000)
+    testee.close()
+
+    recovered = SpillBuffer(spill_config)
+
+    # The read position is not persisted, so all segments that were not fully read are replayed from the start
+    batch = recovered.read_batch(max_count=1000, max_bytes=1_000_000)
+    assert batch[-40:] == entries[10:]
+    assert len(recovered) == 0
+
+    recovered.append(_entries(1, prefix='new'))
+    assert recovered.read_batch(max_count=10, max_bytes=1_000_000) == _entries(1, prefix='new')
+
+def test_max_bytes(spill_config):
+    spill_config.max_bytes = 3000
+    testee = SpillBuffer(spill_config)
+
+    entries = _entries(200)
+    testee.append(entries)
+
+    # Only the newest segments are kept
+    batch = testee.read_batch(max_count=1000, max_bytes=1_000_000)
+    assert 0 < len(batch) < 200
+    assert batch == entries[-len(batch):]
+
+def test_retention(spill_config):
+    spill_config.retention_s = 0.1
+    testee = SpillBuffer(spill_config)
+
+    testee.append(_entries(100, prefix='old'))
+    time.sleep(0.2)
+    testee.append(_entries(1, prefix='new'))
+
+    assert testee.read_batch(max_count=1000, max_bytes=1_000_000) == _entries(1, prefix='new')
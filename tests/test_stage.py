@@ -1,3 +1,7 @@
+import base64
+import signal
+import time
+from collections import defaultdict
 from typing import List
 from unittest.mock import patch
 
@@ -5,7 +9,7 @@ import pytest
 from visionapi.common_pb2 import MessageType
 from visionapi.sae_pb2 import SaeMessage, PositionMessage
 
-from rediswriter.config import RedisWriterConfig, MappingConfig, TargetRedisConfig
+from rediswriter.config import CheckpointConfig, RedisWriterConfig, MappingConfig, RateLimitConfig, TargetRedisConfig, TransformMode
 from rediswriter.stage import run_stage
 
 
@@ -18,24 +22,30 @@ def disable_prometheus():
 @pytest.fixture
 def set_config():
     with patch('rediswriter.stage.RedisWriterConfig') as mock_config:
-        def _make_mock_config(mappings: List[MappingConfig]):
+        def _make_mock_config(mappings: List[MappingConfig], **kwargs):
             mock_config.return_value = RedisWriterConfig(
                 log_level='WARNING',
                 mapping_config=mappings,
-                target_redis=TargetRedisConfig(host='dummy', port=1234)
+                target_redis=TargetRedisConfig(host='dummy', port=1234),
+                **kwargs
             )
         yield _make_mock_config
 
 @pytest.fixture
 def sender_mock():
     with patch('rediswriter.stage.Sender') as mock_sender:
-        yield mock_sender.return_value.__enter__.return_value
+        send = mock_sender.return_value.__enter__.return_value
+        # Record batches as individual calls
+        mock_sender.return_value.publish_batch.side_effect = lambda items: [send(*item) for item in items]
+        yield send
 
 @pytest.fixture
 def inject_consumer_messages():
-    with patch('rediswriter.stage.ValkeyConsumer') as mock_consumer:
+    with patch('rediswriter.stage.SourceReader') as mock_reader:
         def _inject_messages(messages):
-            mock_consumer.return_value.__enter__.return_value.return_value.__iter__.return_value = iter(messages)
+            # Deliver the messages in batches of two
+            batches = [messages[i:i + 2] for i in range(0, len(messages), 2)]
+            mock_reader.return_value.__enter__.return_value.return_value.__iter__.return_value = iter(batches)
         yield _inject_messages
 
 def test_frame_data_removal(set_config, sender_mock, inject_consumer_messages):
@@ -100,6 +110,110 @@ def test_bug_frame_data_removal_fails_with_multiple_streams_2115(set_config, sen
     _assert_position_message(sender_mock.call_args_list[0].args[1], timestamp=1)
     _assert_sae_message(sender_mock.call_args_list[1].args[1], timestamp=2, no_frame_data=True)
 
+def test_wire_transform_mode(set_config, sender_mock, inject_consumer_messages):
+    set_config(mappings=[
+        MappingConfig(source='stage:test_stream', target='stage:test_stream_copy'),
+        MappingConfig(source='stage2:test_stream', target='stage2:test_stream_copy'),
+    ], transform_mode=TransformMode.WIRE)
+    
+    inject_consumer_messages([
+        ('stage:test_stream', _make_position_msg_bytes(1)),
+        ('stage2:test_stream', _make_sae_msg_bytes(2)),
+        ('stage2:test_stream', _make_sae_msg_bytes(3)),
+    ])
+    
+    run_stage()
+    
+    assert sender_mock.call_count == 3
+    assert sender_mock.call_args_list[0].args[0] == 'stage:test_stream_copy'
+    assert sender_mock.call_args_list[1].args[0] == 'stage2:test_stream_copy'
+    _assert_position_message(sender_mock.call_args_list[0].args[1], timestamp=1)
+    _assert_sae_message(sender_mock.call_args_list[1].args[1], timestamp=2, no_frame_data=True)
+    _assert_sae_message(sender_mock.call_args_list[2].args[1], timestamp=3, no_frame_data=True)
+
+def test_aggregate_stream(set_config, sender_mock, inject_consumer_messages):
+    set_config(mappings=[
+        MappingConfig(source='stage:test_stream', target='stage:test_stream_copy'),
+        MappingConfig(source='stage2:test_stream'),
+    ], aggregate_stream='aggregate')
+    
+    inject_consumer_messages([
+        ('stage:test_stream', _make_position_msg_bytes(1)),
+        ('stage2:test_stream', _make_sae_msg_bytes(2)),
+    ])
+    
+    run_stage()
+    
+    assert sender_mock.call_count == 2
+    assert sender_mock.call_args_list[0].args[0] == 'aggregate'
+    assert sender_mock.call_args_list[0].args[2] == {'source': 'stage:test_stream', 'type': 'POSITION'}
+    _assert_position_message(sender_mock.call_args_list[0].args[1], timestamp=1)
+    assert sender_mock.call_args_list[1].args[0] == 'aggregate'
+    assert sender_mock.call_args_list[1].args[2] == {'source': 'stage2:test_stream', 'type': 'SAE'}
+    _assert_sae_message(sender_mock.call_args_list[1].args[1], timestamp=2, no_frame_data=True)
+
+def test_rate_limit(set_config, sender_mock, inject_consumer_messages):
+    set_config(mappings=[
+        MappingConfig(source='stage:test_stream', target='stage:test_stream_copy', rate_limit=RateLimitConfig(min_interval_ms=100)),
+        MappingConfig(source='stage2:test_stream', target='stage2:test_stream_copy', rate_limit=RateLimitConfig(keep_every_nth=2)),
+    ])
+
+    inject_consumer_messages([
+        ('stage:test_stream', _make_sae_msg_bytes(1000)),
+        ('stage:test_stream', _make_sae_msg_bytes(1050)),
+        ('stage:test_stream', _make_sae_msg_bytes(1100)),
+        ('stage2:test_stream', _make_position_msg_bytes(1)),
+        ('stage2:test_stream', _make_position_msg_bytes(2)),
+        ('stage2:test_stream', _make_position_msg_bytes(3)),
+    ])
+
+    run_stage()
+
+    assert sender_mock.call_count == 4
+    sae_calls = [call for call in sender_mock.call_args_list if call.args[0] == 'stage:test_stream_copy']
+    position_calls = [call for call in sender_mock.call_args_list if call.args[0] == 'stage2:test_stream_copy']
+    _assert_sae_message(sae_calls[0].args[1], timestamp=1000, no_frame_data=True)
+    _assert_sae_message(sae_calls[1].args[1], timestamp=1100, no_frame_data=True)
+    _assert_position_message(position_calls[0].args[1], timestamp=1)
+    _assert_position_message(position_calls[1].args[1], timestamp=3)
+
+def test_checkpointed_backlog_is_not_evicted(set_config, tmp_path):
+    # The backlog of both streams together is several times the sender buffer (100 messages, as the read count)
+    backlog = {f'backlog:{idx}': [_make_position_msg_bytes(ts) for ts in range(300)] for idx in range(2)}
+    set_config(mappings=[MappingConfig(source=stream_key) for stream_key in backlog],
+               checkpoint=CheckpointConfig(enabled=True, path=str(tmp_path / 'checkpoints.json'), interval_s=0.01))
+    published = defaultdict(list)
+    xread_calls = []
+
+    def publish(batch):
+        time.sleep(0.002)
+        for entry in batch:
+            published[entry.stream_key].append(entry.msg_bytes)
+
+    def xread(streams, count, **_):
+        xread_calls.append(count)
+        if sum(len(messages) for messages in published.values()) == 600 or len(xread_calls) > 5000:
+            signal.raise_signal(signal.SIGTERM)
+        result = []
+        for stream_key, last_id in streams.items():
+            start = int(last_id.split(b'-' if isinstance(last_id, bytes) else '-')[0])
+            entries = [(f'{idx + 1}-0'.encode(), {b'proto_data_b64': base64.b64encode(backlog[stream_key][idx])})
+                       for idx in range(start, min(start + count, len(backlog[stream_key])))]
+            if len(entries) > 0:
+                result.append([stream_key.encode(), entries])
+        if len(result) == 0:
+            time.sleep(0.001)
+        return result
+
+    with patch('rediswriter.source.valkey.Valkey') as mock_valkey, patch('rediswriter.sender.StreamPublisher') as mock_publisher:
+        mock_valkey.return_value.xrevrange.return_value = []
+        mock_valkey.return_value.xread.side_effect = xread
+        mock_publisher.return_value.__enter__.return_value.side_effect = publish
+        run_stage()
+
+    assert published == backlog
+    assert max(xread_calls) <= 50
+
 def _assert_sae_message(sae_msg_bytes: bytes, timestamp: int, no_frame_data: bool):
     sae_msg = SaeMessage()
     sae_msg.ParseFromString(sae_msg_bytes)
@@ -128,4 +242,4 @@ def _make_position_msg_bytes(timestamp: int) -> bytes:
     pos_msg = PositionMessage()
     pos_msg.timestamp_utc_ms = timestamp
     pos_msg.type = MessageType.POSITION
-    return pos_msg.SerializeToString()
\ No newline at end of file
+    return pos_msg.SerializeToString()
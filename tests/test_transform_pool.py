@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import defaultdict
+from unittest.mock import MagicMock, patch
+
+import pytest
+from prometheus_client import REGISTRY
+from visionapi.common_pb2 import MessageType
+from visionapi.sae_pb2 import SaeMessage
+
+from rediswriter.config import (ExecutionMode, MappingConfig,
+                                RedisWriterConfig, TargetRedisConfig,
+                                TransformPoolConfig)
+from rediswriter.rediswriter import RedisWriter
+from rediswriter.transform_pool import TransformPool, shard_for
+
+
+def _make_config(mode: ExecutionMode, workers: int = 3, max_in_flight: int = 16) -> RedisWriterConfig:
+    return RedisWriterConfig(
+        target_redis=TargetRedisConfig(host='dummy', port=1234),
+        mapping_config=[MappingConfig()],
+        transform_pool=TransformPoolConfig(mode=mode, workers=workers, max_in_flight=max_in_flight),
+    )
+
+def _make_sae_msg_bytes(timestamp: int) -> bytes:
+    sae_msg = SaeMessage()
+    sae_msg.frame.timestamp_utc_ms = timestamp
+    sae_msg.frame.frame_data = b'dummy_frame_data'
+    sae_msg.type = MessageType.SAE
+    return sae_msg.SerializeToString()
+
+def _timestamp(sae_msg_bytes: bytes) -> int:
+    sae_msg = SaeMessage()
+    sae_msg.ParseFromString(sae_msg_bytes)
+    assert len(sae_msg.frame.frame_data) == 0
+    return sae_msg.frame.timestamp_utc_ms
+
+@pytest.mark.parametrize('mode', [ExecutionMode.INLINE, ExecutionMode.THREAD, ExecutionMode.PROCESS])
+def test_per_stream_order(mode):
+    config = _make_config(mode)
+    received = defaultdict(list)
+    lock = threading.Lock()
+
+    def send_batch(items):
+        with lock:
+            for target_stream, msg_bytes, _ in items:
+                received[target_stream].append(_timestamp(msg_bytes))
+
+    with TransformPool(config, RedisWriter(config), send_batch) as pool:
+        for ts in range(50):
+            pool.transform_batch([(f'source:{stream_idx}', f'target:{stream_idx}', _make_sae_msg_bytes(ts), None) for stream_idx in range(8)])
+
+    assert len(received) == 8
+    for timestamps in received.values():
+        assert timestamps == list(range(50))
+
+def test_in_flight_is_bounded():
+    config = _make_config(ExecutionMode.THREAD, workers=1, max_in_flight=2)
+    release_send = threading.Event()
+    send_batch = MagicMock(side_effect=lambda _: release_send.wait())
+
+    with TransformPool(config, RedisWriter(config), send_batch) as pool:
+        submitter = threading.Thread(target=lambda: [pool.transform_batch([('source', 'target', _make_sae_msg_bytes(ts), None)]) for ts in range(4)])
+        submitter.start()
+        time.sleep(0.2)
+
+        # One message is blocked in send_batch, one is waiting, the rest must not have been accepted
+        assert submitter.is_alive()
+        assert pool.pending_count() == 2
+        release_send.set()
+        submitter.join(timeout=1)
+        assert not submitter.is_alive()
+
+    assert send_batch.call_count == 4
+    assert pool.pending_count() == 0
+
+def test_transform_error_does_not_stop_pool():
+    config = _make_config(ExecutionMode.THREAD, workers=1)
+    send_batch = MagicMock()
+    redis_writer = RedisWriter(config)
+    output_proto = redis_writer.transform(_make_sae_msg_bytes(1))
+
+    # The whole batch fails (e.g. a crashed worker process), not just a single message
+    with patch.object(redis_writer, 'get_batch', side_effect=[RuntimeError(), [output_proto]]), TransformPool(config, redis_writer, send_batch) as pool:
+        pool.transform_batch([('source', 'target', _make_sae_msg_bytes(0), None)])
+        pool.transform_batch([('source', 'target', _make_sae_msg_bytes(1), None)])
+
+    send_batch.assert_called_once()
+    assert _timestamp(send_batch.call_args.args[0][0][1]) == 1
+
+def test_shard_is_stable():
+    assert shard_for('geomapper:device01', 8) == shard_for('geomapper:device01', 8)
+    assert len({shard_for(f'stream:{i}', 4) for i in range(100)}) == 4
+
+@pytest.mark.parametrize('mode', [ExecutionMode.INLINE, ExecutionMode.THREAD, ExecutionMode.PROCESS])
+def test_transform_batch(mode):
+    config = _make_config(mode, max_in_flight=4)
+    received = defaultdict(list)
+    lock = threading.Lock()
+
+    def send_batch(items):
+        with lock:
+            for target_stream, msg_bytes, _ in items:
+                received[target_stream].append(_timestamp(msg_bytes))
+
+    pool = TransformPool(config, RedisWriter(config), send_batch)
+    with pool:
+        for ts in range(10):
+            # Batches are larger than `max_in_flight` and contain one broken message
+            batch = [(f'source:{stream_idx}', f'target:{stream_idx}', _make_sae_msg_bytes(ts), None) for stream_idx in range(8)]
+            batch.append(('source:0', 'target:0', b'\xff\xff', None))
+            pool.transform_batch(batch)
+
+    assert len(received) == 8
+    for timestamps in received.values():
+        assert timestamps == list(range(10))
+
+def test_get_batch():
+    config = _make_config(ExecutionMode.INLINE)
+
+    output_protos = RedisWriter(config).get_batch([_make_sae_msg_bytes(1), b'\xff\xff', _make_sae_msg_bytes(2)], [None, None, None])
+
+    assert _timestamp(output_protos[0]) == 1
+    assert output_protos[1] is None
+    # `get` and `get_batch` share the same transformation
+    assert RedisWriter(config).get(_make_sae_msg_bytes(1)) == output_protos[0]
+    assert _timestamp(output_protos[2]) == 2
+
+def test_get_batch_observes_once_per_batch():
+    config = _make_config(ExecutionMode.INLINE)
+    redis_writer = RedisWriter(config)
+
+    def count(name):
+        return REGISTRY.get_sample_value(name) or 0
+
+    deserializations, batches = count('redis_writer_proto_deserialization_duration_count'), count('redis_writer_get_batch_duration_count')
+    redis_writer.get_batch([_make_sae_msg_bytes(ts) for ts in range(5)], [None] * 5)
+    assert count('redis_writer_proto_deserialization_duration_count') == deserializations
+    assert count('redis_writer_get_batch_duration_count') == batches + 1
+
+    # The single message path still observes every step
+    redis_writer.get(_make_sae_msg_bytes(1))
+    assert count('redis_writer_proto_deserialization_duration_count') == deserializations + 1
+
+@pytest.mark.parametrize('mode', [ExecutionMode.INLINE, ExecutionMode.THREAD])
+def test_consume_to_enqueue_latency(mode):
+    def sample(name):
+        return REGISTRY.get_sample_value(name, {'stream': f'latency_target:{mode.value}'}) or 0
+
+    config = _make_config(mode)
+    count = sample('redis_writer_consume_to_enqueue_latency_count')
+    total = sample('redis_writer_consume_to_enqueue_latency_sum')
+
+    pool = TransformPool(config, RedisWriter(config), MagicMock())
+    with pool:
+        batch = [('source', f'latency_target:{mode.value}', _make_sae_msg_bytes(ts), None) for ts in range(3)]
+        pool.transform_batch(batch, consume_time=time.monotonic() - 1)
+
+    assert sample('redis_writer_consume_to_enqueue_latency_count') == count + 3
+    assert sample('redis_writer_consume_to_enqueue_latency_sum') - total >= 3
@@ -0,0 +1,160 @@
+import pytest
+from google.protobuf.message import DecodeError
+from visionapi.common_pb2 import MessageType, TypeMessage
+from visionapi.sae_pb2 import Detection, PositionMessage, SaeMessage
+
+from rediswriter.config import (MappingConfig, RedisWriterConfig,
+                                TargetRedisConfig, TransformMode)
+from rediswriter.rediswriter import RedisWriter
+from rediswriter.wire import (peek_frame_timestamp, peek_message_type,
+                              peek_sae_frame_timestamp, peek_sae_source_id,
+                              strip_frame_data)
+
+
+@pytest.fixture
+def proto_writer():
+    return RedisWriter(_make_config(TransformMode.PROTO))
+
+@pytest.fixture
+def wire_writer():
+    return RedisWriter(_make_config(TransformMode.WIRE))
+
+def _make_config(transform_mode: TransformMode) -> RedisWriterConfig:
+    return RedisWriterConfig(
+        target_redis=TargetRedisConfig(host='dummy', port=1234),
+        mapping_config=[MappingConfig()],
+        transform_mode=transform_mode,
+    )
+
+def _full_sae_msg() -> SaeMessage:
+    sae_msg = SaeMessage()
+    sae_msg.type = MessageType.SAE
+    sae_msg.frame.source_id = 'camera01'
+    sae_msg.frame.timestamp_utc_ms = 1234567890123
+    sae_msg.frame.shape.width = 1920
+    sae_msg.frame.shape.height = 1080
+    sae_msg.frame.shape.channels = 3
+    sae_msg.frame.camera_location.latitude = 52.42
+    sae_msg.frame.camera_location.longitude = 10.78
+    sae_msg.frame.frame_data = bytes(range(256)) * 1000
+    sae_msg.frame.frame_data_jpeg = b'\xff\xd8' + b'jpeg' * 10000
+    for i in range(10):
+        det = Detection()
+        det.bounding_box.min_x = i
+        det.bounding_box.max_x = i + 10
+        det.confidence = i / 10
+        det.class_id = i
+        det.object_id = bytes([i]) * 16
+        sae_msg.detections.append(det)
+    return sae_msg
+
+def _frame_only_msg() -> SaeMessage:
+    sae_msg = SaeMessage()
+    sae_msg.frame.frame_data = b'only_frame_data'
+    return sae_msg
+
+def _metadata_only_msg() -> SaeMessage:
+    sae_msg = SaeMessage()
+    sae_msg.type = MessageType.SAE
+    sae_msg.frame.timestamp_utc_ms = 1
+    return sae_msg
+
+def _without_frame_msg() -> SaeMessage:
+    sae_msg = SaeMessage()
+    sae_msg.type = MessageType.SAE
+    sae_msg.detections.add().confidence = 0.5
+    return sae_msg
+
+# Field number 1007 with wire types varint, length-delimited, fixed64 and fixed32
+UNKNOWN_FIELDS = b'\xf8\x3e\x2a' + b'\xfa\x3e\x03abc' + b'\xf9\x3e' + b'\x00' * 8 + b'\xfd\x3e\x01\x02\x03\x04'
+
+def _frame_field(frame_bytes: bytes) -> bytes:
+    frame_field_number = SaeMessage.DESCRIPTOR.fields_by_name['frame'].number
+    return bytes([frame_field_number << 3 | 2, len(frame_bytes)]) + frame_bytes
+
+DIFFERENTIAL_CASES = [
+    pytest.param(lambda: _full_sae_msg().SerializeToString(), id='full'),
+    pytest.param(lambda: _frame_only_msg().SerializeToString(), id='frame_only'),
+    pytest.param(lambda: _metadata_only_msg().SerializeToString(), id='metadata_only'),
+    pytest.param(lambda: _without_frame_msg().SerializeToString(), id='without_frame'),
+    pytest.param(lambda: b'', id='empty'),
+    # The parser merges repeated occurrences of a message field
+    pytest.param(lambda: _full_sae_msg().SerializeToString() + _metadata_only_msg().SerializeToString(), id='concatenated'),
+    # Unknown fields (top-level and within frame) with all wire types
+    pytest.param(lambda: _full_sae_msg().SerializeToString() + UNKNOWN_FIELDS, id='unknown_top_level'),
+    pytest.param(lambda: _frame_field(UNKNOWN_FIELDS) + _full_sae_msg().SerializeToString(), id='unknown_in_frame'),
+]
+
+@pytest.mark.parametrize('make_input', DIFFERENTIAL_CASES)
+def test_differential_wire_vs_proto(proto_writer, wire_writer, make_input):
+    input_bytes = make_input()
+
+    proto_output = SaeMessage()
+    proto_output.ParseFromString(proto_writer.get(input_bytes))
+    wire_output = SaeMessage()
+    wire_output.ParseFromString(wire_writer.get(input_bytes))
+
+    assert wire_output == proto_output
+    assert wire_output.SerializeToString(deterministic=True) == proto_output.SerializeToString(deterministic=True)
+
+def test_frame_data_not_leaked():
+    output = strip_frame_data(_full_sae_msg().SerializeToString())
+
+    assert b'jpeg' * 100 not in output
+    assert bytes(range(256)) not in output
+
+    sae_msg = SaeMessage()
+    sae_msg.ParseFromString(output)
+    assert len(sae_msg.frame.frame_data) == 0
+    assert len(sae_msg.frame.frame_data_jpeg) == 0
+    assert sae_msg.frame.source_id == 'camera01'
+    assert sae_msg.frame.timestamp_utc_ms == 1234567890123
+    assert sae_msg.frame.shape.width == 1920
+    assert len(sae_msg.detections) == 10
+
+def test_no_frame_removal_passes_through(wire_writer):
+    wire_writer.config.remove_frame_data = False
+    input_bytes = _full_sae_msg().SerializeToString()
+
+    assert wire_writer.get(input_bytes) == input_bytes
+
+@pytest.mark.parametrize('input_bytes', [
+    _full_sae_msg().SerializeToString()[:1000],
+    b'\x0a\xff\xff\xff\xff\x0f',
+    b'\xff' * 11,
+])
+def test_truncated_input(input_bytes):
+    with pytest.raises(DecodeError):
+        strip_frame_data(input_bytes)
+
+@pytest.mark.parametrize('input_bytes', [
+    _full_sae_msg().SerializeToString(),
+    _frame_only_msg().SerializeToString(),
+    PositionMessage(type=MessageType.POSITION, timestamp_utc_ms=1).SerializeToString(),
+    b'',
+])
+def test_peek_message_type(input_bytes):
+    type_msg = TypeMessage()
+    type_msg.ParseFromString(input_bytes)
+
+    assert peek_message_type(input_bytes) == type_msg.type
+
+def test_peek_frame_timestamp():
+    assert peek_frame_timestamp(_full_sae_msg().SerializeToString()) == _full_sae_msg().frame.timestamp_utc_ms
+    assert peek_frame_timestamp(SaeMessage(type=MessageType.SAE).SerializeToString()) is None
+
+    # Concatenated messages are merged by the parser
+    sae_msg = SaeMessage()
+    sae_msg.frame.timestamp_utc_ms = 2
+    assert peek_frame_timestamp(_full_sae_msg().SerializeToString() + sae_msg.SerializeToString()) == 2
+
+def test_peek_sae_frame_timestamp():
+    assert peek_sae_frame_timestamp(_full_sae_msg().SerializeToString()) == _full_sae_msg().frame.timestamp_utc_ms
+    assert peek_sae_frame_timestamp(PositionMessage(type=MessageType.POSITION).SerializeToString()) is None
+    assert peek_sae_frame_timestamp(b'\xff\xff') is None
+
+def test_peek_sae_source_id():
+    assert peek_sae_source_id(_full_sae_msg().SerializeToString()) == _full_sae_msg().frame.source_id.encode('utf-8')
+    assert peek_sae_source_id(SaeMessage(type=MessageType.SAE).SerializeToString()) is None
+    assert peek_sae_source_id(PositionMessage(type=MessageType.POSITION).SerializeToString()) is None
+    assert peek_sae_source_id(b'\xff\xff') is None